@@ -0,0 +1,124 @@
+"""
+Benchmark: per-client connection pools (previous behaviour) vs. the shared adapter.
+
+Starts a local HTTPS keep-alive server with a throwaway self-signed certificate
+(needs the openssl binary) and has simulated users hit it from a thread pool.
+Reports TCP+TLS connections accepted by the server and request latency.
+
+    cd backend && python benchmarks/bench_http_pool.py [users] [requests_per_user]
+"""
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import edupage_internal
+from edupage_internal import EdupageClient
+
+BODY = b"x" * 2048
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accepted = 0
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        self.accepted += 1
+        return sock, addr
+
+
+def start_server(tmp):
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True
+    )
+    server = CountingServer(("127.0.0.1", 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, cert
+
+
+def run(server, url, cert, users, per_user, make_client):
+    """Each user makes per_user requests with its own (warm) client, 16 users at a time."""
+    latencies = []
+    lock = threading.Lock()
+    server.accepted = 0
+
+    def user_session(_):
+        client = make_client()
+        for _ in range(per_user):
+            start = time.perf_counter()
+            client.session.get(url, verify=cert).content
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        client.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(user_session, range(users)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "connections": server.accepted,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+        "total_s": elapsed,
+    }
+
+
+def per_client_pool():
+    """The previous behaviour: every client gets its own connection pool."""
+    client = EdupageClient()
+    adapter = HTTPAdapter()
+    client.session.mount("https://", adapter)
+    return client
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        server, cert = start_server(tmp)
+        url = f"https://localhost:{server.server_address[1]}/menu/"
+        print(f"{users} users x {per_user} requests, 16 concurrent")
+        for label, make_client in (("per-client pool", per_client_pool), ("shared pool", EdupageClient)):
+            result = run(server, url, cert, users, per_user, make_client)
+            print(f"{label:>16}: {result['connections']:5d} connections, "
+                  f"mean {result['mean_ms']:6.2f} ms, p95 {result['p95_ms']:6.2f} ms, total {result['total_s']:.2f} s")
+        print(f"pool stats: {edupage_internal.http_pool_stats()}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Micro-benchmark: session keeper ping via the full menu fetch vs. the liveness probe.
+
+Serves synthetic pages of realistic size through requests-mock and reports the bytes
+read from the (mocked) socket and the CPU time per ping. Then serves the same pages
+from a local keep-alive HTTP server and reports the new connections opened per ping:
+against Edupage each of those is a TCP + TLS handshake.
+
+    cd backend && python benchmarks/bench_liveness.py [iterations]
+"""
+import io
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests_mock
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from edupage_internal import EdupageClient
+
+SUBDOMAIN = "myschool"
+
+
+class CountingBytesIO(io.BytesIO):
+    """Body that records how many bytes the client actually read."""
+    def __init__(self, data: bytes, counter: list):
+        super().__init__(data)
+        self._counter = counter
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self._counter[0] += len(chunk)
+        return chunk
+
+    def readinto(self, b):
+        n = super().readinto(b)
+        self._counter[0] += n
+        return n
+
+
+def build_menu_page() -> bytes:
+    """Menu page: a week of lunches plus the rest of the school payload, like the real one."""
+    days = {}
+    for d in range(5, 12):
+        days[f"2026-01-{d:02d}"] = {
+            str(meal): {
+                "isCooking": True,
+                "evidencia": {"stav": "V", "obj": "A"},
+                "zmen_do": f"2026-01-{d - 1:02d}T14:00:00",
+                "rows": [{"menusStr": f"{n}: ", "nazov": f"Meal {d}-{meal}-{n} with a long description", "alergenyStr": "1, 3, 7"} for n in range(1, 6)],
+            }
+            for meal in (1, 2, 3)
+        }
+    days["addInfo"] = {"stravnikid": "12345"}
+    school = {
+        "novyListok": days,
+        "dbi": {"teachers": {str(i): {"firstname": "Name", "lastname": f"Teacher {i}", "short": f"T{i}"} for i in range(300)}},
+        "classes": {str(i): {"name": f"Class {i}", "students": list(range(30))} for i in range(60)},
+    }
+    # The real page embeds the JSON on a single line followed by ",\r\n"
+    blob = json.dumps({SUBDOMAIN: school})
+    head = "<html><head>" + "<link rel=stylesheet href=/a.css>" * 200 + "</head><body><script>\r\n$j(document).ready(function() {\r\nvar x = {\r\n"
+    return (head + "edupageData: " + blob + ",\r\nother: 1};\r\n});</script>" + "<div></div>" * 5000 + "</body></html>").encode()
+
+
+def build_user_page() -> bytes:
+    head = '<html><head><script>ASC.gsechash="0123abcd";</script>' + "<link rel=stylesheet href=/a.css>" * 100 + "</head>"
+    return (head + "<body>" + "<div class=item>news</div>" * 4000 + "</body></html>").encode()
+
+
+def run(label, fn, register, page: bytes, iterations: int):
+    counter = [0]
+    with requests_mock.Mocker() as m:
+        register(m, lambda request, context: CountingBytesIO(page, counter))
+        fn()  # warm-up
+        counter[0] = 0
+        start = time.process_time()
+        for _ in range(iterations):
+            fn()
+        cpu = time.process_time() - start
+    print(f"{label:<22} {counter[0] / iterations / 1024:>10.1f} KiB/ping {cpu / iterations * 1000:>10.3f} ms CPU/ping")
+
+
+def serve(pages: dict):
+    """Local keep-alive server for {path: page}; returns it and its list of accepted connections."""
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            page = pages[self.path.split("?")[0]]
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            pass  # clients dropping connections mid-response
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, connections
+
+
+def run_reconnects(label, fn, connections, iterations: int):
+    fn()  # warm-up: opens the first connection
+    connections.clear()
+    for _ in range(iterations):
+        fn()
+    print(f"{label:<22} {len(connections) / iterations:>10.2f} new connections/ping")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    client = EdupageClient()
+    client.subdomain = SUBDOMAIN
+    client.is_logged_in = True
+
+    menu_page = build_menu_page()
+    user_page = build_user_page()
+    print(f"menu page {len(menu_page) / 1024:.0f} KiB, user page {len(user_page) / 1024:.0f} KiB, {iterations} iterations")
+
+    run(
+        "full menu fetch",
+        lambda: client.get_meals_for_date(date(2026, 1, 7)),
+        lambda m, body: m.get(f"https://{SUBDOMAIN}.edupage.org/menu/", body=body),
+        menu_page, iterations,
+    )
+    run(
+        "liveness probe",
+        lambda: client.check_session_alive(),
+        lambda m, body: m.get(f"https://{SUBDOMAIN}.edupage.org/user/", body=body),
+        user_page, iterations,
+    )
+
+    server, connections = serve({"/menu/": menu_page, "/user/": user_page})
+
+    class LocalAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = request.url.replace(f"https://{SUBDOMAIN}.edupage.org", f"http://127.0.0.1:{server.server_port}")
+            return super().send(request, **kwargs)
+
+    client.session.mount("https://", LocalAdapter())
+    try:
+        run_reconnects("full menu fetch", lambda: client.get_meals_for_date(date(2026, 1, 7)), connections, iterations)
+        run_reconnects("liveness probe", lambda: client.check_session_alive(), connections, iterations)
+    finally:
+        client.session.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
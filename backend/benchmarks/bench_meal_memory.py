@@ -0,0 +1,128 @@
+"""
+Memory benchmark: what the lunch cache retains for 10k user-days (one school), with
+parsed meals as the previous nested dicts, as slotted Meal/MenuItem objects, and
+in LunchCache's layers (shared per-school menus + per-user MealStatus).
+
+The first two hold every meal in a plain dict; the LunchCache figure also includes
+the backend's LRU bookkeeping and the per-user week entries.
+
+Every simulated user parses the menu page again (as each user's fetch does), so
+strings are fresh objects per user unless the parser interns them.
+
+    cd backend && python benchmarks/bench_meal_memory.py [user_days]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import date, datetime
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import LunchCache
+from edupage_internal import EdupageClient
+from menu_extract import extract_edupage_value
+
+PAGE = Path(__file__).parent.parent / "tests" / "fixtures" / "menu_pages" / "crlf_week.html"
+SUBDOMAIN = "myschool"
+
+
+def legacy_parse(content: str) -> dict:
+    """The previous dict-based _parse_single_meal output, kept here as the baseline."""
+    novyListok = extract_edupage_value(content, [SUBDOMAIN, "novyListok"]) or {}
+    boarder_id = novyListok.get("addInfo", {}).get("stravnikid")
+    parsed_days = {}
+    for d_str, day_data in novyListok.items():
+        if not (len(d_str) == 10 and d_str[4] == '-' and d_str[7] == '-'):
+            continue
+        raw = day_data.get("2")
+        if not raw or raw.get("isCooking") is False:
+            continue
+        ordered = None
+        evidencia = raw.get("evidencia")
+        if evidencia:
+            status = evidencia.get("stav")
+            if status and status in "ABCDEFGH":
+                ordered = status
+            elif status == "V" or status == "E":
+                ordered = evidencia.get("obj")
+        can_change_str = raw.get("zmen_do")
+        menus = []
+        for row in raw.get("rows", []):
+            if not row: continue
+            menu_num = row.get("menusStr")
+            if menu_num:
+                menu_num = menu_num.replace(": ", "")
+            menus.append({"name": row.get("nazov"), "number": menu_num})
+        parsed_days[d_str] = {
+            "date": d_str,
+            "can_be_changed_until": datetime.fromisoformat(can_change_str) if can_change_str else None,
+            "ordered_meal": ordered,
+            "menus": menus,
+            "boarder_id": boarder_id,
+            "meal_index": "2",
+        }
+    return parsed_days
+
+
+def store_in_dict():
+    cache = {}
+
+    def store(user_id, days):
+        for d_str, meal in days.items():
+            cache[(user_id, d_str)] = meal
+    return cache, store
+
+
+def store_in_lunch_cache():
+    cache = LunchCache(max_entries=10_000_000)
+
+    def store(user_id, days):
+        cache.set_week(user_id, SUBDOMAIN, date.fromisoformat(min(days)), days)
+    return cache, store
+
+
+def measure(parse, make_store, content: str, user_days: int):
+    """Bytes retained by a cache holding `user_days` parsed entries."""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    cache, store = make_store()
+    stored = 0
+    user_id = 1
+    while stored < user_days:
+        days = parse(content)
+        days = dict(list(days.items())[:user_days - stored])
+        store(user_id, days)
+        stored += len(days)
+        user_id += 1
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained, user_id - 1
+
+
+def main():
+    user_days = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    content = PAGE.read_text(encoding="utf-8")
+
+    client = EdupageClient()
+    client.subdomain = SUBDOMAIN
+    client.is_logged_in = True
+
+    print(f"{user_days} cached user-days from {PAGE.name}")
+    results = {}
+    for label, parse, make_store in (
+        ("dict", legacy_parse, store_in_dict),
+        ("Meal", client._parse_menu_page, store_in_dict),
+        ("LunchCache", client._parse_menu_page, store_in_lunch_cache),
+    ):
+        retained, users = measure(parse, make_store, content, user_days)
+        results[label] = retained
+        print(f"{label:>10}: {retained / 1024 / 1024:7.2f} MiB total, {retained / user_days:7.0f} B/entry ({users} users)")
+    print(f"Meal vs dict: {1 - results['Meal'] / results['dict']:.0%} less")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Throughput benchmark: legacy split + full json.loads of edupageData vs. the targeted
+extractor in menu_extract, over the page corpus in tests/fixtures/menu_pages.
+
+    cd backend && python benchmarks/bench_menu_extract.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from menu_extract import extract_edupage_value
+
+CORPUS = Path(__file__).parent.parent / "tests" / "fixtures" / "menu_pages"
+SUBDOMAIN = "myschool"
+
+
+def legacy_extract(content: str):
+    """The previous get_meals_for_date parsing, kept here as the baseline."""
+    json_part = content.split("edupageData: ")[1]
+    if ",\r\n" in json_part:
+        json_part = json_part.split(",\r\n")[0]
+    elif ",\n" in json_part:
+        json_part = json_part.split(",\n")[0]
+    data = json.loads(json_part)
+    return data.get(SUBDOMAIN, {}).get("novyListok", {})
+
+
+def targeted_extract(content: str):
+    return extract_edupage_value(content, [SUBDOMAIN, "novyListok"])
+
+
+def measure(fn, content: str, iterations: int):
+    try:
+        fn(content)
+    except Exception as e:
+        return None, type(e).__name__
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(content)
+    elapsed = time.perf_counter() - start
+    return elapsed / iterations, None
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"{'page':<22} {'size':>9} {'legacy':>22} {'targeted':>22}")
+    for page in sorted(CORPUS.glob("*.html")):
+        content = page.read_text(encoding="utf-8")
+        if "edupageData" not in content:
+            continue
+        cells = []
+        for fn in (legacy_extract, targeted_extract):
+            per_call, error = measure(fn, content, iterations)
+            if error:
+                cells.append(f"fails ({error})")
+            else:
+                mb_per_s = len(content) / per_call / 1e6
+                cells.append(f"{per_call * 1e6:8.1f} us {mb_per_s:7.1f} MB/s")
+        print(f"{page.stem:<22} {len(content) / 1024:>7.1f}K {cells[0]:>22} {cells[1]:>22}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmark: bytes a listing sends per photo (original vs. WebP variants) and the
+time make_variants takes per upload.
+
+Sample images are synthetic phone-camera-like JPEGs (smooth gradients plus sensor
+noise, so they don't compress unrealistically well) at common upload sizes.
+
+    cd backend && python benchmarks/bench_photo_variants.py [rounds]
+"""
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageFilter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from photo_variants import VARIANT_SIZES, make_variants
+
+SAMPLES = {
+    "phone 12MP": (4032, 3024),
+    "phone 8MP": (3264, 2448),
+    "resized 1080p": (1920, 1080),
+}
+
+
+def sample_jpeg(width: int, height: int) -> bytes:
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(1))
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"variant sizes: {VARIANT_SIZES}, {rounds} rounds each")
+    for label, (width, height) in SAMPLES.items():
+        data = sample_jpeg(width, height)
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            variants = make_variants(io.BytesIO(data))
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        sizes = ", ".join(f"{name} {len(blob) / 1024:7.1f} KiB" for name, blob in variants.items())
+        print(f"{label:>14} {width}x{height}: original {len(data) / 1024:7.1f} KiB -> {sizes}; "
+              f"median {timings[len(timings) // 2] * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,588 @@
 """
-Simple in-memory cache with TTL for Edupage lunch data.
+Simple cache with TTL for Edupage lunch data.
 Reduces redundant calls to the external Edupage API.
+
+Entries live in a pluggable CacheBackend: process memory by default, or a
+SQLite file shared by all workers on the host (LUNCH_CACHE_BACKEND=sqlite),
+so invalidations after order/cancel are seen by every worker.
+
+Concurrent misses for the same (user, week) are coalesced: only one caller
+runs the upstream fetch, the others wait for its result (single-flight).
+
+Meals are stored in two layers: the menu of a day is stored once per school
+(subdomain) and shared by all of its users, next to a small per-user entry
+with the order state (see meals.MealStatus).
 """
+import abc
+import asyncio
+import json
+import os
+import sqlite3
+import threading
 import time
-from typing import Any, Optional
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
 
-class LunchCache:
-    def __init__(self, ttl_seconds: int = 60):
-        self._cache: dict[str, tuple[Any, float]] = {}
+from meals import DayMenu, Meal, MealStatus
+
+
+def week_start(day: date) -> date:
+    """Monday of the week containing the given day."""
+    return day - timedelta(days=day.weekday())
+
+
+class CacheBackend(abc.ABC):
+    """Storage for cache entries, keyed by (user_id, key)."""
+
+    # Whether calls block on I/O (file locks, fsync); LunchCache's async methods run them in a thread
+    blocking = False
+
+    @abc.abstractmethod
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        """Return the stored data, or None if missing or expired"""
+        pass
+
+    @abc.abstractmethod
+    def set(self, user_id: int, key: str, data: Any) -> None:
+        """Store data with the current timestamp"""
+        pass
+
+    def set_many(self, entries) -> None:
+        """Store several (user_id, key, data) entries at once"""
+        for user_id, key, data in entries:
+            self.set(user_id, key, data)
+
+    @abc.abstractmethod
+    def delete(self, user_id: int, key: str) -> None:
+        """Remove one entry"""
+        pass
+
+    @abc.abstractmethod
+    def clear_user(self, user_id: int) -> None:
+        """Remove all entries of a user"""
+        pass
+
+    @abc.abstractmethod
+    def generation(self, user_id: int) -> int:
+        """Invalidation counter of a user (see LunchCache single-flight)"""
+        pass
+
+    @abc.abstractmethod
+    def bump_generation(self, user_id: int) -> None:
+        """Increment the invalidation counter of a user"""
+        pass
+
+    @abc.abstractmethod
+    def stats(self) -> dict:
+        """Counters and size information"""
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    Bounded LRU cache with TTL in process memory. At most `max_entries` entries are
+    kept; the least recently used one is evicted when full. Expired entries are dropped
+    on read and by a sweep that runs at most every `sweep_interval_seconds`.
+    """
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 10000, sweep_interval_seconds: int = 30):
+        # key -> (data, stored_at), ordered from least to most recently used
+        self._cache: OrderedDict[tuple[int, str], tuple[Any, float]] = OrderedDict()
+        # user_id -> keys of that user, so per-user invalidation doesn't scan everything
+        self._user_keys: dict[int, set[tuple[int, str]]] = {}
+        self._generations: dict[int, int] = {}
+        self._lock = threading.RLock()
         self._ttl = ttl_seconds
-    
-    def _make_key(self, user_id: int, date_str: str) -> str:
-        return f"{user_id}:{date_str}"
-    
-    def get(self, user_id: int, date_str: str) -> Optional[Any]:
-        """Get cached data if it exists and is not expired."""
-        key = self._make_key(user_id, date_str)
-        if key in self._cache:
-            data, timestamp = self._cache[key]
-            if time.time() - timestamp < self._ttl:
-                return data
-            # Expired, remove it
-            del self._cache[key]
+        self._max_entries = max_entries
+        self._sweep_interval = sweep_interval_seconds
+        self._last_sweep = time.monotonic()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        cache_key = (user_id, key)
+        with self._lock:
+            self._maybe_sweep()
+            entry = self._cache.get(cache_key)
+            if entry is not None:
+                data, timestamp = entry
+                if time.monotonic() - timestamp < self._ttl:
+                    self._cache.move_to_end(cache_key)
+                    self._hits += 1
+                    return data
+                # Expired, remove it
+                self._remove(cache_key)
+                self._expirations += 1
+            self._misses += 1
+        return None
+
+    def set(self, user_id: int, key: str, data: Any) -> None:
+        cache_key = (user_id, key)
+        with self._lock:
+            self._maybe_sweep()
+            self._cache[cache_key] = (data, time.monotonic())
+            self._cache.move_to_end(cache_key)
+            self._user_keys.setdefault(user_id, set()).add(cache_key)
+            while len(self._cache) > self._max_entries:
+                oldest_key = next(iter(self._cache))
+                self._remove(oldest_key)
+                self._evictions += 1
+
+    def delete(self, user_id: int, key: str) -> None:
+        with self._lock:
+            self._remove((user_id, key))
+
+    def clear_user(self, user_id: int) -> None:
+        with self._lock:
+            for cache_key in list(self._user_keys.get(user_id, ())):
+                self._remove(cache_key)
+
+    def generation(self, user_id: int) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def bump_generation(self, user_id: int) -> None:
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def sweep_expired(self) -> int:
+        """Drop every expired entry. Returns the number of entries removed."""
+        with self._lock:
+            now = time.monotonic()
+            self._last_sweep = now
+            expired = [k for k, (_, timestamp) in self._cache.items() if now - timestamp >= self._ttl]
+            for cache_key in expired:
+                self._remove(cache_key)
+            self._expirations += len(expired)
+            return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._cache),
+                "max_entries": self._max_entries,
+                "users": len(self._user_keys),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep >= self._sweep_interval:
+            self.sweep_expired()
+
+    def _remove(self, cache_key: tuple[int, str]) -> None:
+        """Remove one entry and its index reference. Caller holds the lock."""
+        if self._cache.pop(cache_key, None) is None:
+            return
+        user_id = cache_key[0]
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+# Tag -> type of the meal objects stored in the JSON encoded backends
+_CACHED_TYPES = {"__meal__": Meal, "__day_menu__": DayMenu, "__meal_status__": MealStatus}
+_TYPE_TAGS = {cls: tag for tag, cls in _CACHED_TYPES.items()}
+
+
+def _encode_value(value):
+    tag = _TYPE_TAGS.get(type(value))
+    if tag is not None:
+        return {tag: value.to_dict()}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+def _decode_object(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        for tag, cls in _CACHED_TYPES.items():
+            if tag in obj:
+                return cls.from_dict(obj[tag])
+    return obj
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Cache stored in a SQLite file shared by every worker process on the host.
+    Entries are JSON encoded; TTL uses wall-clock time since it is compared across
+    processes. When above `max_entries`, the sweep drops the oldest entries.
+    Calls block (lock waits, disk writes): async code goes through LunchCache's
+    async methods, which run them in a thread.
+    """
+    blocking = True
+
+    def __init__(self, path: str, ttl_seconds: int = 60, max_entries: int = 10000, sweep_interval_seconds: int = 30):
+        self._path = path
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._sweep_interval = sweep_interval_seconds
+        self._last_sweep = time.monotonic()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lunch_cache ("
+            " user_id INTEGER NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, stored_at REAL NOT NULL,"
+            " PRIMARY KEY (user_id, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_lunch_cache_stored_at ON lunch_cache (stored_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lunch_cache_generations ("
+            " user_id INTEGER PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections must not be shared between threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5)
+            # WAL stays consistent without an fsync per commit; a crash may only lose recent entries
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        self._maybe_sweep()
+        row = self._conn().execute(
+            "SELECT data, stored_at FROM lunch_cache WHERE user_id = ? AND key = ?", (user_id, key)
+        ).fetchone()
+        with self._lock:
+            if row is not None and time.time() - row[1] < self._ttl:
+                self._hits += 1
+                return json.loads(row[0], object_hook=_decode_object)
+            self._misses += 1
         return None
+
+    def set(self, user_id: int, key: str, data: Any) -> None:
+        self._maybe_sweep()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO lunch_cache (user_id, key, data, stored_at) VALUES (?, ?, ?, ?)",
+            (user_id, key, json.dumps(data, default=_encode_value), time.time())
+        )
+        conn.commit()
+
+    def set_many(self, entries) -> None:
+        """All entries in one transaction (one commit)."""
+        self._maybe_sweep()
+        stored_at = time.time()
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO lunch_cache (user_id, key, data, stored_at) VALUES (?, ?, ?, ?)",
+            [(user_id, key, json.dumps(data, default=_encode_value), stored_at) for user_id, key, data in entries]
+        )
+        conn.commit()
+
+    def delete(self, user_id: int, key: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM lunch_cache WHERE user_id = ? AND key = ?", (user_id, key))
+        conn.commit()
+
+    def clear_user(self, user_id: int) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM lunch_cache WHERE user_id = ?", (user_id,))
+        conn.commit()
+
+    def generation(self, user_id: int) -> int:
+        row = self._conn().execute(
+            "SELECT generation FROM lunch_cache_generations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_generation(self, user_id: int) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO lunch_cache_generations (user_id, generation) VALUES (?, 1)"
+            " ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1",
+            (user_id,)
+        )
+        conn.commit()
+
+    def sweep_expired(self) -> int:
+        """Drop expired entries and trim to max_entries. Returns the number of entries removed."""
+        self._last_sweep = time.monotonic()
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM lunch_cache WHERE stored_at <= ?", (time.time() - self._ttl,)).rowcount
+        evicted = conn.execute(
+            "DELETE FROM lunch_cache WHERE rowid IN ("
+            " SELECT rowid FROM lunch_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self._max_entries,)
+        ).rowcount
+        conn.commit()
+        with self._lock:
+            self._expirations += expired
+            self._evictions += evicted
+        return expired + evicted
+
+    def stats(self) -> dict:
+        entries, users = self._conn().execute(
+            "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM lunch_cache"
+        ).fetchone()
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "entries": entries,
+                "max_entries": self._max_entries,
+                "users": users,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+    def _maybe_sweep(self) -> None:
+        if time.monotonic() - self._last_sweep >= self._sweep_interval:
+            self.sweep_expired()
+
+
+class _Flight:
+    """An in-progress week load, shared by every caller that missed the same key."""
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def async_waiter(self) -> asyncio.Future:
+        """Future (on the running loop) resolved when the load finishes."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.done.is_set():
+                future.set_result(None)
+            else:
+                self._async_waiters.append((loop, future))
+        return future
+
+    def finish(self, result=None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.done.set()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve_waiter, future)
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve_waiter(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+# Backend owner id of the school-wide menu entries (user ids start at 1)
+SHARED_OWNER = 0
+
+
+class LunchCache:
+    """
+    Lunch data cache on top of a CacheBackend, with week helpers and single-flight
+    loading. ttl_seconds, max_entries and sweep_interval_seconds configure the
+    default in-memory backend when no backend is given.
+
+    Per user, only MealStatus entries are kept (per day and per week); the menus
+    are shared per (subdomain, day) under SHARED_OWNER. A user's invalidation
+    only drops their own entries.
+    """
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 10000, sweep_interval_seconds: int = 30,
+                 backend: Optional[CacheBackend] = None):
+        self._backend = backend or MemoryCacheBackend(ttl_seconds, max_entries, sweep_interval_seconds)
+        # Single-flight state: (user_id, week monday) -> running load
+        self._flights: dict[tuple[int, date], _Flight] = {}
+        self._flights_lock = threading.Lock()
     
-    def set(self, user_id: int, date_str: str, data: Any) -> None:
-        """Store data in cache with current timestamp."""
-        key = self._make_key(user_id, date_str)
-        self._cache[key] = (data, time.time())
+    def get(self, user_id: int, date_str: str) -> Optional[Meal]:
+        """Get the user's meal of a day if both of its layers are cached and not expired."""
+        status = self._backend.get(user_id, date_str)
+        if status is None:
+            return None
+        return self._compose(date_str, status)
     
-    def invalidate(self, user_id: int, date_str: str) -> None:
-        """Remove specific entry from cache."""
-        key = self._make_key(user_id, date_str)
-        self._cache.pop(key, None)
+    def set(self, user_id: int, subdomain: str, date_str: str, meal: Meal) -> None:
+        """Store a meal: its menu in the school-wide layer, its order state for the user."""
+        menu, status = meal.split(subdomain)
+        self._backend.set(SHARED_OWNER, self._menu_key(subdomain, date_str), menu)
+        self._backend.set(user_id, date_str, status)
+
+    async def _call(self, fn, *args):
+        """Run a cache operation from async code, in a thread if the backend blocks."""
+        if self._backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def aget(self, user_id: int, date_str: str) -> Optional[Meal]:
+        """get for async callers."""
+        return await self._call(self.get, user_id, date_str)
+
+    async def aget_week(self, user_id: int, target_date: date) -> Optional[dict]:
+        """get_week for async callers."""
+        return await self._call(self.get_week, user_id, target_date)
+
+    async def ainvalidate(self, user_id: int, date_str: str) -> None:
+        """invalidate for async callers."""
+        await self._call(self.invalidate, user_id, date_str)
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and current size of the backend."""
+        return self._backend.stats()
     
+    def get_week(self, user_id: int, target_date: date) -> Optional[dict]:
+        """Get the cached week fetch ({ date_str: Meal }) containing target_date."""
+        statuses = self._backend.get(user_id, self._week_key(target_date))
+        if statuses is None:
+            return None
+        week_data = {}
+        for d_str, status in statuses.items():
+            meal = self._compose(d_str, status)
+            if meal is None:
+                return None
+            week_data[d_str] = meal
+        return week_data
+
+    def set_week(self, user_id: int, subdomain: str, target_date: date, week_data: dict) -> None:
+        """Store a whole week fetch, plus every day in it for single-day lookups."""
+        statuses = {}
+        entries = []
+        for d_str, meal in week_data.items():
+            menu, statuses[d_str] = meal.split(subdomain)
+            entries.append((SHARED_OWNER, self._menu_key(subdomain, d_str), menu))
+            entries.append((user_id, d_str, statuses[d_str]))
+        entries.append((user_id, self._week_key(target_date), statuses))
+        self._backend.set_many(entries)
+
+    def _compose(self, date_str: str, status: MealStatus) -> Optional[Meal]:
+        # The shared menu may have expired or been evicted on its own; that is a miss
+        menu = self._backend.get(SHARED_OWNER, self._menu_key(status.subdomain, date_str))
+        if menu is None:
+            return None
+        return Meal.compose(menu, status)
+
+    def load_week(self, user_id: int, subdomain: str, target_date: date, loader: Callable[[], dict]) -> dict:
+        """
+        Return the cached week containing target_date, or call loader() to fetch it.
+        Concurrent (threaded) misses for the same user and week share one loader() call.
+        """
+        week_data = self.get_week(user_id, target_date)
+        if week_data is not None:
+            return week_data
+
+        flight, is_leader = self._join_flight(user_id, target_date)
+        if not is_leader:
+            flight.done.wait()
+            return flight.outcome()
+
+        try:
+            # Re-check: a flight may have completed between the miss above and joining
+            week_data = self.get_week(user_id, target_date)
+            if week_data is None:
+                week_data = loader()
+        except BaseException as e:
+            self._end_flight(user_id, subdomain, target_date, flight, error=e)
+            raise
+        self._end_flight(user_id, subdomain, target_date, flight, result=week_data)
+        return week_data
+
+    async def aload_week(self, user_id: int, subdomain: str, target_date: date,
+                         loader: Callable[[], Awaitable[dict]]) -> dict:
+        """
+        Async variant of load_week; coalesces with both async and threaded callers.
+        Backend calls run off the event loop when the backend blocks.
+        """
+        week_data = await self.aget_week(user_id, target_date)
+        if week_data is not None:
+            return week_data
+
+        flight, is_leader = await self._call(self._join_flight, user_id, target_date)
+        if not is_leader:
+            await flight.async_waiter()
+            return flight.outcome()
+
+        try:
+            # Re-check: a flight may have completed between the miss above and joining
+            week_data = await self.aget_week(user_id, target_date)
+            if week_data is None:
+                week_data = await loader()
+        except BaseException as e:
+            # No backend I/O on the error path
+            self._end_flight(user_id, subdomain, target_date, flight, error=e)
+            raise
+        await self._call(self._end_flight, user_id, subdomain, target_date, flight, week_data)
+        return week_data
+
+    def _join_flight(self, user_id: int, target_date: date) -> tuple[_Flight, bool]:
+        """Return (flight, is_leader); the leader is the caller that must run the load."""
+        key = (user_id, week_start(target_date))
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = _Flight(self._backend.generation(user_id))
+            self._flights[key] = flight
+            return flight, True
+
+    def _end_flight(self, user_id: int, subdomain: str, target_date: date, flight: _Flight,
+                    result=None, error=None) -> None:
+        key = (user_id, week_start(target_date))
+        with self._flights_lock:
+            self._flights.pop(key, None)
+        # Bumped by invalidations (in any worker) while the load was running
+        if error is None and flight.generation == self._backend.generation(user_id):
+            self.set_week(user_id, subdomain, target_date, result)
+        flight.finish(result, error)
+
+    def invalidate(self, user_id: int, date_str: str) -> None:
+        """Remove specific entry from cache, including the week it belongs to."""
+        self._backend.bump_generation(user_id)
+        self._backend.delete(user_id, date_str)
+        try:
+            day = date.fromisoformat(date_str)
+        except ValueError:
+            return
+        self._backend.delete(user_id, self._week_key(day))
+
+    def _week_key(self, target_date: date) -> str:
+        return f"week:{week_start(target_date).isoformat()}"
+
+    def _menu_key(self, subdomain: str, date_str: str) -> str:
+        return f"menu:{subdomain}:{date_str}"
+
     def clear_user(self, user_id: int) -> None:
         """Clear all cache entries for a specific user."""
-        keys_to_remove = [k for k in self._cache if k.startswith(f"{user_id}:")]
-        for k in keys_to_remove:
-            del self._cache[k]
+        self._backend.bump_generation(user_id)
+        self._backend.clear_user(user_id)
+
+
+def get_cache_backend() -> CacheBackend:
+    ttl_seconds = int(os.getenv("LUNCH_CACHE_TTL_SECONDS", "60"))
+    max_entries = int(os.getenv("LUNCH_CACHE_MAX_ENTRIES", "10000"))
+    backend_type = os.getenv("LUNCH_CACHE_BACKEND", "memory").lower()
+    if backend_type == "sqlite":
+        path = os.getenv("LUNCH_CACHE_SQLITE_PATH", "lunch_cache.sqlite3")
+        return SQLiteCacheBackend(path, ttl_seconds=ttl_seconds, max_entries=max_entries)
+    return MemoryCacheBackend(ttl_seconds=ttl_seconds, max_entries=max_entries)
 
 # Global cache instance
-lunch_cache = LunchCache(ttl_seconds=60)
+lunch_cache = LunchCache(backend=get_cache_backend())
@@ -0,0 +1,104 @@
+"""
+Content-addressed photo objects.
+
+An upload is hashed (SHA-256) while it is copied off the request, and stored
+under "<hash><ext>". Identical bytes map to the same object, so it's written
+only once, and a name never changes content, so it can be cached forever.
+stored_objects counts the photos referencing each object. A photo's variants
+are named after its object (photo_variants.variant_filename), so they are
+shared and counted along with it.
+
+When the last reference goes, the object and its variants are queued in the
+deletion outbox with object_key set. The drain re-checks the count (under a
+row lock on Postgres) and skips the delete if the object was uploaded again
+in the meantime. Rows stay at 0 rather than being deleted, so that check
+always has a row to lock.
+"""
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from sqlalchemy import select, update
+
+from database import dialect_insert
+from models import Photo, StoredObject
+from photo_variants import VARIANT_COLUMNS, variant_filename
+from storage_outbox import enqueue_deletions
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def spool_and_hash(file_obj):
+    """
+    Copy an upload to a local temp file, hashing it on the way (one pass, bounded memory).
+    Returns (hex digest, temp file path); the caller removes the file.
+    """
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(prefix="photo_", delete=False) as copy:
+        for chunk in iter(lambda: file_obj.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            copy.write(chunk)
+    return digest.hexdigest(), copy.name
+
+
+def object_key(digest: str, filename: str, content_type: str = None) -> str:
+    """Storage name of an upload: its hash plus the original's extension (for content types)."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if not ext or len(ext) > 6 or not ext[1:].isalnum():
+        ext = mimetypes.guess_extension(content_type or "") or ""
+    return f"{digest}{ext}"
+
+
+def store_file(storage, local_path: str, key: str) -> str:
+    with open(local_path, "rb") as source:
+        return storage.save(source, key)
+
+
+async def acquire_object(db, key: str) -> int:
+    """Count one more reference to key and return the new count (1: the object must be stored). Doesn't commit."""
+    insert = dialect_insert(db)
+    stmt = insert(StoredObject).values(key=key, refcount=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StoredObject.key],
+        set_={"refcount": StoredObject.refcount + 1},
+    ).returning(StoredObject.refcount)
+    return (await db.execute(stmt)).scalar_one()
+
+
+async def shared_variants(db, key: str) -> dict:
+    """Variant columns of another photo of the same object, if its variants are done."""
+    columns = [getattr(Photo, column) for column in VARIANT_COLUMNS.values()]
+    row = (await db.execute(
+        select(*columns).where(Photo.photo_path == key, columns[0].is_not(None)).limit(1)
+    )).first()
+    return dict(zip(VARIANT_COLUMNS.values(), row)) if row else {}
+
+
+async def release_photo(db, photo) -> None:
+    """
+    Drop a photo's reference to its object and queue the files once unreferenced.
+    Doesn't commit: call it in the transaction that deletes the photo.
+    """
+    refcount = (await db.execute(
+        update(StoredObject)
+        .where(StoredObject.key == photo.photo_path)
+        .values(refcount=StoredObject.refcount - 1)
+        .returning(StoredObject.refcount)
+    )).scalar_one_or_none()
+    if refcount is None:
+        # Uploaded before content addressing (uuid_name): files belong to this photo alone
+        enqueue_deletions(db, [photo.photo_path, photo.thumbnail_path, photo.large_path])
+    elif refcount <= 0:
+        paths = [photo.photo_path] + [variant_filename(photo.photo_path, v) for v in VARIANT_COLUMNS]
+        enqueue_deletions(db, paths, object_key=photo.photo_path)
+
+
+def remove_local(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
@@ -1,5 +1,6 @@
 
 import json
+import os
 import base64
 import functools
 import urllib.parse
@@ -7,7 +8,13 @@ from dataclasses import dataclass
 from datetime import date, datetime
 from typing import Optional, List, Dict
 from enum import Enum
+import threading
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+import httpx
+from menu_extract import MARKER, ExtractionError, extract_edupage_value
+from meals import Meal, MenuItem
 
 # --- Exceptions ---
 class EdupageException(Exception): pass
@@ -17,68 +24,48 @@ class BadCredentialsException(EdupageException): pass
 class InvalidMealsData(EdupageException): pass
 class FailedToChangeMealError(EdupageException): pass
 
-# --- Core Edupage Class ---
-class EdupageClient:
-    def __init__(self, request_timeout=5):
-        self.session = requests.Session()
-        self.session.request = functools.partial(self.session.request, timeout=request_timeout)
+# --- Shared parsing / state ---
+class _EdupageBase:
+    """
+    State and response parsing shared by the sync and async clients.
+    Subclasses only implement the network round trips.
+    """
+    def __init__(self):
         self.subdomain = None
         self.username = None
         self.gsec_hash = None
         self.is_logged_in = False
         self.data = {} # Holds user data from login
 
-    def login(self, username, password, subdomain):
-        # Initial request to get CSRF token
-        url_login = f"https://{subdomain}.edupage.org/login/?cmd=MainLogin"
-        try:
-            resp = self.session.get(url_login)
-            if resp.status_code != 200:
-                raise BadCredentialsException("Failed to access login page")
-            
-            content = resp.text
-            if '"csrftoken":"' not in content:
-                 # Ensure we have a valid session or subdomain. Sometimes redirect happens.
-                 pass
-
-            # Extract CSRF
-            try:
-                csrf_token = content.split('"csrftoken":"')[1].split('"')[0]
-            except IndexError:
-                 # Fallback/Error
-                 raise BadCredentialsException("Could not extract CSRF token")
+    @staticmethod
+    def _extract_csrf_token(content):
+        if '"csrftoken":"' not in content:
+             # Ensure we have a valid session or subdomain. Sometimes redirect happens.
+             pass
 
-            # Login POST
-            post_url = f"https://{subdomain}.edupage.org/login/edubarLogin.php"
-            params = {
-                "csrfauth": csrf_token,
-                "username": username,
-                "password": password
-            }
-            resp_post = self.session.post(post_url, data=params)
-            
-            if "bad=1" in resp_post.url:
-                 raise BadCredentialsException("Invalid credentials")
+        # Extract CSRF
+        try:
+            return content.split('"csrftoken":"')[1].split('"')[0]
+        except IndexError:
+             # Fallback/Error
+             raise BadCredentialsException("Could not extract CSRF token")
 
-            # Update internal state
-            resp_content = resp_post.text
-            
-            # If subdomain was login1, update it
-            if subdomain == "login1":
-                try:
-                    subdomain = resp_content.split("-->")[0].split(" ")[-1]
-                except:
-                    pass
-            
-            self.subdomain = subdomain
-            self.username = username
-            
-            # Parse user data and gsec_hash
-            self._parse_login_data(resp_content)
+    def _finish_login(self, resp_url, resp_content, username, subdomain):
+        if "bad=1" in resp_url:
+             raise BadCredentialsException("Invalid credentials")
 
-        except Exception as e:
-            print(f"Login error: {e}")
-            raise BadCredentialsException(f"Login failed: {e}")
+        # If subdomain was login1, update it
+        if subdomain == "login1":
+            try:
+                subdomain = resp_content.split("-->")[0].split(" ")[-1]
+            except:
+                pass
+        
+        self.subdomain = subdomain
+        self.username = username
+        
+        # Parse user data and gsec_hash
+        self._parse_login_data(resp_content)
 
     def _parse_login_data(self, html_content):
         # Extract userhome json
@@ -96,47 +83,30 @@ class EdupageClient:
              # If we can't parse, we might not be fully logged in or page changed
              pass
 
-    def get_meals_for_date(self, target_date: date):
-        """
-        Optimized fetch. 
-        Instead of just fetching one day, we fetch the week view (standard edupage behavior)
-        and return a dictionary of { date_str: MealObject }.
-        """
+    def _menu_url(self, target_date: date):
         if not self.is_logged_in:
              raise NotLoggedInException()
 
         date_str = target_date.strftime("%Y%m%d")
-        url = f"https://{self.subdomain}.edupage.org/menu/?date={date_str}"
-        
-        resp = self.session.get(url)
-        content = resp.text
-        
-        if "edupageData: " not in content:
+        return f"https://{self.subdomain}.edupage.org/menu/?date={date_str}"
+
+    def _parse_menu_page(self, content):
+        """
+        Parse the menu page HTML into { date_str: Meal } for every day it contains.
+        """
+        if MARKER not in content:
              raise SessionExpiredException("Invalid response (no edupageData)")
 
-        # Parse the JSON data embedded in HTML
+        # Decode only <subdomain>.novyListok out of the embedded edupageData object
         try:
-            # logic from original: response.split("edupageData: ")[1].split(",\r\n")[0]
-            # using more robust generic split if possible
-            json_part = content.split("edupageData: ")[1]
-            # find end of json object. usually it ends with , followed by newline or similar.
-            # but splitting by ",\r\n" is risky if minified.
-            # Original code used: .split(",\r\n")[0]
-            # Let's try to match original logic but be safe
-            if ",\r\n" in json_part:
-                json_part = json_part.split(",\r\n")[0]
-            elif ",\n" in json_part:
-                json_part = json_part.split(",\n")[0]
-            
-            data = json.loads(json_part)
-        except Exception as e:
+            novyListok = extract_edupage_value(content, [self.subdomain, "novyListok"])
+        except ExtractionError as e:
             raise SessionExpiredException(f"Failed to parse edupageData: {e}")
 
-        # Drill down
-        school_data = data.get(self.subdomain, {})
+        if novyListok is None:
+            novyListok = {}
         
         try:
-             novyListok = school_data.get("novyListok", {})
              boarder_id = novyListok.get("addInfo", {}).get("stravnikid")
              if not boarder_id:
                  # Try to find boarder id elsewhere or fail?
@@ -204,52 +174,37 @@ class EdupageClient:
             if menu_num:
                 menu_num = menu_num.replace(": ", "")
             
-            # Simple menu object
-            menus.append({
-                "name": name,
-                "number": menu_num, # "1", "2" or None
-            })
+            menus.append(MenuItem.create(name, menu_num)) # number: "1", "2" or None
 
-        return {
-            "date": date_str,
-            "can_be_changed_until": can_change,
-            "ordered_meal": ordered_meal_status, # "A", "B", etc.
-            "menus": menus,
+        return Meal.create(
+            date=date_str,
+            can_be_changed_until=can_change,
+            ordered_meal=ordered_meal_status, # "A", "B", etc.
+            menus=menus,
             # We need these for actions (ordering/canceling)
-            "boarder_id": boarder_id,
-            "meal_index": meal_index
-        }
+            boarder_id=boarder_id,
+            meal_index=meal_index
+        )
 
-    def order(self, meal_data, letter_choice):
-        """
-        meal_data: dict returned from _parse_single_meal
-        letter_choice: "A", "B", etc.
-        """
-        return self._send_change_request(meal_data, letter_choice)
-
-    def cancel(self, meal_data):
-        return self._send_change_request(meal_data, "AX")
-
-    def _send_change_request(self, meal_data, choice_str):
+    def _change_request_payload(self, meal_data, choice_str):
         if not self.is_logged_in:
              raise NotLoggedInException()
-             
-        url = f"https://{self.subdomain}.edupage.org/menu/"
         
         boarder_menu = {
-            "stravnikid": meal_data["boarder_id"],
-            "mysqlDate": meal_data["date"],
-            "jids": {meal_data["meal_index"]: choice_str},
+            "stravnikid": meal_data.boarder_id,
+            "mysqlDate": meal_data.date,
+            "jids": {meal_data.meal_index: choice_str},
             "view": "pc_listok",
             "pravo": "Student"
         }
         
-        payload = {
+        return {
             "akcia": "ulozJedlaStravnika",
             "jedlaStravnika": json.dumps(boarder_menu)
         }
-        
-        resp = self.session.post(url, data=payload)
+
+    @staticmethod
+    def _check_change_response(resp):
         try:
             res_json = resp.json()
             if res_json.get("error") != "":
@@ -259,3 +214,283 @@ class EdupageClient:
              pass
         return True
 
+
+# --- Liveness probe ---
+LIVENESS_PROBE_PATH = "/user/"
+LIVENESS_PROBE_MAX_BYTES = 64 * 1024
+LIVENESS_PROBE_CHUNK_BYTES = 4 * 1024
+# Unread rest of the probed page still worth downloading to keep the pooled connection:
+# closing a partly read response closes its socket, so the next ping reconnects (TLS)
+LIVENESS_PROBE_DRAIN_MAX_BYTES = 256 * 1024
+# Present near the top of pages rendered for a logged-in user
+_LOGGED_IN_MARKERS = ('ASC.gsechash="', "userhome(", "edupageData")
+# Present on the login page shown to expired sessions
+_LOGGED_OUT_MARKERS = ("edubarLogin", "cmd=MainLogin", "login_form")
+
+def _classify_liveness_page(head: str) -> Optional[bool]:
+    if any(marker in head for marker in _LOGGED_IN_MARKERS):
+        return True
+    if any(marker in head for marker in _LOGGED_OUT_MARKERS):
+        return False
+    return None
+
+def _release_probe_response(resp):
+    """
+    Return the probe's connection to the pool by reading the rest of the body, when that
+    rest is at most LIVENESS_PROBE_DRAIN_MAX_BYTES. Larger (or broken) responses are
+    closed instead, which drops their connection.
+    """
+    try:
+        length = resp.headers.get("Content-Length")
+        # tell(): raw (still compressed) bytes read so far, as counted by Content-Length
+        if length is None or int(length) - resp.raw.tell() <= LIVENESS_PROBE_DRAIN_MAX_BYTES:
+            drained = 0
+            while drained <= LIVENESS_PROBE_DRAIN_MAX_BYTES:
+                chunk = resp.raw.read(LIVENESS_PROBE_CHUNK_BYTES, decode_content=True)
+                if not chunk:
+                    # Fully read: urllib3 has put the connection back into the pool
+                    break
+                drained += len(chunk)
+    except (requests.RequestException, OSError, ValueError, urllib3.exceptions.HTTPError):
+        pass
+    resp.close()
+
+
+# --- Shared connection pool ---
+# One adapter (urllib3 PoolManager) mounted into every EdupageClient session, so users
+# of the same school reuse connections to <subdomain>.edupage.org; cookies stay per session.
+# The PoolManager keeps one pool per host: up to EDUPAGE_POOL_HOSTS hosts, each keeping
+# up to EDUPAGE_POOL_MAXSIZE idle connections.
+SYNC_POOL_HOSTS = int(os.getenv("EDUPAGE_POOL_HOSTS", "100"))
+SYNC_POOL_MAXSIZE = int(os.getenv("EDUPAGE_POOL_MAXSIZE", "10"))
+
+_shared_adapter: Optional[HTTPAdapter] = None
+_shared_adapter_lock = threading.Lock()
+
+def get_shared_adapter() -> HTTPAdapter:
+    """Return the process-wide HTTP adapter used by all EdupageClients."""
+    global _shared_adapter
+    with _shared_adapter_lock:
+        if _shared_adapter is None:
+            _shared_adapter = HTTPAdapter(pool_connections=SYNC_POOL_HOSTS, pool_maxsize=SYNC_POOL_MAXSIZE)
+        return _shared_adapter
+
+def close_shared_adapter():
+    """Close every pooled connection (on application shutdown)."""
+    global _shared_adapter
+    with _shared_adapter_lock:
+        if _shared_adapter is not None:
+            _shared_adapter.close()
+            _shared_adapter = None
+
+def http_pool_stats() -> dict:
+    """Per-host connection counts of the shared pool."""
+    adapter = _shared_adapter
+    hosts = {}
+    if adapter is not None:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[pool.host] = {
+                "opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+    return {"max_hosts": SYNC_POOL_HOSTS, "max_idle_per_host": SYNC_POOL_MAXSIZE, "hosts": hosts}
+
+
+# --- Core Edupage Class ---
+class EdupageClient(_EdupageBase):
+    def __init__(self, request_timeout=5):
+        super().__init__()
+        self.session = requests.Session()
+        self._shared_adapter = get_shared_adapter()
+        self.session.mount("https://", self._shared_adapter)
+        self.session.mount("http://", self._shared_adapter)
+        self.session.request = functools.partial(self.session.request, timeout=request_timeout)
+
+    def close(self):
+        """Release this client's session. The shared pool stays open for other clients."""
+        for prefix, adapter in list(self.session.adapters.items()):
+            if adapter is self._shared_adapter:
+                del self.session.adapters[prefix]
+        self.session.close()
+
+    def login(self, username, password, subdomain):
+        # Initial request to get CSRF token
+        url_login = f"https://{subdomain}.edupage.org/login/?cmd=MainLogin"
+        try:
+            resp = self.session.get(url_login)
+            if resp.status_code != 200:
+                raise BadCredentialsException("Failed to access login page")
+            
+            csrf_token = self._extract_csrf_token(resp.text)
+
+            # Login POST
+            post_url = f"https://{subdomain}.edupage.org/login/edubarLogin.php"
+            params = {
+                "csrfauth": csrf_token,
+                "username": username,
+                "password": password
+            }
+            resp_post = self.session.post(post_url, data=params)
+            self._finish_login(resp_post.url, resp_post.text, username, subdomain)
+
+        except Exception as e:
+            print(f"Login error: {e}")
+            raise BadCredentialsException(f"Login failed: {e}")
+
+    def get_meals_for_date(self, target_date: date):
+        """
+        Optimized fetch. 
+        Instead of just fetching one day, we fetch the week view (standard edupage behavior)
+        and return a dictionary of { date_str: Meal }.
+        """
+        resp = self.session.get(self._menu_url(target_date))
+        return self._parse_menu_page(resp.text)
+
+    def check_session_alive(self) -> Optional[bool]:
+        """
+        Cheap liveness check for the session cookie.
+        Requests the user landing page without following redirects and inspects it only
+        until a logged-in/login marker appears (at most LIVENESS_PROBE_MAX_BYTES), instead
+        of downloading and parsing the whole menu page.
+        Returns True (alive), False (expired) or None when the response is inconclusive,
+        in which case callers should fall back to get_meals_for_date. Only a redirect to
+        the login page or a 401/403 counts as expired: a login marker in the body is
+        reported as None, so the caller confirms it before clearing the session.
+        The rest of a small page is then drained unparsed, so the connection stays pooled.
+        """
+        if not self.is_logged_in:
+             raise NotLoggedInException()
+
+        url = f"https://{self.subdomain}.edupage.org{LIVENESS_PROBE_PATH}"
+        resp = self.session.get(url, allow_redirects=False, stream=True)
+        try:
+            if resp.is_redirect:
+                # Expired sessions are sent to the login page
+                location = resp.headers.get("Location", "").lower()
+                return False if "login" in location else None
+            if resp.status_code in (401, 403):
+                return False
+            if resp.status_code != 200:
+                return None
+            # Markers sit near the top of the page: stop reading as soon as one shows up
+            head = b""
+            for chunk in resp.raw.stream(LIVENESS_PROBE_CHUNK_BYTES, decode_content=True):
+                head += chunk
+                verdict = _classify_liveness_page(head.decode("utf-8", errors="replace"))
+                if verdict is False:
+                    # Login markers also show up in widgets of normal pages: not conclusive
+                    return None
+                if verdict is not None or len(head) >= LIVENESS_PROBE_MAX_BYTES:
+                    return verdict
+            return None
+        finally:
+            _release_probe_response(resp)
+
+    def order(self, meal_data, letter_choice):
+        """
+        meal_data: Meal returned from _parse_single_meal
+        letter_choice: "A", "B", etc.
+        """
+        return self._send_change_request(meal_data, letter_choice)
+
+    def cancel(self, meal_data):
+        return self._send_change_request(meal_data, "AX")
+
+    def _send_change_request(self, meal_data, choice_str):
+        payload = self._change_request_payload(meal_data, choice_str)
+        url = f"https://{self.subdomain}.edupage.org/menu/"
+        resp = self.session.post(url, data=payload)
+        return self._check_change_response(resp)
+
+
+# --- Async Edupage Class ---
+# One connection pool shared by every async client; cookies stay per client.
+ASYNC_POOL_MAX_CONNECTIONS = int(os.getenv("EDUPAGE_ASYNC_MAX_CONNECTIONS", "100"))
+ASYNC_POOL_MAX_KEEPALIVE = int(os.getenv("EDUPAGE_ASYNC_MAX_KEEPALIVE", "20"))
+
+_async_transport: Optional[httpx.AsyncHTTPTransport] = None
+
+def get_async_transport() -> httpx.AsyncHTTPTransport:
+    """Return the process-wide pooled transport used by all AsyncEdupageClients."""
+    global _async_transport
+    if _async_transport is None:
+        _async_transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=ASYNC_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_POOL_MAX_KEEPALIVE,
+            )
+        )
+    return _async_transport
+
+async def close_async_transport():
+    """Close the shared transport (on application shutdown)."""
+    global _async_transport
+    if _async_transport is not None:
+        await _async_transport.aclose()
+        _async_transport = None
+
+
+class AsyncEdupageClient(_EdupageBase):
+    """
+    asyncio counterpart of EdupageClient with the same login, get_meals_for_date,
+    order and cancel semantics and exceptions.
+    """
+    def __init__(self, request_timeout=5, transport: Optional[httpx.AsyncBaseTransport] = None):
+        super().__init__()
+        # Clients are never closed individually: aclose() would close the shared transport.
+        self.http = httpx.AsyncClient(
+            transport=transport or get_async_transport(),
+            timeout=request_timeout,
+            follow_redirects=True,
+        )
+
+    @property
+    def cookies(self):
+        """The underlying http.cookiejar.CookieJar of this client."""
+        return self.http.cookies.jar
+
+    async def login(self, username, password, subdomain):
+        # Initial request to get CSRF token
+        url_login = f"https://{subdomain}.edupage.org/login/?cmd=MainLogin"
+        try:
+            resp = await self.http.get(url_login)
+            if resp.status_code != 200:
+                raise BadCredentialsException("Failed to access login page")
+            
+            csrf_token = self._extract_csrf_token(resp.text)
+
+            # Login POST
+            post_url = f"https://{subdomain}.edupage.org/login/edubarLogin.php"
+            params = {
+                "csrfauth": csrf_token,
+                "username": username,
+                "password": password
+            }
+            resp_post = await self.http.post(post_url, data=params)
+            self._finish_login(str(resp_post.url), resp_post.text, username, subdomain)
+
+        except Exception as e:
+            print(f"Login error: {e}")
+            raise BadCredentialsException(f"Login failed: {e}")
+
+    async def get_meals_for_date(self, target_date: date):
+        """Same as EdupageClient.get_meals_for_date: { date_str: Meal } for the whole week."""
+        resp = await self.http.get(self._menu_url(target_date))
+        return self._parse_menu_page(resp.text)
+
+    async def order(self, meal_data, letter_choice):
+        return await self._send_change_request(meal_data, letter_choice)
+
+    async def cancel(self, meal_data):
+        return await self._send_change_request(meal_data, "AX")
+
+    async def _send_change_request(self, meal_data, choice_str):
+        payload = self._change_request_payload(meal_data, choice_str)
+        url = f"https://{self.subdomain}.edupage.org/menu/"
+        resp = await self.http.post(url, data=payload)
+        return self._check_change_response(resp)
@@ -0,0 +1,121 @@
+"""
+Request dependencies shared by the routers: DB sessions and the calling user.
+
+The caller is identified by the user-id header. Resolved users are kept in a
+small TTL cache so hot paths (e.g. lunch cache hits) don't need a SELECT on
+users per request. Cached users are detached snapshots: routes must write
+user columns with explicit UPDATEs and call invalidate_identity afterwards
+(login, session clear and session expiry do). That only reaches this worker's
+cache, so routes that find no usable session re-read the user (reload_identity)
+before failing, e.g. right after a login handled by another worker.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, get_async_sessionmaker
+from models import User
+
+IDENTITY_CACHE_TTL_SECONDS = int(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "30"))
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "10000"))
+
+
+class IdentityCache:
+    """Bounded LRU of user_id -> (User snapshot, stored_at) with a TTL."""
+    def __init__(self, ttl_seconds: int = 30, max_entries: int = 10000):
+        self._users: OrderedDict[int, tuple[User, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+
+    def get(self, user_id: int) -> Optional[User]:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            user, stored_at = entry
+            if time.monotonic() - stored_at >= self._ttl:
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return user
+
+    def set(self, user: User) -> None:
+        with self._lock:
+            self._users[user.id] = (user, time.monotonic())
+            self._users.move_to_end(user.id)
+            while len(self._users) > self._max_entries:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+
+
+identity_cache = IdentityCache(IDENTITY_CACHE_TTL_SECONDS, IDENTITY_CACHE_MAX_ENTRIES)
+
+
+def invalidate_identity(user_id: int) -> None:
+    """Drop a cached user after its row changed (call after the commit)."""
+    identity_cache.invalidate(user_id)
+
+
+def _snapshot(user: User) -> User:
+    """Transient copy of a user row, safe to share between requests and sessions."""
+    return User(
+        id=user.id,
+        edupage_username=user.edupage_username,
+        edupage_session_data=user.edupage_session_data,
+        last_upstream_success_at=user.last_upstream_success_at,
+    )
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+async def reload_identity(db: AsyncSession, user_id: int) -> Optional[User]:
+    """
+    Read a user from the DB, bypassing and refreshing the cache. invalidate_identity only
+    reaches this worker's cache, so a snapshot may predate a change made by another one.
+    """
+    row = (await db.execute(select(User).where(User.id == user_id))).scalars().first()
+    if not row:
+        identity_cache.invalidate(user_id)
+        return None
+    user = _snapshot(row)
+    identity_cache.set(user)
+    return user
+
+
+async def get_current_user(user_id: str = Header(None), db: AsyncSession = Depends(get_async_db)) -> User:
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Missing User ID")
+    # Cast to int for DB lookup
+    uid = int(user_id)
+    user = identity_cache.get(uid)
+    if user is not None:
+        return user
+    user = await reload_identity(db, uid)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid User")
+    return user
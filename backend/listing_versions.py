@@ -0,0 +1,66 @@
+"""
+Version counters for the lunch listing ETags.
+
+A listing's ETag hashes the cached meal data it shows and the versions of:
+- "meal:<identifier>" for each listed meal, bumped by rating and photo writes
+  (including the variant task, which changes photo URLs);
+- "user:<id>", bumped by that user's orders and cancellations.
+Writers bump in the transaction of their change. The counters live in the DB,
+so every worker process sees them. Checking an ETag costs one primary-key
+query instead of the rating and photo enrichment.
+"""
+import hashlib
+import json
+
+from sqlalchemy import select
+
+from database import dialect_insert
+from models import ListingVersion
+
+
+def meal_key(meal_identifier: str) -> str:
+    return f"meal:{meal_identifier}"
+
+
+def user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _bump_statement(db, keys):
+    insert = dialect_insert(db)
+    stmt = insert(ListingVersion).values([{"key": key, "version": 1} for key in sorted(set(keys))])
+    return stmt.on_conflict_do_update(
+        index_elements=[ListingVersion.key],
+        set_={"version": ListingVersion.version + 1},
+    )
+
+
+async def bump_versions(db, keys) -> None:
+    """Invalidate the ETags of listings showing these keys. Doesn't commit."""
+    keys = [key for key in keys if key]
+    if keys:
+        await db.execute(_bump_statement(db, keys))
+
+
+def bump_versions_sync(db, keys) -> None:
+    """bump_versions for sync sessions (background tasks)."""
+    keys = [key for key in keys if key]
+    if keys:
+        db.execute(_bump_statement(db, keys))
+
+
+async def listing_etag(db, user_id: int, days: dict, variant: str) -> str:
+    """
+    Strong ETag of a listing of days ({date: Meal}) for user_id. variant covers
+    request options that change the body (e.g. photo size).
+    """
+    keys = [user_key(user_id)] + sorted({meal_key(menu.name) for meal in days.values() for menu in meal.menus if menu.name})
+    versions = dict((await db.execute(
+        select(ListingVersion.key, ListingVersion.version).where(ListingVersion.key.in_(keys))
+    )).all())
+    digest = hashlib.sha256()
+    digest.update(json.dumps([user_id, variant, [versions.get(key, 0) for key in keys]]).encode())
+    for date_str in sorted(days):
+        # default=str: the change deadline is a datetime
+        digest.update(json.dumps([date_str, days[date_str].to_dict()], sort_keys=True, default=str).encode())
+    return f'"{digest.hexdigest()[:32]}"'
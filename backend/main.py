@@ -3,7 +3,7 @@ import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine, Base
-from models import User, Rating, Photo # Ensure models are registered
+from models import User, Rating, Photo, StorageDeletion # Ensure models are registered
 import os
 from dotenv import load_dotenv
 
@@ -21,14 +21,23 @@ async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown events."""
     # Startup
     Base.metadata.create_all(bind=engine)
-    from session_keeper import start_scheduler
+    from migrations import run_migrations
+    run_migrations(engine)
+    from session_keeper import start_scheduler, scheduler
     start_scheduler()
+    from storage_outbox import schedule_deletion_drain
+    schedule_deletion_drain(scheduler)
     
     yield
     
     # Shutdown
     from session_keeper import stop_scheduler
     stop_scheduler()
+    from edupage_internal import close_async_transport, close_shared_adapter
+    await close_async_transport()
+    close_shared_adapter()
+    from database import dispose_async_engine
+    await dispose_async_engine()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -44,18 +53,31 @@ app.add_middleware(
 
 # Base.metadata.create_all(bind=engine)  # Moved to lifespan
 
-from fastapi.staticfiles import StaticFiles
-from routers import auth, lunches, social
+from routers import auth, lunches, social, uploads
 import os
 
 app.include_router(auth.router, prefix="/api")
 app.include_router(lunches.router, prefix="/api")
 app.include_router(social.router, prefix="/api")
 
-# Mount uploads directory (keep for backward compatibility / local storage)
+# Local storage uploads, served with caching headers (see routers/uploads.py)
 os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.include_router(uploads.router)
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
+
+@app.get("/api/stats")
+def read_stats():
+    """Cache, session registry, upstream connection pool and storage deletion counters."""
+    from cache import lunch_cache
+    from session_manager import registry_stats
+    from edupage_internal import http_pool_stats
+    from storage_outbox import last_drain_stats
+    return {
+        "lunch_cache": lunch_cache.stats(),
+        "sessions": registry_stats(),
+        "edupage_pool": http_pool_stats(),
+        "storage_deletions": last_drain_stats,
+    }
@@ -0,0 +1,125 @@
+"""
+Compact representation of parsed Edupage meals.
+
+Parsed meals are cached for every user and day, so these are
+slotted, immutable dataclasses holding tuples rather than nested dicts and
+lists. Strings that repeat across users and days (meal names, menu numbers,
+dates) are interned so each distinct value is stored once.
+
+Everything but the order state is the same for every student of a school, so
+the lunch cache stores a Meal as a school-wide DayMenu plus a small per-user
+MealStatus, and composes them back on read.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from sys import intern
+from typing import Optional, Tuple
+
+
+def _intern(value):
+    return intern(value) if isinstance(value, str) else value
+
+
+@dataclass(frozen=True, slots=True)
+class MenuItem:
+    name: Optional[str]
+    number: Optional[str]  # "1", "2" or None
+
+    @classmethod
+    def create(cls, name: Optional[str], number: Optional[str]) -> "MenuItem":
+        return cls(_intern(name), _intern(number))
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "number": self.number}
+
+
+@dataclass(frozen=True, slots=True)
+class DayMenu:
+    """The part of a Meal shared by the whole school."""
+    date: str
+    menus: Tuple[MenuItem, ...]
+    meal_index: str
+
+    def to_dict(self) -> dict:
+        return {"date": self.date, "menus": [menu.to_dict() for menu in self.menus], "meal_index": self.meal_index}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DayMenu":
+        menus = tuple(MenuItem.create(menu.get("name"), menu.get("number")) for menu in data["menus"])
+        return cls(_intern(data["date"]), menus, _intern(data["meal_index"]))
+
+
+@dataclass(frozen=True, slots=True)
+class MealStatus:
+    """The per-user part of a Meal: order state, deadline and the user's school."""
+    subdomain: str
+    ordered_meal: Optional[str]
+    boarder_id: Optional[str]
+    can_be_changed_until: Optional[datetime]
+
+    def to_dict(self) -> dict:
+        return {
+            "subdomain": self.subdomain,
+            "ordered_meal": self.ordered_meal,
+            "boarder_id": self.boarder_id,
+            "can_be_changed_until": self.can_be_changed_until,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MealStatus":
+        return cls(
+            _intern(data["subdomain"]), _intern(data["ordered_meal"]),
+            _intern(data["boarder_id"]), data["can_be_changed_until"]
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Meal:
+    date: str
+    can_be_changed_until: Optional[datetime]
+    ordered_meal: Optional[str]  # "A", "B", etc.
+    menus: Tuple[MenuItem, ...]
+    # Needed for actions (ordering/canceling)
+    boarder_id: Optional[str]
+    meal_index: str
+
+    @classmethod
+    def create(cls, date: str, can_be_changed_until: Optional[datetime], ordered_meal: Optional[str],
+               menus, boarder_id: Optional[str], meal_index: str) -> "Meal":
+        return cls(
+            _intern(date), can_be_changed_until, _intern(ordered_meal),
+            tuple(menus), _intern(boarder_id), _intern(meal_index)
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Meal":
+        return cls.create(
+            data["date"],
+            data.get("can_be_changed_until"),
+            data.get("ordered_meal"),
+            (MenuItem.create(menu.get("name"), menu.get("number")) for menu in data.get("menus", [])),
+            data.get("boarder_id"),
+            data.get("meal_index", "2"),
+        )
+
+    @classmethod
+    def compose(cls, menu: DayMenu, status: MealStatus) -> "Meal":
+        return cls(menu.date, status.can_be_changed_until, status.ordered_meal, menu.menus, status.boarder_id, menu.meal_index)
+
+    def split(self, subdomain: str) -> Tuple[DayMenu, MealStatus]:
+        """Inverse of compose: (school-wide menu, per-user status)."""
+        return (
+            DayMenu(self.date, self.menus, self.meal_index),
+            MealStatus(_intern(subdomain), self.ordered_meal, self.boarder_id, self.can_be_changed_until),
+        )
+
+    def to_dict(self) -> dict:
+        """Plain dict view (JSON friendly apart from the datetime)."""
+        return {
+            "date": self.date,
+            "can_be_changed_until": self.can_be_changed_until,
+            "ordered_meal": self.ordered_meal,
+            "menus": [menu.to_dict() for menu in self.menus],
+            "boarder_id": self.boarder_id,
+            "meal_index": self.meal_index,
+        }
@@ -0,0 +1,125 @@
+"""
+Targeted extraction of the `edupageData` object embedded in Edupage HTML pages.
+
+The menu page carries the whole school payload as a JS object literal
+(`edupageData: {...}`), but only `<subdomain>.novyListok` is needed. Instead of
+splitting the page on delimiters (which copies the page and breaks on minified
+output) and decoding the whole blob, we walk the object members along the
+wanted path in place and json-decode only that subtree. Members after it are
+never looked at.
+
+Sibling objects/arrays in front of the wanted member are skipped with the C
+JSON scanner: a pure-Python brace/string scanner is several times slower than
+decoding and discarding them (see benchmarks/bench_menu_extract.py).
+"""
+import json
+import re
+from typing import Any, Optional, Sequence
+
+MARKER = "edupageData:"
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"\s*")
+# End of a scalar (number, true, false, null)
+_SCALAR_END = re.compile(r"[,}\]\s]")
+
+
+class ExtractionError(ValueError):
+    """The page does not contain a well-formed edupageData object."""
+
+
+def extract_edupage_value(content: str, path: Sequence[str]) -> Optional[Any]:
+    """
+    Decode the value at `path` (e.g. ["myschool", "novyListok"]) inside the page's
+    edupageData object. Returns None if a key along the path is missing.
+    Raises ExtractionError if there is no edupageData object or it is malformed.
+    """
+    marker_at = content.find(MARKER)
+    if marker_at == -1:
+        raise ExtractionError("No edupageData in page")
+
+    pos = _skip_whitespace(content, marker_at + len(MARKER))
+    for key in path:
+        if pos >= len(content) or content[pos] != "{":
+            return None
+        pos = _find_member(content, pos, key)
+        if pos is None:
+            return None
+
+    try:
+        value, _ = _DECODER.raw_decode(content, pos)
+    except json.JSONDecodeError as e:
+        raise ExtractionError(f"Malformed edupageData: {e}") from e
+    return value
+
+
+def _skip_whitespace(content: str, pos: int) -> int:
+    return _WHITESPACE.match(content, pos).end()
+
+
+def _string_end(content: str, pos: int) -> int:
+    """Index just past the JSON string literal whose opening quote is at pos."""
+    end = content.find('"', pos + 1)
+    while end != -1:
+        # A quote preceded by an odd number of backslashes is escaped
+        backslashes = 0
+        i = end - 1
+        while content[i] == "\\":
+            backslashes += 1
+            i -= 1
+        if backslashes % 2 == 0:
+            return end + 1
+        end = content.find('"', end + 1)
+    raise ExtractionError(f"Unterminated string at {pos}")
+
+
+def _find_member(content: str, obj_start: int, wanted: str) -> Optional[int]:
+    """
+    Scan the members of the object starting at obj_start ("{") and return the index
+    where the value of key `wanted` starts, or None if the object has no such key.
+    """
+    pos = _skip_whitespace(content, obj_start + 1)
+    if content.startswith("}", pos):
+        return None
+
+    while True:
+        if not content.startswith('"', pos):
+            raise ExtractionError(f"Expected object key at {pos}")
+        key_end = _string_end(content, pos)
+        raw_key = content[pos:key_end]
+        key = json.loads(raw_key) if "\\" in raw_key else raw_key[1:-1]
+
+        pos = _skip_whitespace(content, key_end)
+        if not content.startswith(":", pos):
+            raise ExtractionError(f"Expected ':' at {pos}")
+        pos = _skip_whitespace(content, pos + 1)
+
+        if key == wanted:
+            return pos
+
+        pos = _skip_whitespace(content, _skip_value(content, pos))
+        if content.startswith(",", pos):
+            pos = _skip_whitespace(content, pos + 1)
+        elif content.startswith("}", pos):
+            return None
+        else:
+            raise ExtractionError(f"Expected ',' or '}}' at {pos}")
+
+
+def _skip_value(content: str, pos: int) -> int:
+    """Return the index just past the JSON value starting at pos."""
+    if pos >= len(content):
+        raise ExtractionError("Unexpected end of page")
+
+    char = content[pos]
+    if char == '"':
+        return _string_end(content, pos)
+
+    if char in "{[":
+        try:
+            return _DECODER.raw_decode(content, pos)[1]
+        except json.JSONDecodeError as e:
+            raise ExtractionError(f"Malformed edupageData: {e}") from e
+
+    match = _SCALAR_END.search(content, pos)
+    return match.start() if match else len(content)
@@ -0,0 +1,117 @@
+"""
+Idempotent schema migrations, run at startup after Base.metadata.create_all.
+
+create_all only creates missing tables, so changes to existing tables
+(new columns, constraints, data fixes) are applied here.
+"""
+import base64
+import logging
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+
+def _add_column_if_missing(conn, table: str, column: str, ddl_type: str):
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in columns:
+        logger.info(f"Migrations: Adding column {table}.{column}")
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _unpickle_legacy_session(session_data) -> dict:
+    """
+    Legacy users.edupage_session_data: base64(pickle({'cookies': RequestsCookieJar, ...})).
+    The only place stored session data is unpickled; request paths read JSON only.
+    """
+    import pickle
+    if isinstance(session_data, str):
+        session_data = session_data.encode('utf-8')
+    return pickle.loads(base64.b64decode(session_data))
+
+
+def _migrate_session_data(conn):
+    """Rewrite users.edupage_session_data from the legacy pickle format to JSON."""
+    from session_manager import migrate_session_data
+
+    rows = conn.execute(text(
+        "SELECT id, edupage_session_data FROM users"
+        " WHERE edupage_session_data IS NOT NULL AND edupage_session_data NOT LIKE '{%'"
+    )).fetchall()
+    for user_id, session_data in rows:
+        try:
+            new_data = migrate_session_data(_unpickle_legacy_session(session_data))
+        except Exception as e:
+            # Unreadable session: the user has to log in again
+            logger.warning(f"Migrations: Dropping unreadable session data of user {user_id}: {e}")
+            new_data = None
+        conn.execute(
+            text("UPDATE users SET edupage_session_data = :data WHERE id = :id"),
+            {"data": new_data, "id": user_id}
+        )
+    if rows:
+        logger.info(f"Migrations: Converted session data of {len(rows)} user(s) to JSON")
+
+
+def _deduplicate_ratings(conn):
+    """
+    Keep only the latest rating per (user_id, meal_identifier), then add the unique
+    index rate_lunch upserts against. Rebuilds meal_rating_stats if rows were dropped.
+    """
+    indexes = {i["name"] for i in inspect(conn).get_indexes("ratings")}
+    if "uq_ratings_user_meal" in indexes:
+        return
+    if conn.dialect.name == "postgresql":
+        # No new duplicates between the cleanup and the index
+        conn.execute(text("LOCK TABLE ratings IN SHARE ROW EXCLUSIVE MODE"))
+    result = conn.execute(text(
+        "DELETE FROM ratings"
+        " WHERE user_id IS NOT NULL AND meal_identifier IS NOT NULL AND id NOT IN ("
+        "  SELECT MAX(id) FROM ratings GROUP BY user_id, meal_identifier)"
+    ))
+    logger.info("Migrations: Adding unique index ratings(user_id, meal_identifier)")
+    conn.execute(text("CREATE UNIQUE INDEX uq_ratings_user_meal ON ratings (user_id, meal_identifier)"))
+    if result.rowcount:
+        from rating_stats import backfill_rating_stats
+        logger.info(f"Migrations: Removed {result.rowcount} duplicate rating(s)")
+        backfill_rating_stats(conn)
+
+
+def _backfill_rating_stats_if_empty(conn):
+    """First start with meal_rating_stats: build it from the existing ratings."""
+    from rating_stats import backfill_rating_stats
+
+    has_stats = conn.execute(text("SELECT 1 FROM meal_rating_stats LIMIT 1")).first()
+    has_ratings = conn.execute(text("SELECT 1 FROM ratings LIMIT 1")).first()
+    if has_ratings and not has_stats:
+        backfill_rating_stats(conn)
+
+
+def run_migrations(engine):
+    """Bring an existing database up to the current models."""
+    with engine.begin() as conn:
+        _add_column_if_missing(conn, "users", "last_upstream_success_at", "TIMESTAMP")
+        _add_column_if_missing(conn, "photos", "thumbnail_path", "VARCHAR")
+        _add_column_if_missing(conn, "photos", "large_path", "VARCHAR")
+        _add_column_if_missing(conn, "storage_deletions", "object_key", "VARCHAR")
+        _migrate_session_data(conn)
+        _deduplicate_ratings(conn)
+        _backfill_rating_stats_if_empty(conn)
+
+
+if __name__ == "__main__":
+    # Maintenance commands, e.g. `python migrations.py backfill-rating-stats`
+    import sys
+    from database import Base, engine
+    import models  # noqa: F401 (register tables)
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    Base.metadata.create_all(bind=engine)
+    if command == "migrate":
+        run_migrations(engine)
+    elif command == "backfill-rating-stats":
+        from rating_stats import backfill_rating_stats
+        with engine.begin() as conn:
+            backfill_rating_stats(conn)
+    else:
+        sys.exit(f"Unknown command: {command} (expected migrate or backfill-rating-stats)")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -9,6 +9,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     edupage_username = Column(String, unique=True, index=True)
     edupage_session_data = Column(Text) # JSON string of cookies/session
+    last_upstream_success_at = Column(DateTime, nullable=True) # Last time the session worked against Edupage
     
     ratings = relationship("Rating", back_populates="user")
     photos = relationship("Photo", back_populates="user")
@@ -24,6 +25,9 @@ class Rating(Base):
 
     user = relationship("User", back_populates="ratings")
 
+    # One rating per user and meal; rate_lunch upserts against it
+    __table_args__ = (Index("uq_ratings_user_meal", "user_id", "meal_identifier", unique=True),)
+
 class Photo(Base):
     __tablename__ = "photos"
 
@@ -31,6 +35,50 @@ class Photo(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     meal_identifier = Column(String, index=True)
     photo_path = Column(String)
+    # WebP variants, filled in by photo_variants.process_photo after the upload
+    thumbnail_path = Column(String, nullable=True)
+    large_path = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="photos")
+
+class MealRatingStats(Base):
+    """Totals of ratings per meal, refreshed in the same transaction as each rating write."""
+    __tablename__ = "meal_rating_stats"
+
+    meal_identifier = Column(String, primary_key=True)
+    rating_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0)
+
+    @property
+    def average(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
+class StorageDeletion(Base):
+    """Outbox of stored files to delete, drained in the background by storage_outbox."""
+    __tablename__ = "storage_deletions"
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)
+    # Content-addressed files: only deleted while stored_objects has no references to this key
+    object_key = Column(String, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Null once attempts are exhausted: kept (with last_error) for inspection, not retried
+    next_attempt_at = Column(DateTime, nullable=True, default=datetime.utcnow, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class StoredObject(Base):
+    """Reference count of a content-addressed photo object (see content_store)."""
+    __tablename__ = "stored_objects"
+
+    key = Column(String, primary_key=True)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ListingVersion(Base):
+    """Change counters behind the lunch listing ETags (see listing_versions)."""
+    __tablename__ = "listing_versions"
+
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,98 @@
+"""
+Resized WebP variants of uploaded meal photos.
+
+upload_photo stores the original and schedules process_photo as a background
+task. It decodes the original once, writes a thumbnail (meal cards) and a large
+variant (lightbox) through the StorageService, and records their paths on the
+Photo row. Until that finishes, or if the image can't be decoded, listings
+fall back to the original.
+"""
+import io
+import logging
+import os
+
+from sqlalchemy import update
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of each variant, smallest first
+VARIANT_SIZES = {
+    "thumbnail": int(os.getenv("PHOTO_THUMBNAIL_SIZE", "480")),
+    "large": int(os.getenv("PHOTO_LARGE_SIZE", "1600")),
+}
+PHOTO_WEBP_QUALITY = int(os.getenv("PHOTO_WEBP_QUALITY", "80"))
+
+# Photo column holding each variant's storage path
+VARIANT_COLUMNS = {"thumbnail": "thumbnail_path", "large": "large_path"}
+
+
+def variant_filename(photo_path: str, variant: str) -> str:
+    """Storage name of a variant, next to the original: uploads/abc_pic.jpg -> uploads/abc_pic.thumbnail.webp"""
+    stem = os.path.splitext(photo_path)[0]
+    return f"{stem}.{variant}.webp"
+
+
+def make_variants(source) -> dict:
+    """Decode an image (path or file object) and return {variant: WebP bytes}."""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # JPEG: let the decoder scale down by up to 8x instead of decoding every pixel
+        scale = max(VARIANT_SIZES.values()) / max(image.size)
+        if scale < 1:
+            image.draft("RGB", (round(image.width * scale), round(image.height * scale)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+        variants = {}
+        # Largest first, each smaller one resized from the previous result
+        for variant, size in sorted(VARIANT_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, "WEBP", quality=PHOTO_WEBP_QUALITY, method=4)
+            variants[variant] = out.getvalue()
+    return variants
+
+
+def process_photo(photo_id: int, photo_path: str, source_file: str) -> None:
+    """
+    Background task: build the variants of photo photo_id from a local copy of its
+    upload (source_file, removed afterwards) and store them. Runs in a worker thread.
+    """
+    from database import SessionLocal
+    from listing_versions import bump_versions_sync, meal_key
+    from models import Photo
+    from storage import get_storage_service
+    from storage_outbox import enqueue_deletions
+
+    storage = get_storage_service()
+    stored = {}
+    db = SessionLocal()
+    try:
+        variants = make_variants(source_file)
+        for variant, data in variants.items():
+            stored[VARIANT_COLUMNS[variant]] = storage.save(io.BytesIO(data), variant_filename(photo_path, variant))
+
+        meal_identifier = db.execute(
+            update(Photo).where(Photo.id == photo_id).values(stored).returning(Photo.meal_identifier)
+        ).scalar_one_or_none()
+        if meal_identifier is None:
+            # Photo replaced or deleted while we worked: don't leave the variants behind
+            logger.info(f"Photo variants: Photo {photo_id} is gone, discarding its variants")
+            enqueue_deletions(db, stored.values(), object_key=photo_path)
+        else:
+            # Listings now point at the variants
+            bump_versions_sync(db, [meal_key(meal_identifier)])
+        db.commit()
+    except Exception as e:
+        logger.warning(f"Photo variants: Could not process photo {photo_id} ({photo_path}): {e}")
+        # Variants already saved stay: they are named after the photo's object, so a
+        # later build overwrites them and release_photo queues them with the object
+        db.rollback()
+    finally:
+        db.close()
+        try:
+            os.remove(source_file)
+        except OSError:
+            pass
@@ -0,0 +1,111 @@
+"""
+Rating writes and maintenance of meal_rating_stats, the per-meal rating count and sum.
+
+Listings read averages from meal_rating_stats instead of aggregating the ratings
+table. Writers apply deltas in the same transaction as the rating change; the
+backfill rebuilds the whole table from ratings.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import case, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import dialect_insert
+from listing_versions import bump_versions, meal_key
+from models import MealRatingStats, Rating
+
+logger = logging.getLogger(__name__)
+
+
+async def upsert_ratings(db: AsyncSession, user_id: int, ratings: dict):
+    """
+    Set a user's ratings ({meal_identifier: stars}; insert or replace), apply the
+    changes to those meals' totals and bump their listing versions, in at most five
+    statements whatever the number of meals. Does not commit: the caller commits
+    (or rolls back) them together.
+    """
+    if not ratings:
+        return
+    meals = sorted(ratings)
+    insert = dialect_insert(db)
+    created_at = datetime.utcnow()
+    # New ratings first; the unique index makes a concurrent insert of the same row wait
+    # for ours and then skip, so each new rating is counted once
+    inserted = set((await db.execute(
+        insert(Rating).values([
+            {"user_id": user_id, "meal_identifier": meal, "stars": ratings[meal], "created_at": created_at}
+            for meal in meals
+        ]).on_conflict_do_nothing(index_elements=[Rating.user_id, Rating.meal_identifier])
+        .returning(Rating.meal_identifier)
+    )).scalars())
+    deltas = {meal: (1, ratings[meal]) for meal in inserted}
+
+    changed = [meal for meal in meals if meal not in inserted]
+    if changed:
+        # Existing ratings: lock them (Postgres) so the old stars stay current until commit
+        query = select(Rating.meal_identifier, Rating.stars).where(
+            Rating.user_id == user_id, Rating.meal_identifier.in_(changed)
+        )
+        if db.bind.dialect.name == "postgresql":
+            query = query.order_by(Rating.meal_identifier).with_for_update()
+        old_stars = dict((await db.execute(query)).all())
+        await db.execute(
+            update(Rating)
+            .where(Rating.user_id == user_id, Rating.meal_identifier.in_(changed))
+            .values(stars=case({meal: ratings[meal] for meal in changed}, value=Rating.meal_identifier))
+        )
+        for meal in changed:
+            old = old_stars.get(meal)
+            if old is None:
+                deltas[meal] = (1, ratings[meal])
+            elif old != ratings[meal]:
+                deltas[meal] = (0, ratings[meal] - old)
+
+    await apply_rating_deltas(db, deltas)
+    await bump_versions(db, [meal_key(meal) for meal in meals])
+
+
+async def upsert_rating(db: AsyncSession, user_id: int, meal_identifier: str, stars: float):
+    """Set one rating and update the meal's totals (see upsert_ratings)."""
+    await upsert_ratings(db, user_id, {meal_identifier: stars})
+
+
+async def apply_rating_deltas(db: AsyncSession, deltas: dict):
+    """
+    Add {meal_identifier: (count_delta, sum_delta)} to the meals' totals, creating rows
+    as needed (one statement). Does not commit: call it in the transaction that changes
+    the ratings, so both are committed (or rolled back) together.
+    """
+    if not deltas:
+        return
+    insert = dialect_insert(db)
+    stmt = insert(MealRatingStats).values([
+        {"meal_identifier": meal, "rating_count": count_delta, "rating_sum": sum_delta}
+        for meal, (count_delta, sum_delta) in sorted(deltas.items())
+    ])
+    # Relative update, so concurrent raters of the same meal don't overwrite each other
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MealRatingStats.meal_identifier],
+        set_={
+            "rating_count": MealRatingStats.rating_count + stmt.excluded.rating_count,
+            "rating_sum": MealRatingStats.rating_sum + stmt.excluded.rating_sum,
+        },
+    )
+    await db.execute(stmt)
+
+
+def backfill_rating_stats(conn) -> int:
+    """Rebuild meal_rating_stats from ratings (sync connection, one transaction). Returns the row count."""
+    if conn.dialect.name == "postgresql":
+        # Hold off rating writes until the rebuilt totals are committed
+        conn.execute(text("LOCK TABLE ratings IN SHARE MODE"))
+        conn.execute(text("LOCK TABLE meal_rating_stats IN EXCLUSIVE MODE"))
+    conn.execute(text("DELETE FROM meal_rating_stats"))
+    result = conn.execute(text(
+        "INSERT INTO meal_rating_stats (meal_identifier, rating_count, rating_sum)"
+        " SELECT meal_identifier, COUNT(*), SUM(stars) FROM ratings"
+        " WHERE meal_identifier IS NOT NULL AND stars IS NOT NULL"
+        " GROUP BY meal_identifier"
+    ))
+    logger.info(f"Rating stats: Rebuilt totals for {result.rowcount} meal(s)")
+    return result.rowcount
@@ -1,18 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from models import User
-from database import SessionLocal
+from identity import get_db, invalidate_identity
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -59,6 +52,7 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
         try:
             client = create_session(user, request.username, request.password, request.subdomain)
             db.commit() # Save session data
+            invalidate_identity(user.id)
             return {"id": user.id, "username": user.edupage_username}
         except BadCredentialsException:
              raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -1,34 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from models import User, Rating, Photo
-from database import SessionLocal
-from datetime import date, datetime
-from cache import lunch_cache
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
+from models import User, Rating, Photo, MealRatingStats
+from meals import Meal
+from identity import get_async_db, get_current_user, invalidate_identity, reload_identity
+from datetime import date, datetime, timedelta
+from cache import lunch_cache, week_start
 from storage import get_storage_service
-from session_manager import get_client
+from listing_versions import bump_versions, listing_etag, user_key
+from etags import etag_matches
+from session_manager import clear_session, get_async_client, mark_upstream_success
 from edupage_internal import SessionExpiredException, EdupageException, NotLoggedInException
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/lunches", tags=["lunches"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def get_current_user(user_id: str = Header(None), db: Session = Depends(get_db)):
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Missing User ID")
-    # Cast to int for DB lookup
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid User")
-    return user
+# Photo URLs in listings: WebP thumbnails unless the client asks for more
+PHOTO_SIZES = ("thumbnail", "large", "original")
+
+
+# Clients may keep listings but must revalidate them (ETag) before use
+LISTING_CACHE_CONTROL = "private, no-cache"
+
+
+def _check_photo_size(photo_size: str):
+    if photo_size not in PHOTO_SIZES:
+        raise HTTPException(status_code=400, detail=f"photo_size must be one of {', '.join(PHOTO_SIZES)}")
+
+
+def _not_modified(request: Request, etag: str):
+    """A 304 for a matching If-None-Match, else None."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": LISTING_CACHE_CONTROL})
+    return None
 
 @router.get("/")
-def get_lunches(day: str = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_lunches(request: Request, response: Response, day: str = None, photo_size: str = "thumbnail", user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    _check_photo_size(photo_size)
     if day:
         try:
             target_date = datetime.strptime(day, "%Y-%m-%d").date()
@@ -40,24 +51,15 @@ def get_lunches(day: str = None, user: User = Depends(get_current_user), db: Ses
     date_str = target_date.isoformat()
     
     # Check cache first
-    lunches = lunch_cache.get(user.id, date_str)
+    lunches = await lunch_cache.aget(user.id, date_str)
     
     if lunches is None:
         # Cache miss - fetch from Edupage
-        client = get_client(user)
         try:
-            # fetch_week returns { "YYYY-MM-DD": meal_dict, ... }
-            week_data = client.get_meals_for_date(target_date)
-            
-            # Populate cache for ALL fetched days
-            for d_str, m_data in week_data.items():
-                lunch_cache.set(user.id, d_str, m_data)
-                
-            lunches = week_data.get(date_str)
+            lunches = (await _fetch_week(user, target_date, db)).get(date_str)
             
         except SessionExpiredException:
-            user.edupage_session_data = None
-            db.commit()
+            await _expire_session(user, db)
             raise HTTPException(status_code=401, detail="Session expired, please log in again")
         except NotLoggedInException:
             # Also raise 401 if not logged in (e.g. session cleared/missing)
@@ -69,40 +71,223 @@ def get_lunches(day: str = None, user: User = Depends(get_current_user), db: Ses
     if not lunches:
         return []
 
-    # Prepare response
+    # Unchanged since the client's copy: skip the ratings/photos enrichment
+    etag = await listing_etag(db, user.id, {date_str: lunches}, photo_size)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = LISTING_CACHE_CONTROL
+
+    storage = get_storage_service()
+    meal_names = [menu.name for menu in lunches.menus[:7]]
+    metadata = await _fetch_meal_metadata(db, user.id, meal_names, storage, photo_size)
+
+    return _build_day_results(lunches, date_str, metadata)
+
+
+@router.get("/week")
+async def get_week_lunches(request: Request, response: Response, day: str = None, photo_size: str = "thumbnail", user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    All lunches of the week containing `day`, from a single (cached) Edupage fetch.
+    Returns { "YYYY-MM-DD": [lunch items...] } with days in ascending order.
+    """
+    _check_photo_size(photo_size)
+    if day:
+        try:
+            target_date = datetime.strptime(day, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format")
+    else:
+        target_date = date.today()
+
+    week_data = await lunch_cache.aget_week(user.id, target_date)
+
+    if week_data is None:
+        try:
+            week_data = await _fetch_week(user, target_date, db)
+        except SessionExpiredException:
+            await _expire_session(user, db)
+            raise HTTPException(status_code=401, detail="Session expired, please log in again")
+        except NotLoggedInException:
+            raise HTTPException(status_code=401, detail="Session expired, please log in again")
+        except Exception as e:
+            print(f"Error fetching lunches: {e}")
+            return {}
+
+    # Only serve days of the requested week; Edupage may pad the range with neighbouring days
+    monday = week_start(target_date)
+    week_days = {(monday + timedelta(days=i)).isoformat() for i in range(7)}
+    days = {d_str: week_data[d_str] for d_str in sorted(week_data) if d_str in week_days and week_data[d_str]}
+
+    etag = await listing_etag(db, user.id, days, f"week:{photo_size}")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = LISTING_CACHE_CONTROL
+
+    storage = get_storage_service()
+    meal_names = [menu.name for lunches in days.values() for menu in lunches.menus[:7]]
+    metadata = await _fetch_meal_metadata(db, user.id, meal_names, storage, photo_size)
+
+    return {d_str: _build_day_results(lunches, d_str, metadata) for d_str, lunches in days.items()}
+
+
+async def _fetch_week(user: User, target_date: date, db: AsyncSession) -> dict:
+    """
+    Get the week containing target_date, fetching it from Edupage and caching all of its
+    days on a miss. Concurrent misses for the same week share a single upstream fetch.
+    Returns { "YYYY-MM-DD": Meal, ... }. Edupage exceptions propagate to the caller.
+    """
+    client = await _get_client(user, db)
+    fetched = False
+
+    async def load():
+        nonlocal fetched
+        week_data = await client.get_meals_for_date(target_date)
+        fetched = True
+        return week_data
+
+    week_data = await lunch_cache.aload_week(user.id, client.subdomain, target_date, load)
+    # Outside the single flight: followers don't wait on it and it can't fail the fetch
+    if fetched:
+        await _record_upstream_success(user, db)
+    return week_data
+
+
+async def _get_client(user: User, db: AsyncSession):
+    """The user's Edupage client, re-reading the user if the cached snapshot has no usable session."""
+    client = get_async_client(user)
+    if not client.is_logged_in:
+        # The snapshot may predate a login handled by another worker
+        fresh = await reload_identity(db, user.id)
+        if fresh is not None and fresh.edupage_session_data != user.edupage_session_data:
+            client = get_async_client(fresh)
+    return client
+
+
+async def _record_order_change(user: User, db: AsyncSession):
+    """
+    Bookkeeping after a successful order/cancel: bump the user's listing version (their
+    ETags must change) and record the upstream success. Errors are logged only.
+    """
+    try:
+        await bump_versions(db, [user_key(user.id)])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Lunches: Bumping the listing version of user {user.id} failed: {e}")
+    await _record_upstream_success(user, db)
+
+
+async def _record_upstream_success(user: User, db: AsyncSession):
+    """
+    Let the session keeper know this session is alive (throttled DB write).
+    Bookkeeping only: errors are logged, never raised.
+    """
+    if not mark_upstream_success(user):
+        return
+    try:
+        await _update_user(db, user.id, {User.last_upstream_success_at: user.last_upstream_success_at})
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Lunches: Recording upstream success of user {user.id} failed: {e}")
+
+
+async def _expire_session(user: User, db: AsyncSession):
+    """
+    Forget the stored Edupage session after Edupage rejected it. Only the rejected
+    session data is cleared, so a login that raced in on another request is kept.
+    """
+    result = await db.execute(
+        update(User)
+        .where(User.id == user.id, User.edupage_session_data == user.edupage_session_data)
+        .values({User.edupage_session_data: None})
+    )
+    await db.commit()
+    if result.rowcount:
+        # Drops the expired client from the registry and the cached identity
+        clear_session(user.id)
+    else:
+        invalidate_identity(user.id)
+
+
+async def _update_user(db: AsyncSession, user_id: int, values: dict):
+    # `user` is a cached snapshot not attached to db, so write with an explicit UPDATE
+    await db.execute(update(User).where(User.id == user_id).values(values))
+    await db.commit()
+
+
+async def _fetch_meal_metadata(db: AsyncSession, user_id: int, meal_names, storage, photo_size: str = "thumbnail") -> dict:
+    """
+    Load ratings and photos for all given meal names at once.
+    Returns { meal_name: {avg_rating, user_rating, photos, photos_large, user_has_photo} },
+    photos at photo_size. Photos whose variants aren't ready yet use the original.
+    Issues a fixed number of grouped queries regardless of how many meals are listed.
+    """
+    names = list({name for name in meal_names if name})
+    metadata = {
+        name: {"avg_rating": None, "user_rating": None, "photos": [], "photos_large": [], "user_has_photo": False}
+        for name in names
+    }
+    if not names:
+        return metadata
+
+    # Primary key lookups in the running totals instead of aggregating every rating
+    stats_rows = (await db.execute(
+        select(MealRatingStats).where(MealRatingStats.meal_identifier.in_(names))
+    )).scalars().all()
+    for stats in stats_rows:
+        metadata[stats.meal_identifier]["avg_rating"] = stats.average
+
+    user_rows = (await db.execute(
+        select(Rating.meal_identifier, Rating.stars)
+        .where(Rating.user_id == user_id, Rating.meal_identifier.in_(names))
+    )).all()
+    for meal_name, stars in user_rows:
+        metadata[meal_name]["user_rating"] = stars
+
+    photo_rows = (await db.execute(
+        select(Photo.meal_identifier, Photo.photo_path, Photo.thumbnail_path, Photo.large_path, Photo.user_id)
+        .where(Photo.meal_identifier.in_(names))
+        .order_by(Photo.id)
+    )).all()
+    for meal_name, photo_path, thumbnail_path, large_path, photo_user_id in photo_rows:
+        entry = metadata[meal_name]
+        paths = {"thumbnail": thumbnail_path or photo_path, "large": large_path or photo_path, "original": photo_path}
+        entry["photos"].append(storage.get_url(paths[photo_size]))
+        entry["photos_large"].append(storage.get_url(paths["large"]))
+        if photo_user_id == user_id:
+            entry["user_has_photo"] = True
+
+    return metadata
+
+
+def _build_day_results(lunches: Meal, date_str: str, metadata: dict) -> list:
+    """Build the API response items for one day from parsed meal data and its metadata."""
     results = []
     
-    # 'lunches' is a dict with keys: date, can_be_changed_until, ordered_meal, menus, boarder_id...
-    current_lunch_meal = lunches
-    can_be_changed_until = current_lunch_meal.get('can_be_changed_until')
+    can_be_changed_until = lunches.can_be_changed_until
     
     # Ordered logic: 'ordered_meal' is "A", "B", ...
-    ordered_letter = current_lunch_meal.get('ordered_meal')
+    ordered_letter = lunches.ordered_meal
     ordered_number = None
     if ordered_letter and ordered_letter in "ABCDEFGH":
          ordered_number = str(ord(ordered_letter) - ord('A') + 1)
 
     # Menus
-    menus = current_lunch_meal.get('menus', [])[:7] # Limit to 7 items
-    
-    storage = get_storage_service()
+    menus = lunches.menus[:7] # Limit to 7 items
     
     for i, menu in enumerate(menus):
-        meal_name = menu['name']
-        menu_number = menu['number'] # e.g. "1", "2"
+        meal_name = menu.name
+        menu_number = menu.number # e.g. "1", "2"
         if menu_number:
             menu_number = str(menu_number).strip()
 
-        # DB Queries for metadata
-        avg_rating = db.query(func.avg(Rating.stars)).filter(Rating.meal_identifier == meal_name).scalar()
-        user_rating = db.query(Rating.stars).filter(
-            Rating.user_id == user.id,
-            Rating.meal_identifier == meal_name
-        ).scalar()
-        
-        photos = db.query(Photo).filter(Photo.meal_identifier == meal_name).all()
-        photo_list = [storage.get_url(p.photo_path) for p in photos]
-        user_has_photo = any(p.user_id == user.id for p in photos)
+        meta = metadata.get(meal_name) or {}
+        avg_rating = meta.get("avg_rating")
+        photo_list = meta.get("photos", [])
         photo_url = photo_list[0] if photo_list else None
         
         # Determine if this specific menu item is ordered
@@ -116,10 +301,11 @@ def get_lunches(day: str = None, user: User = Depends(get_current_user), db: Ses
             "number": menu_number,
             "is_ordered": is_ordered,
             "avg_rating": round(avg_rating, 1) if avg_rating else None,
-            "user_rating": user_rating,
+            "user_rating": meta.get("user_rating"),
             "photo_url": photo_url,
             "photos": photo_list,
-            "user_has_photo": user_has_photo,
+            "photos_large": meta.get("photos_large", []),
+            "user_has_photo": meta.get("user_has_photo", False),
             "date": date_str,
             "can_be_changed_until": can_be_changed_until
         })
@@ -128,24 +314,20 @@ def get_lunches(day: str = None, user: User = Depends(get_current_user), db: Ses
 
 
 @router.post("/order")
-def order_lunch(meal_index: int, day: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def order_lunch(meal_index: int, day: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     # meal_index expects 1-based index (menu number 1..N) corresponding to A..N
     target_date = datetime.strptime(day, "%Y-%m-%d").date()
-    client = get_client(user)
+    client = await _get_client(user, db)
     
     # We need meal data first (to get boarder_id, etc.)
     # Check cache first or fetch
-    lunches = lunch_cache.get(user.id, day)
+    lunches = await lunch_cache.aget(user.id, day)
     
     if not lunches:
         try:
-            week_data = client.get_meals_for_date(target_date)
-            for d_str, m_data in week_data.items():
-                lunch_cache.set(user.id, d_str, m_data)
-            lunches = week_data.get(day)
+            lunches = (await _fetch_week(user, target_date, db)).get(day)
         except SessionExpiredException:
-            user.edupage_session_data = None
-            db.commit()
+            await _expire_session(user, db)
             raise HTTPException(status_code=401, detail="Session expired")
         except NotLoggedInException:
             raise HTTPException(status_code=401, detail="Session expired")
@@ -161,36 +343,33 @@ def order_lunch(meal_index: int, day: str, user: User = Depends(get_current_user
         raise HTTPException(status_code=400, detail="Invalid meal index")
 
     try:
-        client.order(lunches, calc_letter)
-        # Invalidate cache
-        lunch_cache.invalidate(user.id, day)
-        return {"message": "Ordered"}
+        await client.order(lunches, calc_letter)
     except SessionExpiredException:
-        user.edupage_session_data = None
-        db.commit()
+        await _expire_session(user, db)
         raise HTTPException(status_code=401, detail="Session expired")
     except NotLoggedInException:
         raise HTTPException(status_code=401, detail="Session expired")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to order: {str(e)}")
 
+    # The order went through upstream: from here on, failures are logged, not reported as a failed order
+    await lunch_cache.ainvalidate(user.id, day)
+    await _record_order_change(user, db)
+    return {"message": "Ordered"}
+
 @router.post("/cancel")
-def cancel_lunch(meal_index: int, day: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def cancel_lunch(meal_index: int, day: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     # meal_index is ignored for cancel usually? Or strictly "sign off"?
     # internal client cancel method takes meal_data
     target_date = datetime.strptime(day, "%Y-%m-%d").date()
-    client = get_client(user)
+    client = await _get_client(user, db)
     
-    lunches = lunch_cache.get(user.id, day)
+    lunches = await lunch_cache.aget(user.id, day)
     if not lunches:
         try:
-            week_data = client.get_meals_for_date(target_date)
-            for d_str, m_data in week_data.items():
-                lunch_cache.set(user.id, d_str, m_data)
-            lunches = week_data.get(day)
+            lunches = (await _fetch_week(user, target_date, db)).get(day)
         except SessionExpiredException:
-            user.edupage_session_data = None
-            db.commit()
+            await _expire_session(user, db)
             raise HTTPException(status_code=401, detail="Session expired")
         except NotLoggedInException:
             raise HTTPException(status_code=401, detail="Session expired")
@@ -199,14 +378,16 @@ def cancel_lunch(meal_index: int, day: str, user: User = Depends(get_current_use
          raise HTTPException(status_code=404, detail="No lunch found")
          
     try:
-        client.cancel(lunches)
-        lunch_cache.invalidate(user.id, day)
-        return {"message": "Canceled"}
+        await client.cancel(lunches)
     except SessionExpiredException:
-        user.edupage_session_data = None
-        db.commit()
+        await _expire_session(user, db)
         raise HTTPException(status_code=401, detail="Session expired")
     except NotLoggedInException:
         raise HTTPException(status_code=401, detail="Session expired")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to cancel: {str(e)}")
+
+    # The cancel went through upstream: from here on, failures are logged, not reported as a failed cancel
+    await lunch_cache.ainvalidate(user.id, day)
+    await _record_order_change(user, db)
+    return {"message": "Canceled"}
@@ -1,73 +1,120 @@
-from fastapi import APIRouter, Depends, HTTPException, Header, UploadFile, File, Form
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, HTTPException, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User, Rating, Photo
-from database import SessionLocal
-from pydantic import BaseModel
+from identity import get_async_db, get_current_user
+from rating_stats import upsert_rating, upsert_ratings
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, List
 import shutil
 import os
-import uuid
 from storage import get_storage_service
+from photo_variants import process_photo
+from listing_versions import bump_versions, meal_key
+from content_store import acquire_object, object_key, release_photo, remove_local, shared_variants, spool_and_hash, store_file
 
 router = APIRouter(prefix="/social", tags=["social"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def get_current_user(user_id: str = Header(None), db: Session = Depends(get_db)):
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Missing User ID")
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid User")
-    return user
+MAX_STARS = 5
 
 class RateRequest(BaseModel):
     meal_identifier: str
-    stars: float
+    stars: float = Field(gt=0, le=MAX_STARS)
 
 @router.post("/rate")
-def rate_lunch(request: RateRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Check if rating exists
-    rating = db.query(Rating).filter(Rating.user_id == user.id, Rating.meal_identifier == request.meal_identifier).first()
-    if rating:
-        rating.stars = request.stars
-    else:
-        rating = Rating(user_id=user.id, meal_identifier=request.meal_identifier, stars=request.stars)
-        db.add(rating)
-    
-    db.commit()
+async def rate_lunch(request: RateRequest, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    # Upserts against the unique index: concurrent taps update the same row instead of adding another
+    await upsert_rating(db, user.id, request.meal_identifier, request.stars)
+    await db.commit()
     return {"message": "Rated"}
 
+# Most meals a week view offers; larger batches are rejected as a whole
+RATE_BATCH_MAX = 100
+
+
+def _rating_error(item: Any):
+    """Validate one batch item. Returns (RateRequest, None) or (None, error message)."""
+    try:
+        rating = RateRequest.model_validate(item)
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors())
+    if not rating.meal_identifier.strip():
+        return None, "meal_identifier: must not be empty"
+    return rating, None
+
+
+@router.post("/rate/batch")
+async def rate_lunches(items: List[Any] = Body(...), user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """
+    Rate several meals at once. Valid items are applied in one transaction (at most five
+    statements however many there are); invalid ones are reported per index without failing the batch.
+    """
+    if len(items) > RATE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {RATE_BATCH_MAX} ratings per batch")
+
+    results = []
+    ratings = {}  # meal_identifier -> stars; a repeated meal keeps its last rating
+    for index, item in enumerate(items):
+        rating, error = _rating_error(item)
+        if error:
+            results.append({"index": index, "status": "error", "detail": error})
+            continue
+        ratings[rating.meal_identifier] = rating.stars
+        results.append({"index": index, "status": "ok", "meal_identifier": rating.meal_identifier})
+
+    if ratings:
+        await upsert_ratings(db, user.id, ratings)
+        await db.commit()
+    return {"message": "Rated", "rated": len(ratings), "results": results}
+
 @router.post("/upload")
-def upload_photo(meal_identifier: str = Form(...), file: UploadFile = File(...), user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_photo(background_tasks: BackgroundTasks, meal_identifier: str = Form(...), file: UploadFile = File(...), user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     storage = get_storage_service()
     
     # Check if user already has a photo for this meal
-    existing_photo = db.query(Photo).filter(Photo.user_id == user.id, Photo.meal_identifier == meal_identifier).first()
+    existing_photo = (await db.execute(
+        select(Photo).where(Photo.user_id == user.id, Photo.meal_identifier == meal_identifier)
+    )).scalars().first()
     
     if existing_photo:
-        # Remove old file
-        storage.delete(existing_photo.photo_path)
-            
-        db.delete(existing_photo)
-        db.commit()
+        # Old files are deleted in the background once this commits (unless shared)
+        await release_photo(db, existing_photo)
+        await db.delete(existing_photo)
+        await bump_versions(db, [meal_key(meal_identifier)])
+        await db.commit()
     else:
         # Check total photos limit (max 5)
-        count = db.query(Photo).filter(Photo.meal_identifier == meal_identifier).count()
+        count = (await db.execute(
+            select(func.count()).select_from(Photo).where(Photo.meal_identifier == meal_identifier)
+        )).scalar_one()
         if count >= 5:
             raise HTTPException(status_code=400, detail="Max 5 photos per meal reached")
 
-    # Save file
-    filename = f"{uuid.uuid4()}_{file.filename}"
-    saved_path = storage.save(file.file, filename)
-        
-    photo = Photo(user_id=user.id, meal_identifier=meal_identifier, photo_path=saved_path)
-    db.add(photo)
-    db.commit()
+    # Stored under its content hash: identical uploads (e.g. retries) share one object
+    digest, local_copy = await run_in_threadpool(spool_and_hash, file.file)
+    saved_path = object_key(digest, file.filename, file.content_type)
+    try:
+        variants = {}
+        if await acquire_object(db, saved_path) == 1:
+            await run_in_threadpool(store_file, storage, local_copy, saved_path)
+        else:
+            variants = await shared_variants(db, saved_path)
+
+        photo = Photo(user_id=user.id, meal_identifier=meal_identifier, photo_path=saved_path, **variants)
+        db.add(photo)
+        await bump_versions(db, [meal_key(meal_identifier)])
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        remove_local(local_copy)
+        raise
+
+    if variants:
+        remove_local(local_copy)
+    else:
+        # Thumbnails are built after the response is sent; listings use the original until then
+        background_tasks.add_task(process_photo, photo.id, saved_path, local_copy)
     
     return {"message": "Uploaded", "path": saved_path}
 
@@ -75,15 +122,17 @@ class DeletePhotoRequest(BaseModel):
     meal_identifier: str
 
 @router.post("/delete_photo")
-def delete_photo(request: DeletePhotoRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    photo = db.query(Photo).filter(Photo.user_id == user.id, Photo.meal_identifier == request.meal_identifier).first()
+async def delete_photo(request: DeletePhotoRequest, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    photo = (await db.execute(
+        select(Photo).where(Photo.user_id == user.id, Photo.meal_identifier == request.meal_identifier)
+    )).scalars().first()
     if not photo:
         raise HTTPException(status_code=404, detail="Photo not found")
     
-    storage = get_storage_service()
-    storage.delete(photo.photo_path)
-        
-    db.delete(photo)
-    db.commit()
+    # Files are deleted in the background once this commits (unless shared)
+    await release_photo(db, photo)
+    await db.delete(photo)
+    await bump_versions(db, [meal_key(photo.meal_identifier)])
+    await db.commit()
     
     return {"message": "Deleted"}
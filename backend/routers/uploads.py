@@ -0,0 +1,70 @@
+"""
+Serving of locally stored uploads (STORAGE_TYPE=local) at /uploads/<name>.
+
+Content-addressed names (content_store: "<sha256>.jpg", "<sha256>.thumbnail.webp")
+never change content, so they get a strong ETag taken from the name and a one-year
+immutable Cache-Control. Older uuid names get a stat-based ETag and a shorter
+max-age. Conditional requests are answered with 304, and Range/If-Range are
+handled by FileResponse.
+
+With UPLOADS_X_ACCEL_PREFIX set (e.g. /protected-uploads/), the route only
+checks the name and sets the caching headers. The bytes are sent by nginx from
+an internal location (see nginx/nginx.conf), so uvicorn never streams the file.
+"""
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+from etags import etag_matches
+
+router = APIRouter(tags=["uploads"])
+
+# LocalStorage's directory
+UPLOAD_DIR = "uploads"
+UPLOADS_X_ACCEL_PREFIX = os.getenv("UPLOADS_X_ACCEL_PREFIX", "")
+# Older uuid-named uploads are never rewritten either, but may disappear when replaced
+LEGACY_UPLOAD_MAX_AGE = int(os.getenv("LEGACY_UPLOAD_MAX_AGE", "86400"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)*$")
+
+
+def _etag(name: str, stat_result) -> str:
+    if _CONTENT_ADDRESSED.match(name):
+        return f'"{name}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _cache_control(name: str) -> str:
+    if _CONTENT_ADDRESSED.match(name):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={LEGACY_UPLOAD_MAX_AGE}"
+
+
+@router.api_route("/uploads/{name}", methods=["GET", "HEAD"])
+async def get_upload(name: str, request: Request):
+    # Flat directory: no separators or dot-files (rules out traversal)
+    if "/" in name or "\\" in name or name.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = os.path.join(UPLOAD_DIR, name)
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    headers = {"Cache-Control": _cache_control(name)}
+    if UPLOADS_X_ACCEL_PREFIX:
+        # nginx serves the file (with its own ETag, conditional and range handling)
+        headers["X-Accel-Redirect"] = UPLOADS_X_ACCEL_PREFIX.rstrip("/") + "/" + quote(name)
+        return Response(headers=headers)
+
+    headers["ETag"] = _etag(name, stat_result)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, stat_result=stat_result)
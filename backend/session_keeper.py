@@ -2,12 +2,26 @@
 Session Keep-Alive Service
 
 Periodically pings all active Edupage sessions to keep them alive.
-If a session is expired, it clears the session data from the database.
+If a session is expired, it clears the session data from the database
+(unless the user has logged in again meanwhile).
+
+Pings run on a bounded thread pool and are spread with jitter across most of
+the interval instead of bursting at the start of the cycle.
+
+Only sessions idle for longer than the idle threshold are pinged; sessions
+recently used by the lunch/order routes already proved they are alive
+(users.last_upstream_success_at). The threshold adapts to observed expiries.
 """
 import logging
-from datetime import date
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
 
 from database import SessionLocal
@@ -19,59 +33,214 @@ logger = logging.getLogger(__name__)
 
 # How often to ping sessions (in minutes)
 KEEP_ALIVE_INTERVAL_MINUTES = 10
+# Max pings in flight at once
+KEEP_ALIVE_CONCURRENCY = int(os.getenv("KEEP_ALIVE_CONCURRENCY", "10"))
+# Fraction of the interval the pings are spread over (rest is slack so cycles don't overlap)
+KEEP_ALIVE_SPREAD_FRACTION = float(os.getenv("KEEP_ALIVE_SPREAD_FRACTION", "0.8"))
+
+# Sessions used against Edupage more recently than the idle threshold are skipped.
+# It starts at KEEP_ALIVE_IDLE_MINUTES, is lowered below the idle time at which
+# sessions were found expired, and creeps back up after cycles without expiries,
+# but never above the learned ceiling: the shortest idle time seen at an expiry,
+# minus one interval (a skipped session waits up to one more before its ping)
+# and KEEP_ALIVE_IDLE_MARGIN_MINUTES.
+KEEP_ALIVE_IDLE_MINUTES = float(os.getenv("KEEP_ALIVE_IDLE_MINUTES", "20"))
+KEEP_ALIVE_MIN_IDLE_MINUTES = float(os.getenv("KEEP_ALIVE_MIN_IDLE_MINUTES", "5"))
+KEEP_ALIVE_MAX_IDLE_MINUTES = float(os.getenv("KEEP_ALIVE_MAX_IDLE_MINUTES", "120"))
+KEEP_ALIVE_IDLE_MARGIN_MINUTES = float(os.getenv("KEEP_ALIVE_IDLE_MARGIN_MINUTES", "5"))
+KEEP_ALIVE_IDLE_STEP_MINUTES = 2
+
+idle_threshold_minutes = KEEP_ALIVE_IDLE_MINUTES
+idle_ceiling_minutes = KEEP_ALIVE_MAX_IDLE_MINUTES
 
 scheduler = BackgroundScheduler()
+_stop_event = threading.Event()
+
+# Summary of the most recent cycle (duration, success and expiry counts)
+last_cycle_stats: dict = {}
+
+
+def _ping_user(user) -> str:
+    """Ping one session. Returns "alive", "expired" or "error"."""
+    try:
+        # get_client will load into memory if not present (warmup)
+        client = get_client(user)
+        
+        # Cheap probe first; fall back to fetching today's meals if it can't tell. The
+        # probe only says "expired" on a login redirect or 401/403; anything weaker
+        # (e.g. a login form in the page) is confirmed by the fetch before clearing
+        alive = client.check_session_alive()
+        if alive is False:
+            raise SessionExpiredException("Liveness probe reported expired session")
+        if alive is not True:
+            client.get_meals_for_date(date.today())
+        
+        logger.debug(f"Session keeper: Session for user {user.id} is still alive")
+        return "alive"
+        
+    except SessionExpiredException:
+        logger.warning(f"Session keeper: Session expired for user {user.id}, clearing session data")
+        return "expired"
+        
+    except Exception as e:
+        # Don't clear on other errors (network issues, etc.)
+        logger.error(f"Session keeper: Error pinging session for user {user.id}: {e}")
+        return "error"
+
+
+def _ping_schedule(count: int, window_seconds: float) -> list:
+    """
+    Start offsets (seconds from cycle start) for `count` pings: one evenly sized slot
+    per ping across the window, with a random position inside each slot.
+    """
+    if count == 0 or window_seconds <= 0:
+        return [0.0] * count
+    slot = window_seconds / count
+    return [i * slot + random.uniform(0, slot) for i in range(count)]
+
+
+def _adapt_idle_threshold(expired_idle_minutes: list, any_alive: bool):
+    """
+    Lower the threshold when sessions expired (below the shortest observed idle time at
+    expiry, leaving two cycles of margin) and remember that bound as the ceiling; raise
+    the threshold slowly after clean cycles, up to the ceiling.
+    """
+    global idle_threshold_minutes, idle_ceiling_minutes
+    threshold = idle_threshold_minutes
+    if expired_idle_minutes:
+        observed = min(expired_idle_minutes)
+        idle_ceiling_minutes = min(
+            idle_ceiling_minutes, observed - KEEP_ALIVE_INTERVAL_MINUTES - KEEP_ALIVE_IDLE_MARGIN_MINUTES
+        )
+        threshold = min(threshold / 2, observed - 2 * KEEP_ALIVE_INTERVAL_MINUTES)
+    elif any_alive:
+        threshold += KEEP_ALIVE_IDLE_STEP_MINUTES
+    idle_threshold_minutes = max(KEEP_ALIVE_MIN_IDLE_MINUTES, min(idle_ceiling_minutes, threshold))
+
+
+def _clear_expired(db: Session, expired: list) -> list:
+    """
+    Clear the session data of expired (user_id, session data pinged) pairs, in the
+    caller's transaction. Each UPDATE only matches the stale session data, so a user
+    who logged in again during the cycle keeps the new session.
+    Returns the ids that were cleared.
+    """
+    cleared = []
+    for user_id, stale_data in expired:
+        matched = db.query(User).filter(
+            User.id == user_id, User.edupage_session_data == stale_data
+        ).update({User.edupage_session_data: None}, synchronize_session=False)
+        if matched:
+            cleared.append(user_id)
+        else:
+            logger.info(f"Session keeper: User {user_id} logged in again during the cycle, keeping the new session")
+    return cleared
+
+
+def _load_idle_users(idle_cutoff: datetime):
+    """Users with session data that have not talked to Edupage recently, and the count of skipped ones."""
+    db: Session = SessionLocal()
+    try:
+        with_session = db.query(User).filter(User.edupage_session_data.isnot(None))
+        users = with_session.filter(or_(
+            User.last_upstream_success_at.is_(None),
+            User.last_upstream_success_at < idle_cutoff
+        )).all()
+        return users, with_session.count() - len(users)
+    finally:
+        # Loaded attributes stay readable on the detached objects
+        db.close()
 
 
 def ping_all_sessions():
     """
-    Iterate through all users with session data and ping their sessions.
-    Clears session data for any expired sessions.
+    Ping every user whose session has been idle longer than the idle threshold,
+    at most KEEP_ALIVE_CONCURRENCY at a time.
+    Expired sessions are cleared in one batch at the end of the cycle (only where the
+    session data is still the one pinged); no database session is held while the
+    pings are spread across the cycle.
     """
     logger.info("Session keeper: Starting session ping cycle")
+    started = time.monotonic()
+    counts = {"alive": 0, "expired": 0, "error": 0, "skipped": 0}
     
-    db: Session = SessionLocal()
     try:
-        # Get all users with session data
-        users = db.query(User).filter(User.edupage_session_data.isnot(None)).all()
+        now = datetime.utcnow()
+        users, counts["skipped"] = _load_idle_users(now - timedelta(minutes=idle_threshold_minutes))
         
         if not users:
-            logger.info("Session keeper: No active sessions to ping")
+            logger.info("Session keeper: No idle sessions to ping")
+            _record_cycle(started, counts)
             return
         
-        logger.info(f"Session keeper: Pinging {len(users)} active session(s)")
-        
-        for user in users:
+        logger.info(f"Session keeper: Pinging {len(users)} idle session(s), skipping {counts['skipped']} recently active")
+
+        random.shuffle(users)
+        window = KEEP_ALIVE_INTERVAL_MINUTES * 60 * KEEP_ALIVE_SPREAD_FRACTION
+        offsets = _ping_schedule(len(users), window)
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=KEEP_ALIVE_CONCURRENCY, thread_name_prefix="session-keeper") as pool:
+            for user, offset in zip(users, offsets):
+                delay = started + offset - time.monotonic()
+                if delay > 0 and _stop_event.wait(delay):
+                    logger.info("Session keeper: Stopping mid-cycle")
+                    break
+                futures.append((user, pool.submit(_ping_user, user)))
+
+        alive_ids = []
+        expired = []
+        expired_idle_minutes = []
+        for user, future in futures:
+            result = future.result()
+            counts[result] += 1
+            if result == "expired":
+                expired.append((user.id, user.edupage_session_data))
+                if user.last_upstream_success_at is not None:
+                    expired_idle_minutes.append((now - user.last_upstream_success_at).total_seconds() / 60)
+            elif result == "alive":
+                alive_ids.append(user.id)
+
+        _adapt_idle_threshold(expired_idle_minutes, bool(alive_ids))
+
+        if alive_ids or expired:
+            # One short transaction for the cycle's results
+            db: Session = SessionLocal()
             try:
-                # get_client will load into memory if not present (warmup)
-                client = get_client(user)
-                
-                # Ping by fetching today's meals (lightweight check)
-                # Since this is "internal" client now, just running a fetch is good.
-                # get_meals_for_date might be "heavy" (week fetch), but it's fine for pings every 30m.
-                # Alternatively, we could add a lighter ping method to client, but this ensures functionality.
-                client.get_meals_for_date(date.today())
-                
-                logger.debug(f"Session keeper: Session for user {user.id} is still alive")
-                
-            except SessionExpiredException:
-                logger.warning(f"Session keeper: Session expired for user {user.id}, clearing session data")
-                user.edupage_session_data = None
-                
-                # Also clear from memory
-                clear_session(user.id)
+                if alive_ids:
+                    db.query(User).filter(User.id.in_(alive_ids)).update(
+                        {User.last_upstream_success_at: datetime.utcnow()}, synchronize_session=False
+                    )
+                cleared = _clear_expired(db, expired)
                 db.commit()
-                
-            except Exception as e:
-                # Don't clear on other errors (network issues, etc.)
-                logger.error(f"Session keeper: Error pinging session for user {user.id}: {e}")
+            finally:
+                db.close()
+            # Also clear from memory
+            for user_id in cleared:
+                clear_session(user_id)
                 
     except Exception as e:
         logger.error(f"Session keeper: Error during ping cycle: {e}")
-    finally:
-        db.close()
-    
-    logger.info("Session keeper: Ping cycle complete")
+
+    _record_cycle(started, counts)
+
+
+def _record_cycle(started: float, counts: dict):
+    global last_cycle_stats
+    duration = time.monotonic() - started
+    last_cycle_stats = {
+        "finished_at": datetime.utcnow().isoformat(),
+        "duration_seconds": round(duration, 2),
+        "pinged": counts["alive"] + counts["expired"] + counts["error"],
+        "idle_threshold_minutes": round(idle_threshold_minutes, 1),
+        "idle_ceiling_minutes": round(idle_ceiling_minutes, 1),
+        **counts,
+    }
+    logger.info(
+        f"Session keeper: Ping cycle complete in {duration:.1f}s "
+        f"({counts['alive']} alive, {counts['expired']} expired, {counts['error']} errors, "
+        f"{counts['skipped']} skipped; idle threshold now {idle_threshold_minutes:.0f} min)"
+    )
 
 
 def start_scheduler():
@@ -80,12 +249,16 @@ def start_scheduler():
         logger.warning("Session keeper: Scheduler already running")
         return
     
+    _stop_event.clear()
+
     scheduler.add_job(
         ping_all_sessions,
         trigger=IntervalTrigger(minutes=KEEP_ALIVE_INTERVAL_MINUTES),
         id='session_keep_alive',
         name='Keep Edupage sessions alive',
-        replace_existing=True
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
     )
     
     scheduler.start()
@@ -94,6 +267,7 @@ def start_scheduler():
 
 def stop_scheduler():
     """Stop the background scheduler."""
+    _stop_event.set()
     if scheduler.running:
         scheduler.shutdown(wait=False)
         logger.info("Session keeper: Stopped")
@@ -1,11 +1,144 @@
 
-import pickle
-import base64
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from typing import Dict
-from edupage_internal import EdupageClient
+from requests.cookies import create_cookie
+from edupage_internal import EdupageClient, AsyncEdupageClient
 
-# In-memory store: user_id (int) -> EdupageClient
-_sessions: Dict[int, EdupageClient] = {}
+# In-memory store: user_id (int) -> EdupageClient, least recently used first
+_sessions: "OrderedDict[int, EdupageClient]" = OrderedDict()
+# Async counterparts used by the async routes: user_id (int) -> AsyncEdupageClient
+_async_sessions: Dict[int, AsyncEdupageClient] = {}
+# user_id -> time.monotonic() of the last get_client/get_async_client for that user
+_last_used: Dict[int, float] = {}
+_registry_lock = threading.RLock()
+_last_idle_sweep = time.monotonic()
+
+# Registry bounds: least recently used sessions are closed beyond the max,
+# sessions unused for longer than the idle timeout are closed by a periodic sweep.
+# Evicted users are reloaded from users.edupage_session_data on next use.
+SESSION_REGISTRY_MAX = int(os.getenv("SESSION_REGISTRY_MAX", "1000"))
+SESSION_IDLE_TIMEOUT_SECONDS = int(os.getenv("SESSION_IDLE_TIMEOUT_MINUTES", "60")) * 60
+SESSION_IDLE_SWEEP_SECONDS = 60
+
+# users.last_upstream_success_at is rewritten at most this often per user
+ACTIVITY_WRITE_INTERVAL = timedelta(seconds=60)
+
+# Version of the JSON format of users.edupage_session_data
+SESSION_FORMAT_VERSION = 1
+
+
+def serialize_session(client: EdupageClient) -> str:
+    """
+    Compact JSON form of a logged in session, stored in users.edupage_session_data.
+    Cookies are [name, value, domain, path, expires, secure] rows.
+    """
+    state = {
+        "v": SESSION_FORMAT_VERSION,
+        "subdomain": client.subdomain,
+        "username": client.username,
+        "gsec_hash": client.gsec_hash,
+        "cookies": [_cookie_row(cookie) for cookie in client.session.cookies],
+    }
+    return json.dumps(state, separators=(",", ":"))
+
+
+def deserialize_session(session_data) -> dict:
+    """
+    Parse users.edupage_session_data into a state dict (see serialize_session).
+    Only the JSON format is read: legacy pickled rows are converted at startup
+    (migrations), so data read from the database is never unpickled here.
+    """
+    if isinstance(session_data, bytes):
+        session_data = session_data.decode('utf-8')
+    if not session_data.startswith("{"):
+        raise ValueError("Session data is not in the JSON format")
+    return json.loads(session_data)
+
+
+def migrate_session_data(legacy_state: dict) -> str:
+    """
+    JSON session data for an unpickled legacy state dict ({'cookies': RequestsCookieJar, ...}).
+    Used by the startup migration, the only place legacy rows are unpickled.
+    """
+    state = dict(legacy_state, cookies=[_cookie_row(cookie) for cookie in legacy_state.get("cookies", [])])
+    client = _restore_client(state)
+    try:
+        return serialize_session(client)
+    finally:
+        client.close()
+
+
+def _cookie_row(cookie) -> list:
+    return [cookie.name, cookie.value, cookie.domain, cookie.path, cookie.expires, cookie.secure]
+
+
+def _restore_client(state: dict) -> EdupageClient:
+    client = EdupageClient()
+    for name, value, domain, path, expires, secure in state.get("cookies", []):
+        client.session.cookies.set_cookie(
+            create_cookie(name, value, domain=domain, path=path, expires=expires, secure=secure)
+        )
+    client.subdomain = state.get("subdomain")
+    client.username = state.get("username")
+    client.gsec_hash = state.get("gsec_hash")
+    client.is_logged_in = True
+    return client
+
+
+def _touch(user_id: int):
+    """Mark a registry entry as just used. Caller holds the lock."""
+    _last_used[user_id] = time.monotonic()
+    if user_id in _sessions:
+        _sessions.move_to_end(user_id)
+
+
+def _register(user_id: int, client: EdupageClient):
+    """Add a client to the registry, closing whatever falls out of it. Caller holds the lock."""
+    previous = _sessions.pop(user_id, None)
+    if previous is not None and previous is not client:
+        previous.close()
+    _sessions[user_id] = client
+    _touch(user_id)
+    _evict_idle()
+    while len(_sessions) > SESSION_REGISTRY_MAX:
+        oldest = next(iter(_sessions))
+        _evict(oldest)
+
+
+def _evict(user_id: int):
+    """Drop a user's clients from memory and close their sockets. Caller holds the lock."""
+    client = _sessions.pop(user_id, None)
+    if client is not None:
+        client.close()
+    # Async clients share one pooled transport (closed on shutdown); they own no sockets
+    _async_sessions.pop(user_id, None)
+    _last_used.pop(user_id, None)
+
+
+def _evict_idle():
+    """Close sessions unused for SESSION_IDLE_TIMEOUT_SECONDS; runs at most every SESSION_IDLE_SWEEP_SECONDS."""
+    global _last_idle_sweep
+    now = time.monotonic()
+    if now - _last_idle_sweep < SESSION_IDLE_SWEEP_SECONDS:
+        return
+    _last_idle_sweep = now
+    for user_id in [u for u, used in _last_used.items() if now - used >= SESSION_IDLE_TIMEOUT_SECONDS]:
+        _evict(user_id)
+
+
+def registry_stats() -> dict:
+    with _registry_lock:
+        return {
+            "sessions": len(_sessions),
+            "async_sessions": len(_async_sessions),
+            "max_sessions": SESSION_REGISTRY_MAX,
+            "idle_timeout_seconds": SESSION_IDLE_TIMEOUT_SECONDS,
+        }
 
 def get_client(user) -> EdupageClient:
     """
@@ -14,35 +147,19 @@ def get_client(user) -> EdupageClient:
     If in DB, deserialize, add to memory, return it.
     Else return a new (not logged in) client.
     """
-    if user.id in _sessions:
-        return _sessions[user.id]
+    with _registry_lock:
+        client = _sessions.get(user.id)
+        if client is not None:
+            _touch(user.id)
+            _evict_idle()
+            return client
     
     # Not in memory, try to load from DB
     if user.edupage_session_data:
         try:
-            client = EdupageClient()
-            # Deserialize
-            # Format: base64(pickle(dict))
-            
-            # Handle string vs bytes
-            session_data = user.edupage_session_data
-            if isinstance(session_data, bytes):
-                session_data = session_data.decode('utf-8')
-                
-            data = base64.b64decode(session_data)
-            state = pickle.loads(data)
-            
-            client.session.cookies.update(state.get('cookies', {}))
-            client.subdomain = state.get('subdomain')
-            client.username = state.get('username')
-            client.gsec_hash = state.get('gsec_hash')
-            client.is_logged_in = True 
-            
-            # Additional check: parsing login data might be needed if we want 'client.data'
-            # but we usually don't serialize 'client.data'. 
-            # It's fine, we fetch what we need.
-            
-            _sessions[user.id] = client
+            client = _restore_client(deserialize_session(user.edupage_session_data))
+            with _registry_lock:
+                _register(user.id, client)
             return client
         except Exception as e:
             print(f"Failed to load session for user {user.id}: {e}")
@@ -51,6 +168,37 @@ def get_client(user) -> EdupageClient:
     # Return fresh client (caller will likely redirect to login)
     return EdupageClient()
 
+def get_async_client(user) -> AsyncEdupageClient:
+    """
+    Get an active AsyncEdupageClient for the user.
+    Built from the same session state as get_client (cookies, subdomain, gsec_hash),
+    so both clients act as the same Edupage session.
+    """
+    with _registry_lock:
+        client = _async_sessions.get(user.id)
+        if client is not None:
+            _touch(user.id)
+            return client
+
+    sync_client = get_client(user)
+    client = AsyncEdupageClient()
+    if not sync_client.is_logged_in:
+        # Not logged in: don't keep it, the next call should see a fresh login
+        return client
+
+    for cookie in sync_client.session.cookies:
+        client.cookies.set_cookie(cookie)
+    client.subdomain = sync_client.subdomain
+    client.username = sync_client.username
+    client.gsec_hash = sync_client.gsec_hash
+    client.is_logged_in = True
+
+    with _registry_lock:
+        # Only kept while the sync client is registered, so eviction drops both
+        if user.id in _sessions:
+            _async_sessions[user.id] = client
+    return client
+
 def create_session(user, username, password, subdomain) -> EdupageClient:
     """
     Creates a new session by logging in, and then updates storage.
@@ -65,25 +213,36 @@ def update_session(user, client: EdupageClient):
     Update the in-memory session and DB persistence.
     Should be called after a fresh login.
     """
-    # Key point: we are storing the client instance in memory
-    _sessions[user.id] = client
+    with _registry_lock:
+        # Async client is rebuilt from the new cookies on next use
+        _async_sessions.pop(user.id, None)
+        # Key point: we are storing the client instance in memory
+        _register(user.id, client)
     
     # Serialize for DB persistence
-    state = {
-        'cookies': client.session.cookies,
-        'subdomain': client.subdomain,
-        'username': client.username,
-        'gsec_hash': client.gsec_hash
-    }
-    pickled = pickle.dumps(state)
-    b64_data = base64.b64encode(pickled).decode('utf-8')
-    
-    user.edupage_session_data = b64_data
+    user.edupage_session_data = serialize_session(client)
+    user.last_upstream_success_at = datetime.utcnow()
     # Note: caller must commit DB transaction
 
+def mark_upstream_success(user) -> bool:
+    """
+    Record that the user's session just worked against Edupage, so the session keeper
+    can skip it. Throttled to one write per ACTIVITY_WRITE_INTERVAL.
+    Returns True if the user row changed (caller must commit DB transaction).
+    """
+    now = datetime.utcnow()
+    last = user.last_upstream_success_at
+    if last is not None and now - last < ACTIVITY_WRITE_INTERVAL:
+        return False
+    user.last_upstream_success_at = now
+    return True
+
 def clear_session(user_id: int):
     """
-    Remove from memory. Caller should also clear DB if needed.
+    Remove from memory and close its connections. Caller should also clear DB if needed.
     """
-    if user_id in _sessions:
-        del _sessions[user_id]
+    with _registry_lock:
+        _evict(user_id)
+    # The cached identity may still carry the cleared session data
+    from identity import invalidate_identity
+    invalidate_identity(user_id)
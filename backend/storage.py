@@ -2,6 +2,8 @@ import os
 import shutil
 import uuid
 import abc
+import itertools
+import threading
 from typing import Optional
 import mimetypes
 
@@ -13,7 +15,7 @@ class StorageService(abc.ABC):
 
     @abc.abstractmethod
     def delete(self, filename: str):
-        """Delete file"""
+        """Delete file (no error if it doesn't exist; raises on other failures)"""
         pass
 
     @abc.abstractmethod
@@ -70,56 +72,86 @@ class LocalStorage(StorageService):
             # So returning "/" + filename works.
         return f"{self.base_url}/{filename}"
 
+# Uploads larger than one part go up as multipart uploads, one part in memory at a time
+OCI_UPLOAD_PART_SIZE = int(os.getenv("OCI_UPLOAD_PART_MB", "8")) * 1024 * 1024
+
+
 class OCIStorage(StorageService):
-    def __init__(self):
-        import oci
+    def __init__(self, client=None, namespace: Optional[str] = None, bucket_name: Optional[str] = None,
+                 region: Optional[str] = None, part_size: int = OCI_UPLOAD_PART_SIZE):
+        """
+        Object Storage bucket from the OCI_* settings. Tests (and tools) can pass their
+        own client and namespace; the SDK is only needed to build the default client.
+        """
         self.config = {
             "user": os.environ.get("OCI_USER"),
             "fingerprint": os.environ.get("OCI_FINGERPRINT"),
             "key_file": os.environ.get("OCI_KEY_FILE"),
             "tenancy": os.environ.get("OCI_TENANCY"),
-            "region": os.environ.get("OCI_REGION")
+            "region": region or os.environ.get("OCI_REGION")
         }
-        # Validate config if needed, or rely on OCI SDK validation
-        self.client = oci.object_storage.ObjectStorageClient(self.config)
-        self.namespace = os.environ.get("OCI_NAMESPACE")
+        if client is None:
+            import oci
+            # Validate config if needed, or rely on OCI SDK validation
+            client = oci.object_storage.ObjectStorageClient(self.config)
+        self.client = client
+        # Looked up once per process (get_storage_service keeps one instance)
+        self.namespace = namespace or os.environ.get("OCI_NAMESPACE")
         if not self.namespace:
-             self.namespace = self.client.get_namespace().data
-        self.bucket_name = os.environ.get("OCI_BUCKET_NAME")
+            self.namespace = self.client.get_namespace().data
+        self.bucket_name = bucket_name or os.environ.get("OCI_BUCKET_NAME")
+        self.part_size = part_size
 
     def save(self, file_obj, filename: str) -> str:
-        # Strip "uploads/" if present for OCI object name cleanliness, or keep it?
-        # To match local structure, we might want to keep uniqueness.
-        # But "uploads/" folder notion in Object Storage is just prefix.
-        
-        # Let's clean the filename for OCI but store the resulting ID/Key in DB.
-        # Social router expects save to return something that is stored in DB.
-        
-        # If we want to switch seamlessly, we should probably stick to a convention.
-        # Let's just use the filename passed to us.
-        
-        # Read file content
-        content = file_obj.read()
-        # Reset file pointer if needed, or assume it's fresh. 
-        # SpooledTemporaryFile might need seek(0).
+        # The filename is used as the object name and returned for the DB, as with LocalStorage.
+        # Stream from the start of the file; small files are a single put_object.
         if hasattr(file_obj, 'seek'):
             file_obj.seek(0)
-            content = file_obj.read()
-            
-        self.client.put_object(
-            self.namespace,
-            self.bucket_name,
-            filename,
-            content,
-            content_type=mimetypes.guess_type(filename)[0]
-        )
+        content_type = mimetypes.guess_type(filename)[0]
+        first_part = file_obj.read(self.part_size)
+        next_part = file_obj.read(self.part_size) if len(first_part) == self.part_size else b""
+        if not next_part:
+            self.client.put_object(self.namespace, self.bucket_name, filename, first_part, content_type=content_type)
+        else:
+            self._multipart_upload(file_obj, filename, content_type, first_part, next_part)
         return filename
 
+    def _multipart_upload(self, file_obj, filename: str, content_type: Optional[str], *first_parts: bytes):
+        from oci.object_storage.models import (
+            CommitMultipartUploadDetails, CommitMultipartUploadPartDetails, CreateMultipartUploadDetails
+        )
+
+        upload_id = self.client.create_multipart_upload(
+            self.namespace, self.bucket_name,
+            CreateMultipartUploadDetails(object=filename, content_type=content_type)
+        ).data.upload_id
+        try:
+            parts = []
+            chunks = itertools.chain(first_parts, iter(lambda: file_obj.read(self.part_size), b""))
+            for part_num, chunk in enumerate(chunks, start=1):
+                response = self.client.upload_part(
+                    self.namespace, self.bucket_name, filename, upload_id, part_num, chunk
+                )
+                parts.append(CommitMultipartUploadPartDetails(part_num=part_num, etag=response.headers["etag"]))
+            self.client.commit_multipart_upload(
+                self.namespace, self.bucket_name, filename, upload_id,
+                CommitMultipartUploadDetails(parts_to_commit=parts)
+            )
+        except Exception:
+            # Don't leave uncommitted parts behind (they are billed until aborted)
+            try:
+                self.client.abort_multipart_upload(self.namespace, self.bucket_name, filename, upload_id)
+            except Exception as e:
+                print(f"Error aborting multipart upload {upload_id} of {filename}: {e}")
+            raise
+
     def delete(self, filename: str):
+        # Errors propagate so the deletion outbox can retry; an already missing object is fine
         try:
             self.client.delete_object(self.namespace, self.bucket_name, filename)
         except Exception as e:
-            print(f"Error deleting object {filename}: {e}")
+            if getattr(e, "status", None) != 404:
+                raise
 
     def get_url(self, filename: str) -> str:
         # Public URL format: https://objectstorage.{region}.oraclecloud.com/n/{namespace}/b/{bucket}/o/{object}
@@ -128,8 +160,18 @@ class OCIStorage(StorageService):
         region = self.config["region"]
         return f"https://objectstorage.{region}.oraclecloud.com/n/{self.namespace}/b/{self.bucket_name}/o/{filename}"
 
+_storage_service: Optional[StorageService] = None
+_storage_service_lock = threading.Lock()
+
+
 def get_storage_service() -> StorageService:
-    storage_type = os.getenv("STORAGE_TYPE", "local").lower()
-    if storage_type == "oci":
-        return OCIStorage()
-    return LocalStorage()
+    """Return the process-wide storage service (one OCI client and namespace lookup per process)."""
+    global _storage_service
+    with _storage_service_lock:
+        if _storage_service is None:
+            storage_type = os.getenv("STORAGE_TYPE", "local").lower()
+            if storage_type == "oci":
+                _storage_service = OCIStorage()
+            else:
+                _storage_service = LocalStorage()
+        return _storage_service
@@ -0,0 +1,156 @@
+"""
+Durable queue of storage deletions (the storage_deletions outbox table).
+
+Routes enqueue the files of a removed photo in the same transaction as the row
+change, so they return without waiting on the storage backend and a crash can't
+lose a deletion. A scheduler job drains due entries in batches, deleting
+concurrently. A failed delete is retried with exponential backoff; once the
+attempts are exhausted it's logged as an error and kept in the table.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from apscheduler.triggers.interval import IntervalTrigger
+
+from models import StorageDeletion, StoredObject
+
+logger = logging.getLogger(__name__)
+
+# How often the queue is drained (in seconds)
+STORAGE_DELETE_INTERVAL_SECONDS = int(os.getenv("STORAGE_DELETE_INTERVAL_SECONDS", "30"))
+# Entries claimed per transaction, and deletes in flight at once
+STORAGE_DELETE_BATCH_SIZE = int(os.getenv("STORAGE_DELETE_BATCH_SIZE", "50"))
+STORAGE_DELETE_CONCURRENCY = int(os.getenv("STORAGE_DELETE_CONCURRENCY", "4"))
+# Retries back off from 30 s, doubling, up to 6 h; after the last attempt the entry is parked
+STORAGE_DELETE_MAX_ATTEMPTS = int(os.getenv("STORAGE_DELETE_MAX_ATTEMPTS", "10"))
+STORAGE_DELETE_RETRY_BASE_SECONDS = 30
+STORAGE_DELETE_RETRY_MAX_SECONDS = 6 * 60 * 60
+
+# Summary of the most recent drain (see /api/stats)
+last_drain_stats: dict = {}
+
+
+def enqueue_deletions(db, paths, object_key: str = None) -> None:
+    """
+    Queue stored files for deletion. Doesn't commit: commit it with the row change.
+    With object_key, the files are kept if that content object is referenced again by then.
+    """
+    db.add_all([StorageDeletion(path=path, object_key=object_key) for path in paths if path])
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    seconds = STORAGE_DELETE_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, STORAGE_DELETE_RETRY_MAX_SECONDS))
+
+
+def _delete(storage, path: str):
+    """Returns None on success, else the error."""
+    try:
+        storage.delete(path)
+        return None
+    except Exception as e:
+        return e
+
+
+def _drain_batch(db, storage, pool) -> dict:
+    """Claim and process one batch of due entries in one transaction."""
+    now = datetime.utcnow()
+    query = (
+        select(StorageDeletion)
+        .where(StorageDeletion.next_attempt_at <= now)
+        .order_by(StorageDeletion.next_attempt_at, StorageDeletion.id)
+        .limit(STORAGE_DELETE_BATCH_SIZE)
+    )
+    if db.bind.dialect.name == "postgresql":
+        # Every worker process drains; each claims different rows
+        query = query.with_for_update(skip_locked=True)
+    entries = db.execute(query).scalars().all()
+    counts = {"deleted": 0, "retrying": 0, "failed": 0, "referenced": 0}
+    if not entries:
+        return counts
+
+    # Content objects uploaded again since they were queued stay. The row lock holds
+    # off a concurrent re-upload (content_store.acquire_object) until this commits.
+    keys = {entry.object_key for entry in entries if entry.object_key}
+    if keys:
+        refs = select(StoredObject.key, StoredObject.refcount).where(StoredObject.key.in_(keys))
+        if db.bind.dialect.name == "postgresql":
+            refs = refs.with_for_update()
+        referenced = {key for key, refcount in db.execute(refs) if refcount > 0}
+        for entry in [e for e in entries if e.object_key in referenced]:
+            db.delete(entry)
+            counts["referenced"] += 1
+        entries = [e for e in entries if e.object_key not in referenced]
+
+    errors = pool.map(lambda entry: _delete(storage, entry.path), entries)
+    for entry, error in zip(entries, errors):
+        if error is None:
+            db.delete(entry)
+            counts["deleted"] += 1
+            continue
+        entry.attempts += 1
+        entry.last_error = str(error)[:1000]
+        if entry.attempts >= STORAGE_DELETE_MAX_ATTEMPTS:
+            entry.next_attempt_at = None
+            counts["failed"] += 1
+            logger.error(f"Storage outbox: Giving up deleting {entry.path} after {entry.attempts} attempts: {error}")
+        else:
+            entry.next_attempt_at = now + _retry_delay(entry.attempts)
+            counts["retrying"] += 1
+            logger.warning(f"Storage outbox: Deleting {entry.path} failed (attempt {entry.attempts}), will retry: {error}")
+    db.commit()
+    return counts
+
+
+def drain_deletions(max_batches: int = 20) -> dict:
+    """Process due deletions, batch by batch, until none are due (or max_batches)."""
+    from database import SessionLocal
+    from storage import get_storage_service
+
+    started = time.monotonic()
+    storage = get_storage_service()
+    totals = {"deleted": 0, "retrying": 0, "failed": 0, "referenced": 0}
+    db = SessionLocal()
+    try:
+        with ThreadPoolExecutor(max_workers=STORAGE_DELETE_CONCURRENCY, thread_name_prefix="storage-delete") as pool:
+            for _ in range(max_batches):
+                counts = _drain_batch(db, storage, pool)
+                for key, value in counts.items():
+                    totals[key] += value
+                if sum(counts.values()) < STORAGE_DELETE_BATCH_SIZE:
+                    break
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Storage outbox: Error while draining: {e}")
+    finally:
+        db.close()
+
+    global last_drain_stats
+    last_drain_stats = {
+        "finished_at": datetime.utcnow().isoformat(),
+        "duration_seconds": round(time.monotonic() - started, 2),
+        **totals,
+    }
+    if any(totals.values()):
+        logger.info(
+            f"Storage outbox: Deleted {totals['deleted']}, {totals['retrying']} to retry, {totals['failed']} given up"
+        )
+    return totals
+
+
+def schedule_deletion_drain(scheduler):
+    """Add the drain job to the app's background scheduler."""
+    scheduler.add_job(
+        drain_deletions,
+        trigger=IntervalTrigger(seconds=STORAGE_DELETE_INTERVAL_SECONDS),
+        id='storage_deletion_drain',
+        name='Delete queued storage files',
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    logger.info(f"Storage outbox: Draining every {STORAGE_DELETE_INTERVAL_SECONDS} seconds")
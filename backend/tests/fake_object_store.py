@@ -0,0 +1,91 @@
+"""
+In-memory stand-in for oci.object_storage.ObjectStorageClient, covering the calls
+OCIStorage makes. Responses mimic the SDK's (`.data`, `.headers`).
+"""
+import hashlib
+import itertools
+from types import SimpleNamespace
+
+
+class FakeServiceError(Exception):
+    def __init__(self, status, code):
+        super().__init__(f"{status} {code}")
+        self.status = status
+        self.code = code
+
+
+class FakeObjectStorageClient:
+    def __init__(self, namespace="testns", fail_on_part=None):
+        self.namespace = namespace
+        self.objects = {}            # (bucket, name) -> bytes
+        self.content_types = {}      # (bucket, name) -> content type
+        self.uploads = {}            # upload_id -> {"bucket", "object", "content_type", "parts"}
+        self.aborted = []
+        self.calls = []
+        self.largest_body = 0
+        self.fail_on_part = fail_on_part
+        self._upload_ids = itertools.count(1)
+
+    def _body(self, body):
+        data = body if isinstance(body, bytes) else body.read()
+        self.largest_body = max(self.largest_body, len(data))
+        return data
+
+    def get_namespace(self):
+        self.calls.append("get_namespace")
+        return SimpleNamespace(data=self.namespace)
+
+    def put_object(self, namespace_name, bucket_name, object_name, put_object_body, content_type=None, **kwargs):
+        self.calls.append("put_object")
+        self.objects[(bucket_name, object_name)] = self._body(put_object_body)
+        self.content_types[(bucket_name, object_name)] = content_type
+        return SimpleNamespace(data=None, headers={"etag": "put"})
+
+    def get_object(self, namespace_name, bucket_name, object_name, **kwargs):
+        self.calls.append("get_object")
+        if (bucket_name, object_name) not in self.objects:
+            raise FakeServiceError(404, "ObjectNotFound")
+        return SimpleNamespace(data=SimpleNamespace(content=self.objects[(bucket_name, object_name)]))
+
+    def delete_object(self, namespace_name, bucket_name, object_name, **kwargs):
+        self.calls.append("delete_object")
+        if self.objects.pop((bucket_name, object_name), None) is None:
+            raise FakeServiceError(404, "ObjectNotFound")
+        return SimpleNamespace(data=None)
+
+    def create_multipart_upload(self, namespace_name, bucket_name, create_multipart_upload_details, **kwargs):
+        self.calls.append("create_multipart_upload")
+        upload_id = f"upload-{next(self._upload_ids)}"
+        self.uploads[upload_id] = {
+            "bucket": bucket_name,
+            "object": create_multipart_upload_details.object,
+            "content_type": create_multipart_upload_details.content_type,
+            "parts": {},
+        }
+        return SimpleNamespace(data=SimpleNamespace(upload_id=upload_id))
+
+    def upload_part(self, namespace_name, bucket_name, object_name, upload_id, upload_part_num, upload_part_body, **kwargs):
+        self.calls.append("upload_part")
+        if upload_part_num == self.fail_on_part:
+            raise FakeServiceError(503, "ServiceUnavailable")
+        data = self._body(upload_part_body)
+        self.uploads[upload_id]["parts"][upload_part_num] = data
+        return SimpleNamespace(data=None, headers={"etag": hashlib.md5(data).hexdigest()})
+
+    def commit_multipart_upload(self, namespace_name, bucket_name, object_name, upload_id, commit_multipart_upload_details, **kwargs):
+        self.calls.append("commit_multipart_upload")
+        upload = self.uploads.pop(upload_id)
+        parts = []
+        for part in commit_multipart_upload_details.parts_to_commit:
+            data = upload["parts"][part.part_num]
+            assert part.etag == hashlib.md5(data).hexdigest()
+            parts.append((part.part_num, data))
+        self.objects[(bucket_name, object_name)] = b"".join(data for _, data in sorted(parts))
+        self.content_types[(bucket_name, object_name)] = upload["content_type"]
+        return SimpleNamespace(data=None)
+
+    def abort_multipart_upload(self, namespace_name, bucket_name, object_name, upload_id, **kwargs):
+        self.calls.append("abort_multipart_upload")
+        self.uploads.pop(upload_id)
+        self.aborted.append(upload_id)
+        return SimpleNamespace(data=None)
@@ -0,0 +1,280 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from cache import SHARED_OWNER, LunchCache, MemoryCacheBackend
+from meals import Meal
+
+WEEK = {
+    "2026-01-05": Meal.from_dict({"date": "2026-01-05", "menus": [{"name": "Soup", "number": None}]}),
+    "2026-01-07": Meal.from_dict({"date": "2026-01-07", "menus": [], "ordered_meal": "A"}),
+}
+
+
+def test_concurrent_threaded_misses_share_one_fetch():
+    cache = LunchCache()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return WEEK
+
+    n = 8
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        # Different days of the same week all coalesce on the (user, week) key
+        futures = [pool.submit(cache.load_week, 1, "myschool", date(2026, 1, 5 + i % 5), loader) for i in range(n)]
+        started.wait(timeout=5)
+        time.sleep(0.05)
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+
+    assert len(calls) == 1
+    assert all(r is WEEK for r in results)
+    assert cache.get(1, "2026-01-07") == WEEK["2026-01-07"]
+
+
+def test_concurrent_async_misses_share_one_fetch():
+    cache = LunchCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return WEEK
+
+    async def run():
+        return await asyncio.gather(*[cache.aload_week(1, "myschool", date(2026, 1, 7), loader) for _ in range(20)])
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(r is WEEK for r in results)
+
+
+def test_async_waiter_joins_threaded_fetch():
+    cache = LunchCache()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return WEEK
+
+    async def never_called():
+        raise AssertionError("async caller must wait for the running fetch")
+
+    thread = threading.Thread(target=cache.load_week, args=(1, "myschool", date(2026, 1, 5), loader))
+    thread.start()
+    started.wait(timeout=5)
+
+    async def run():
+        waiter = asyncio.ensure_future(cache.aload_week(1, "myschool", date(2026, 1, 6), never_called))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await waiter
+
+    assert asyncio.run(run()) is WEEK
+    thread.join(timeout=5)
+    assert len(calls) == 1
+
+
+def test_failed_fetch_is_propagated_and_not_cached():
+    cache = LunchCache()
+
+    async def failing():
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*[cache.aload_week(1, "myschool", date(2026, 1, 7), failing) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.get_week(1, date(2026, 1, 7)) is None
+
+
+def test_invalidation_during_fetch_discards_stale_result():
+    cache = LunchCache()
+
+    def loader():
+        # An order lands while the week is being fetched
+        cache.invalidate(1, "2026-01-07")
+        return WEEK
+
+    assert cache.load_week(1, "myschool", date(2026, 1, 7), loader) is WEEK
+    assert cache.get_week(1, date(2026, 1, 7)) is None
+
+
+def test_lru_eviction_and_stats():
+    backend = MemoryCacheBackend(max_entries=2)
+    backend.set(1, "2026-01-05", "a")
+    backend.set(1, "2026-01-06", "b")
+    assert backend.get(1, "2026-01-05") == "a"  # now most recently used
+
+    backend.set(2, "2026-01-05", "c")  # evicts (1, 2026-01-06)
+
+    assert backend.get(1, "2026-01-06") is None
+    assert backend.get(1, "2026-01-05") == "a"
+    assert backend.get(2, "2026-01-05") == "c"
+    stats = backend.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_expired_entries_are_swept_without_reads(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    backend = MemoryCacheBackend(ttl_seconds=60, sweep_interval_seconds=30)
+    backend.set(1, "2026-01-05", "a")
+    backend.set(2, "2026-01-05", "b")
+
+    now[0] += 61
+    backend.set(3, "2026-01-05", "c")  # any access past the interval triggers a sweep
+
+    stats = backend.stats()
+    assert stats["entries"] == 1
+    assert stats["users"] == 1
+    assert stats["expirations"] == 2
+
+
+def test_clear_user_only_touches_that_user():
+    cache = LunchCache()
+    cache.set_week(1, "myschool", date(2026, 1, 7), WEEK)
+    cache.set(11, "myschool", "2026-01-05", WEEK["2026-01-05"])
+
+    cache.clear_user(1)
+
+    assert cache.get_week(1, date(2026, 1, 7)) is None
+    assert cache.get(1, "2026-01-05") is None
+    assert cache.get(11, "2026-01-05") == WEEK["2026-01-05"]
+
+
+def test_menus_are_shared_per_school_with_per_user_order_state():
+    cache = LunchCache()
+    menus = [{"name": "Soup", "number": None}, {"name": "Pasta", "number": "1"}, {"name": "Rice", "number": "2"}]
+    # Same school, same day, different orders
+    for user_id, ordered in ((1, "A"), (2, "B"), (3, None)):
+        meal = Meal.from_dict({"date": "2026-01-07", "menus": menus, "ordered_meal": ordered, "boarder_id": str(user_id)})
+        cache.set_week(user_id, "myschool", date(2026, 1, 7), {"2026-01-07": meal})
+    cache.set_week(4, "otherschool", date(2026, 1, 7), {"2026-01-07": Meal.from_dict({"date": "2026-01-07", "menus": []})})
+
+    shared = [key for key in cache._backend._cache if key[0] == SHARED_OWNER]
+    assert sorted(key for _, key in shared) == ["menu:myschool:2026-01-07", "menu:otherschool:2026-01-07"]
+    assert [cache.get(u, "2026-01-07").ordered_meal for u in (1, 2, 3)] == ["A", "B", None]
+    assert cache.get(2, "2026-01-07").boarder_id == "2"
+    assert cache.get(1, "2026-01-07").menus == cache.get(3, "2026-01-07").menus
+    assert cache.get(4, "2026-01-07").menus == ()
+
+    # An order by user 1 leaves the other users and the shared menu in place
+    cache.invalidate(1, "2026-01-07")
+    assert cache.get(1, "2026-01-07") is None
+    assert cache.get_week(2, date(2026, 1, 5))["2026-01-07"].ordered_meal == "B"
+
+    # A user's layer without its shared menu is a miss
+    cache._backend.delete(SHARED_OWNER, "menu:myschool:2026-01-07")
+    assert cache.get(2, "2026-01-07") is None
+    assert cache.get_week(2, date(2026, 1, 7)) is None
+
+
+def test_sqlite_backend_is_shared_between_workers(tmp_path):
+    from datetime import datetime
+    from cache import SQLiteCacheBackend
+    from meals import Meal
+
+    path = str(tmp_path / "lunch_cache.sqlite3")
+    # Two caches on the same file stand in for two uvicorn workers
+    worker_a = LunchCache(backend=SQLiteCacheBackend(path))
+    worker_b = LunchCache(backend=SQLiteCacheBackend(path))
+    meal = Meal.from_dict({"date": "2026-01-07", "can_be_changed_until": datetime(2026, 1, 6, 14, 0), "menus": [{"name": "Soup", "number": None}]})
+
+    worker_a.set_week(1, "myschool", date(2026, 1, 7), {"2026-01-07": meal})
+
+    assert worker_b.get(1, "2026-01-07") == meal
+    assert worker_b.get_week(1, date(2026, 1, 5)) == {"2026-01-07": meal}
+
+    # Invalidation after an order in one worker is seen by the other
+    worker_b.invalidate(1, "2026-01-07")
+    assert worker_a.get(1, "2026-01-07") is None
+    assert worker_a.get_week(1, date(2026, 1, 7)) is None
+
+
+def test_sqlite_backend_invalidation_in_other_worker_discards_running_fetch(tmp_path):
+    from cache import SQLiteCacheBackend
+
+    path = str(tmp_path / "lunch_cache.sqlite3")
+    worker_a = LunchCache(backend=SQLiteCacheBackend(path))
+    worker_b = LunchCache(backend=SQLiteCacheBackend(path))
+
+    def loader():
+        worker_b.clear_user(1)
+        return WEEK
+
+    assert worker_a.load_week(1, "myschool", date(2026, 1, 7), loader) == WEEK
+    assert worker_b.get_week(1, date(2026, 1, 7)) is None
+
+
+def test_sqlite_backend_expiry_and_cap(tmp_path, monkeypatch):
+    from cache import SQLiteCacheBackend
+
+    now = [1000.0]
+    monkeypatch.setattr("cache.time.time", lambda: now[0])
+    backend = SQLiteCacheBackend(str(tmp_path / "c.sqlite3"), ttl_seconds=60, max_entries=2)
+
+    backend.set(1, "a", 1)
+    now[0] += 1
+    backend.set(1, "b", 2)
+    now[0] += 1
+    backend.set(2, "c", 3)
+    assert backend.sweep_expired() == 1  # over the cap: oldest entry dropped
+    assert backend.get(1, "a") is None
+
+    now[0] += 61
+    assert backend.get(1, "b") is None
+    backend.sweep_expired()
+    stats = backend.stats()
+    assert stats["entries"] == 0
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 2
+
+
+def test_sqlite_backend_async_loads_run_off_the_loop_and_store_a_week_in_one_commit(tmp_path):
+    from cache import SQLiteCacheBackend
+
+    backend = SQLiteCacheBackend(str(tmp_path / "lunch_cache.sqlite3"))
+    cache = LunchCache(backend=backend)
+    loop_thread = threading.get_ident()
+    backend_threads = set()
+    commits = []
+
+    for name in ("get", "set_many", "generation"):
+        method = getattr(backend, name)
+
+        def wrapped(*args, _method=method):
+            backend_threads.add(threading.get_ident())
+            conn = backend._conn()
+            conn.set_trace_callback(lambda sql: commits.append(sql) if sql == "COMMIT" else None)
+            return _method(*args)
+
+        setattr(backend, name, wrapped)
+
+    async def loader():
+        return WEEK
+
+    async def load():
+        return await cache.aload_week(1, "myschool", date(2026, 1, 7), loader)
+
+    assert asyncio.run(load()) == WEEK
+    assert loop_thread not in backend_threads
+    assert len(commits) == 1  # two menus, two statuses and the week entry
+    assert cache.get_week(1, date(2026, 1, 7)) == WEEK
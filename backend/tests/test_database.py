@@ -0,0 +1,102 @@
+import pytest
+
+from database import _pool_options, async_database_url
+
+
+def test_async_database_url_picks_async_driver():
+    assert async_database_url("postgresql://u:p@db:5432/app") == "postgresql+asyncpg://u:p@db:5432/app"
+    assert async_database_url("postgresql+psycopg2://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert async_database_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+
+
+def test_pool_options_only_for_server_databases():
+    assert _pool_options("sqlite:///./app.db") == {}
+    options = _pool_options("postgresql://u:p@db/app")
+    assert options["pool_pre_ping"] is True
+    assert set(options) == {"pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping"}
+
+
+def test_startup_backfills_rating_stats_once():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import StaticPool
+    from database import Base
+    from migrations import run_migrations
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO ratings (user_id, meal_identifier, stars) VALUES (1, 'Soup', 4), (2, 'Soup', 2), (1, 'Rice', 5)"))
+
+    run_migrations(engine)
+    with engine.begin() as conn:
+        # Later totals come from rate_lunch; a restart must not rebuild over them
+        conn.execute(text("UPDATE meal_rating_stats SET rating_count = 9 WHERE meal_identifier = 'Rice'"))
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT meal_identifier, rating_count, rating_sum FROM meal_rating_stats ORDER BY meal_identifier")).fetchall()
+    assert [tuple(r) for r in rows] == [("Rice", 9, 5.0), ("Soup", 2, 6.0)]
+
+
+def test_startup_deduplicates_ratings_and_adds_unique_index():
+    from sqlalchemy import create_engine, inspect, text
+    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy.pool import StaticPool
+    from database import Base
+    from migrations import run_migrations
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # A database from before the unique index, with duplicates left by concurrent taps
+        conn.execute(text("DROP INDEX uq_ratings_user_meal"))
+        conn.execute(text("INSERT INTO ratings (id, user_id, meal_identifier, stars) VALUES"
+                          " (1, 1, 'Soup', 2), (2, 1, 'Soup', 5), (3, 2, 'Soup', 3), (4, 1, 'Rice', 4)"))
+        conn.execute(text("INSERT INTO meal_rating_stats VALUES ('Soup', 3, 10), ('Rice', 1, 4)"))
+
+    run_migrations(engine)
+    run_migrations(engine)  # idempotent
+
+    with engine.connect() as conn:
+        ratings = conn.execute(text("SELECT id, user_id, meal_identifier, stars FROM ratings ORDER BY id")).fetchall()
+        stats = conn.execute(text("SELECT meal_identifier, rating_count, rating_sum FROM meal_rating_stats ORDER BY meal_identifier")).fetchall()
+        assert "uq_ratings_user_meal" in {i["name"] for i in inspect(conn).get_indexes("ratings")}
+    assert [tuple(r) for r in ratings] == [(2, 1, "Soup", 5.0), (3, 2, "Soup", 3.0), (4, 1, "Rice", 4.0)]
+    assert [tuple(r) for r in stats] == [("Rice", 1, 4.0), ("Soup", 2, 8.0)]
+
+    with pytest.raises(IntegrityError), engine.begin() as conn:
+        conn.execute(text("INSERT INTO ratings (user_id, meal_identifier, stars) VALUES (1, 'Soup', 1)"))
+
+
+def test_concurrent_ratings_of_one_meal_keep_one_row_per_user(tmp_path):
+    import asyncio
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from database import Base
+    from rating_stats import upsert_rating
+
+    path = tmp_path / "ratings.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+
+    async def rate_concurrently():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        async def rate(user_id, stars):
+            async with sessions() as db:
+                await upsert_rating(db, user_id, "Soup", stars)
+                await db.commit()
+
+        await asyncio.gather(*(rate(1, stars) for stars in (1, 2, 3, 4)), rate(2, 5))
+        await async_engine.dispose()
+
+    asyncio.run(rate_concurrently())
+
+    with engine.connect() as conn:
+        ratings = conn.execute(text("SELECT user_id, stars FROM ratings ORDER BY user_id")).fetchall()
+        stats = conn.execute(text("SELECT rating_count, rating_sum FROM meal_rating_stats WHERE meal_identifier = 'Soup'")).one()
+    assert len(ratings) == 2
+    assert ratings[1] == (2, 5.0)
+    assert tuple(stats) == (2, ratings[0].stars + 5.0)
+    engine.dispose()
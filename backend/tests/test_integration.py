@@ -25,3 +25,6 @@ def test_real_login_and_fetch():
         assert isinstance(meals, dict)
     except Exception as e:
         pytest.fail(f"Fetching meals failed: {e}")
+
+    # The cheap liveness probe must never report a fresh session as expired
+    assert client.check_session_alive() in (True, None)
@@ -0,0 +1,53 @@
+"""
+Regression tests for menu page parsing, driven by the page corpus in
+tests/fixtures/menu_pages (anonymized menu pages in the formats Edupage serves:
+CRLF, LF and minified script blocks, multi-school payloads, login page).
+Each <name>.html has the expected parse result in <name>.expected.json.
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+from edupage_internal import EdupageClient, SessionExpiredException
+from menu_extract import ExtractionError, extract_edupage_value
+
+CORPUS = Path(__file__).parent / "fixtures" / "menu_pages"
+PAGES = sorted(CORPUS.glob("*.html"))
+
+
+def load_page(path: Path) -> str:
+    return path.read_text(encoding="utf-8")
+
+
+@pytest.mark.parametrize("page", PAGES, ids=[p.stem for p in PAGES])
+def test_menu_page_corpus(page):
+    client = EdupageClient()
+    client.subdomain = "myschool"
+    client.is_logged_in = True
+    expected = json.loads((CORPUS / f"{page.stem}.expected.json").read_text(encoding="utf-8"))
+
+    try:
+        result = {d_str: meal.to_dict() for d_str, meal in client._parse_menu_page(load_page(page)).items()}
+    except SessionExpiredException:
+        result = {"error": "SessionExpiredException"}
+
+    assert json.loads(json.dumps(result, default=lambda o: o.isoformat())) == expected
+
+
+def test_extract_skips_tricky_siblings():
+    content = (
+        'x = {edupageData: {"a": "}{\\"][", "b": [1, {"c": "]"}, [2]], "d\\u0061": {"k": -1.5e3, "n": null}},\r\n};'
+    )
+
+    assert extract_edupage_value(content, ["da", "k"]) == -1500.0
+    assert extract_edupage_value(content, ["b"]) == [1, {"c": "]"}, [2]]
+    assert extract_edupage_value(content, ["da", "missing"]) is None
+    assert extract_edupage_value(content, ["a", "nested"]) is None
+
+
+def test_extract_errors():
+    with pytest.raises(ExtractionError):
+        extract_edupage_value("<html>login</html>", ["myschool"])
+    with pytest.raises(ExtractionError):
+        extract_edupage_value('edupageData: {"a": [1, 2', ["b"])
@@ -2,6 +2,7 @@ import pytest
 from datetime import date
 from unittest.mock import MagicMock
 from edupage_internal import EdupageClient
+from meals import MenuItem
 def test_parse_single_meal_ordered_b():
     client = EdupageClient()
     
@@ -20,9 +21,9 @@ def test_parse_single_meal_ordered_b():
     result = client._parse_single_meal(raw_data, "12345", "2026-01-08", "2")
     
     assert result is not None
-    assert result['ordered_meal'] == "B"
-    assert len(result['menus']) == 2
-    assert result['menus'][0]['name'] == "Meal 1"
+    assert result.ordered_meal == "B"
+    assert len(result.menus) == 2
+    assert result.menus[0].name == "Meal 1"
 
 def test_parse_single_meal_ordered_v():
     client = EdupageClient()
@@ -37,7 +38,7 @@ def test_parse_single_meal_ordered_v():
     
     result = client._parse_single_meal(raw_data, "12345", "2026-01-08", "2")
     
-    assert result['ordered_meal'] == "C"
+    assert result.ordered_meal == "C"
 
 def test_parse_single_meal_cancelled():
     client = EdupageClient()
@@ -52,4 +53,130 @@ def test_parse_single_meal_cancelled():
     
     result = client._parse_single_meal(raw_data, "12345", "2026-01-08", "2")
     
-    assert result['ordered_meal'] is None
+    assert result.ordered_meal is None
+
+def test_parsed_meals_share_interned_names():
+    import json
+    client = EdupageClient()
+    raw = '{"isCooking": true, "rows": [{"menusStr": "1: ", "nazov": "Meal 1"}], "zmen_do": null}'
+
+    # Separate decodes, like two users fetching the same menu
+    first = client._parse_single_meal(json.loads(raw), "1", "2026-01-08", "2")
+    second = client._parse_single_meal(json.loads(raw), "2", "2026-01-08", "2")
+
+    assert first.menus[0].name is second.menus[0].name
+    assert first.to_dict()["menus"] == [{"name": "Meal 1", "number": "1"}]
+
+def test_async_client_get_meals_for_date():
+    import asyncio
+    import httpx
+    from edupage_internal import AsyncEdupageClient
+
+    page = (
+        'var x = {edupageData: {"myschool": {"novyListok": {'
+        '"addInfo": {"stravnikid": "12345"}, '
+        '"2026-01-08": {"2": {"isCooking": true, "evidencia": {"stav": "V", "obj": "B"}, '
+        '"rows": [{"menusStr": "1: ", "nazov": "Meal 1"}], "zmen_do": "2026-01-07T14:00:00"}}'
+        '}}},\r\n other: 1};'
+    )
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(200, text=page)
+
+    client = AsyncEdupageClient(transport=httpx.MockTransport(handler))
+    client.subdomain = "myschool"
+    client.is_logged_in = True
+
+    result = asyncio.run(client.get_meals_for_date(date(2026, 1, 8)))
+
+    assert requested == ["https://myschool.edupage.org/menu/?date=20260108"]
+    assert result["2026-01-08"].ordered_meal == "B"
+    assert result["2026-01-08"].boarder_id == "12345"
+    assert result["2026-01-08"].menus == (MenuItem("Meal 1", "1"),)
+
+@pytest.mark.parametrize("response, expected", [
+    ({"status_code": 302, "headers": {"Location": "/login/?cmd=MainLogin"}}, False),
+    ({"status_code": 200, "text": '<script>ASC.gsechash="abc123";</script>'}, True),
+    # A login form in the body is left for get_meals_for_date to confirm
+    ({"status_code": 200, "text": '<form action="/login/edubarLogin.php">'}, None),
+    ({"status_code": 401, "text": ""}, False),
+    ({"status_code": 200, "text": "<html>maintenance</html>"}, None),
+    ({"status_code": 503, "text": ""}, None),
+])
+def test_check_session_alive(mock_client, response, expected):
+    import requests_mock
+
+    with requests_mock.Mocker() as m:
+        m.get("https://myschool.edupage.org/user/", **response)
+        assert mock_client.check_session_alive() is expected
+
+def test_liveness_probe_keeps_its_connection_pooled():
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from requests.adapters import HTTPAdapter
+
+    # The marker is in the first chunk, the rest of the page is left unread by the check
+    page = b'<script>ASC.gsechash="abc123";</script>' + b"<div class=item>news</div>" * 4000
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            pass  # clients dropping connections mid-response
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    class LocalAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = request.url.replace("https://myschool.edupage.org", f"http://127.0.0.1:{server.server_port}")
+            return super().send(request, **kwargs)
+
+    client = EdupageClient()
+    client.session.mount("https://", LocalAdapter())
+    client.subdomain = "myschool"
+    client.is_logged_in = True
+    try:
+        assert [client.check_session_alive() for _ in range(3)] == [True, True, True]
+        assert len(connections) == 1
+    finally:
+        client.session.close()
+        server.shutdown()
+        server.server_close()
+
+def test_clients_share_connection_pool_but_not_cookies():
+    from edupage_internal import get_shared_adapter
+
+    first, second = EdupageClient(), EdupageClient()
+    first.session.cookies.set("PHPSESSID", "first", domain="myschool.edupage.org")
+
+    url = "https://myschool.edupage.org/menu/"
+    assert first.session.get_adapter(url) is second.session.get_adapter(url) is get_shared_adapter()
+    assert second.session.cookies.get("PHPSESSID") is None
+
+    # Closing one client must not close the pool under the other
+    shared = get_shared_adapter()
+    shared.close = MagicMock()
+    try:
+        first.close()
+        shared.close.assert_not_called()
+        assert second.session.get_adapter(url) is shared
+    finally:
+        del shared.close
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+from PIL import Image
+
+from photo_variants import VARIANT_SIZES, make_variants, variant_filename
+
+
+def jpeg(width, height, orientation=None):
+    image = Image.new("RGB", (width, height), (200, 120, 40))
+    out = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(out, "JPEG", quality=90, exif=exif)
+    out.seek(0)
+    return out
+
+
+def test_variants_are_resized_webp():
+    variants = make_variants(jpeg(4000, 3000))
+
+    assert set(variants) == set(VARIANT_SIZES)
+    for variant, data in variants.items():
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.format == "WEBP"
+            assert max(image.size) == VARIANT_SIZES[variant]
+            assert image.size[0] > image.size[1]
+
+
+def test_variants_follow_exif_orientation_and_never_upscale():
+    # Orientation 6: stored landscape, displayed portrait
+    variants = make_variants(jpeg(400, 300, orientation=6))
+
+    for data in variants.values():
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.size == (300, 400)
+
+
+def test_undecodable_upload_raises():
+    with pytest.raises(Exception):
+        make_variants(io.BytesIO(b"not an image"))
+
+
+def test_variant_filename_sits_next_to_original():
+    assert variant_filename("uploads/abc_lunch.jpg", "thumbnail") == "uploads/abc_lunch.thumbnail.webp"
+    assert variant_filename("abc_lunch", "large") == "abc_lunch.large.webp"
@@ -1,8 +1,10 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from main import app
 from models import User
+from cache import LunchCache
+from meals import Meal
 
 client = TestClient(app)
 
@@ -10,8 +12,11 @@ client = TestClient(app)
 def mock_get_current_user():
     return User(id=1, edupage_username="testuser", edupage_session_data=b"mockdata")
 
-def mock_get_db():
-    db = MagicMock()
+async def mock_get_db():
+    # Every query returns no rows
+    db = AsyncMock()
+    db.execute.return_value = MagicMock(all=MagicMock(return_value=[]))
+    db.add = MagicMock()
     yield db
 
 @pytest.fixture
@@ -19,37 +24,29 @@ def override_auth_and_db():
     """Overrides dependencies for auth and db"""
     app.dependency_overrides = {}
     
-    from routers.lunches import get_current_user, get_db
+    from routers.lunches import get_current_user, get_async_db
     app.dependency_overrides[get_current_user] = mock_get_current_user
-    app.dependency_overrides[get_db] = mock_get_db
+    app.dependency_overrides[get_async_db] = mock_get_db
 
     yield
     app.dependency_overrides = {}
 
-@patch("routers.lunches.lunch_cache")
-@patch("routers.lunches.get_client")
+@patch("routers.lunches.lunch_cache", new_callable=LunchCache)
+@patch("routers.lunches.get_async_client")
 def test_get_lunches_success(mock_get_client, mock_cache, override_auth_and_db):
-    # Mock cache miss
-    mock_cache.get.return_value = None
-    
-    # Mock database session
-    mock_db = next(mock_get_db())
-    # Mock the chain db.query(...).filter(...).scalar() or .all()
-    # We can just make it return None/empty for ratings/photos
-    mock_db.query.return_value.filter.return_value.scalar.return_value = None
-    mock_db.query.return_value.filter.return_value.all.return_value = []
+    # Empty cache -> cache miss; the mocked db returns no ratings/photos
     mock_edupage_client = MagicMock()
     mock_get_client.return_value = mock_edupage_client
     
     # Mock return from get_meals_for_date
-    mock_edupage_client.get_meals_for_date.return_value = {
-        "2026-01-01": {
+    mock_edupage_client.get_meals_for_date = AsyncMock(return_value={
+        "2026-01-01": Meal.from_dict({
             "date": "2026-01-01",
             "menus": [{"name": "Tasty Lunch", "number": "1"}],
             "ordered_meal": "A",
             "can_be_changed_until": None
-        }
-    }
+        })
+    })
 
     # Make request
     response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
@@ -60,15 +57,562 @@ def test_get_lunches_success(mock_get_client, mock_cache, override_auth_and_db):
     assert data[0]['name'] == "Tasty Lunch"
     assert data[0]['is_ordered'] is True # Meal A is index 0 -> ordered
 
-@patch("routers.lunches.lunch_cache")
-@patch("routers.lunches.get_client")
+@patch("routers.lunches.lunch_cache", new_callable=LunchCache)
+@patch("routers.lunches.get_async_client")
 def test_get_lunches_not_logged_in(mock_get_client, mock_cache, override_auth_and_db):
     from edupage_internal import NotLoggedInException
     
-    mock_cache.get.return_value = None
-    mock_get_client.return_value.get_meals_for_date.side_effect = NotLoggedInException()
+    mock_get_client.return_value.get_meals_for_date = AsyncMock(side_effect=NotLoggedInException())
     
     response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
     
     assert response.status_code == 401
     assert "Session expired" in response.json()['detail']
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """
+    Real SQLite database wired into the lunches router through the async (aiosqlite)
+    engine. TestingSession is a sync session on the same file, for setup and checks.
+    """
+    import asyncio
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from database import Base
+    from routers.lunches import get_current_user, get_async_db
+
+    path = tmp_path / "test.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncTestingSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    async def override_get_db():
+        async with AsyncTestingSession() as db:
+            yield db
+
+    app.dependency_overrides[get_current_user] = mock_get_current_user
+    app.dependency_overrides[get_async_db] = override_get_db
+
+    yield TestingSession, statements
+    app.dependency_overrides = {}
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
+
+
+@patch("routers.lunches.lunch_cache")
+def test_get_lunches_query_count_independent_of_menu_count(mock_cache, sqlite_db):
+    from models import Rating, Photo
+    from rating_stats import backfill_rating_stats
+    TestingSession, statements = sqlite_db
+
+    db = TestingSession()
+    for n in range(7):
+        db.add(Rating(user_id=1, meal_identifier=f"Meal {n}", stars=4))
+        db.add(Rating(user_id=2, meal_identifier=f"Meal {n}", stars=2))
+        db.add(Photo(user_id=2, meal_identifier=f"Meal {n}", photo_path=f"uploads/meal{n}.jpg"))
+    db.commit()
+    backfill_rating_stats(db.connection())
+    db.commit()
+    db.close()
+
+    def request_with_menus(count):
+        mock_cache.aget = AsyncMock(return_value=Meal.from_dict({
+            "date": "2026-01-01",
+            "menus": [{"name": f"Meal {n}", "number": str(n + 1)} for n in range(count)],
+            "ordered_meal": None,
+            "can_be_changed_until": None
+        }))
+        statements.clear()
+        response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
+        assert response.status_code == 200
+        return response.json(), len(statements)
+
+    single, single_count = request_with_menus(1)
+    full, full_count = request_with_menus(7)
+
+    assert len(single) == 1
+    assert len(full) == 7
+    assert full_count == single_count
+    assert full[3]["avg_rating"] == 3.0
+    assert full[3]["user_rating"] == 4
+    assert full[3]["photos"] == ["/uploads/meal3.jpg"]
+    assert full[3]["user_has_photo"] is False
+
+
+@patch("routers.lunches.get_async_client")
+def test_get_week_lunches_single_fetch(mock_get_client, sqlite_db):
+    TestingSession, statements = sqlite_db
+
+    mock_get_client.return_value.get_meals_for_date = AsyncMock(return_value={
+        f"2026-01-0{d}": Meal.from_dict({
+            "date": f"2026-01-0{d}",
+            "menus": [{"name": f"Soup {d}", "number": None}, {"name": f"Meal {d}", "number": "1"}],
+            "ordered_meal": "A",
+            "can_be_changed_until": None
+        })
+        for d in range(5, 10)
+    })
+
+    with patch("routers.lunches.lunch_cache", LunchCache()):
+        response = client.get("/api/lunches/week?day=2026-01-07", headers={"user-id": "1"})
+        assert response.status_code == 200
+        data = response.json()
+        assert list(data) == ["2026-01-05", "2026-01-06", "2026-01-07", "2026-01-08", "2026-01-09"]
+        assert data["2026-01-08"][1]["name"] == "Meal 8"
+        assert data["2026-01-08"][1]["is_ordered"] is True
+
+        # Days of the fetched week are now served from cache
+        response = client.get("/api/lunches/?day=2026-01-09", headers={"user-id": "1"})
+        assert response.json()[1]["name"] == "Meal 9"
+
+    assert mock_get_client.return_value.get_meals_for_date.call_count == 1
+
+
+@patch("routers.lunches.get_async_client")
+def test_lunch_listing_etag_skips_enrichment_until_a_write(mock_get_client, sqlite_db):
+    TestingSession, statements = sqlite_db
+    meal = Meal.from_dict({
+        "date": "2026-01-01", "menus": [{"name": "Tasty Lunch", "number": "1"}], "ordered_meal": None
+    })
+    cache = LunchCache()
+    cache.set(1, "myschool", "2026-01-01", meal)
+
+    def get(etag=None):
+        statements.clear()
+        headers = {"user-id": "1"}
+        if etag:
+            headers["If-None-Match"] = etag
+        return client.get("/api/lunches/?day=2026-01-01", headers=headers)
+
+    with patch("routers.lunches.lunch_cache", cache):
+        first = get()
+        assert first.status_code == 200
+        etag = first.headers["etag"]
+        assert get().headers["etag"] == etag  # stable while nothing changes
+
+        not_modified = get(etag)
+        assert not_modified.status_code == 304
+        assert not_modified.headers["etag"] == etag
+        assert not any("ratings" in s or "photos" in s for s in statements)
+
+        # A rating changes the listing
+        client.post("/api/social/rate", json={"meal_identifier": "Tasty Lunch", "stars": 4}, headers={"user-id": "1"})
+        rated = get(etag)
+        assert rated.status_code == 200
+        assert rated.json()[0]["user_rating"] == 4
+        assert rated.headers["etag"] != etag
+
+        # So does the user's order, even if the menu comes back identical
+        mock_get_client.return_value.order = AsyncMock()
+        assert client.post("/api/lunches/order?meal_index=1&day=2026-01-01", headers={"user-id": "1"}).status_code == 200
+        cache.set(1, "myschool", "2026-01-01", meal)
+        assert get(rated.headers["etag"]).status_code == 200
+
+
+@patch("routers.lunches.get_async_client")
+def test_order_succeeds_and_invalidates_when_bookkeeping_fails(mock_get_client, sqlite_db):
+    meal = Meal.from_dict({
+        "date": "2026-01-01", "menus": [{"name": "Tasty Lunch", "number": "1"}], "ordered_meal": None
+    })
+    cache = LunchCache()
+    cache.set(1, "myschool", "2026-01-01", meal)
+    mock_get_client.return_value.order = AsyncMock()
+
+    with patch("routers.lunches.lunch_cache", cache), \
+            patch("routers.lunches.bump_versions", AsyncMock(side_effect=RuntimeError("db down"))):
+        response = client.post("/api/lunches/order?meal_index=1&day=2026-01-01", headers={"user-id": "1"})
+
+    assert response.status_code == 200
+    assert response.json() == {"message": "Ordered"}
+    assert cache.get(1, "2026-01-01") is None
+
+
+@patch("routers.lunches.get_async_client")
+def test_failing_upstream_success_write_does_not_fail_the_fetch(mock_get_client, sqlite_db):
+    mock_get_client.return_value.get_meals_for_date = AsyncMock(return_value={"2026-01-01": Meal.from_dict({
+        "date": "2026-01-01", "menus": [{"name": "Tasty Lunch", "number": "1"}], "ordered_meal": None
+    })})
+    failing_write = AsyncMock(side_effect=RuntimeError("db down"))
+
+    with patch("routers.lunches.lunch_cache", LunchCache()), patch("routers.lunches._update_user", failing_write):
+        response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
+
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "Tasty Lunch"
+    assert failing_write.called
+
+
+def test_lunch_listing_etag_covers_the_change_deadline(sqlite_db):
+    from datetime import datetime
+
+    def listing(deadline):
+        cache = LunchCache()
+        cache.set(1, "myschool", "2026-01-01", Meal.from_dict({
+            "date": "2026-01-01", "menus": [{"name": "Tasty Lunch", "number": "1"}], "ordered_meal": "A",
+            "can_be_changed_until": deadline,
+        }))
+        with patch("routers.lunches.lunch_cache", cache):
+            response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
+        assert response.status_code == 200
+        return response.headers["etag"]
+
+    first = listing(datetime(2025, 12, 31, 14))
+    assert listing(datetime(2025, 12, 31, 14)) == first
+    assert listing(datetime(2025, 12, 31, 10)) != first
+
+
+@patch("routers.lunches.get_async_client")
+def test_week_listing_etag(mock_get_client, sqlite_db):
+    mock_get_client.return_value.get_meals_for_date = AsyncMock(return_value={
+        f"2026-01-0{d}": Meal.from_dict({
+            "date": f"2026-01-0{d}", "menus": [{"name": f"Meal {d}", "number": "1"}], "ordered_meal": None
+        })
+        for d in range(5, 10)
+    })
+
+    with patch("routers.lunches.lunch_cache", LunchCache()):
+        first = client.get("/api/lunches/week?day=2026-01-07", headers={"user-id": "1"})
+        etag = first.headers["etag"]
+        # Distinct from the single day listing's
+        day = client.get("/api/lunches/?day=2026-01-07", headers={"user-id": "1"})
+        assert day.headers["etag"] != etag
+
+        headers = {"user-id": "1", "If-None-Match": etag}
+        assert client.get("/api/lunches/week?day=2026-01-07", headers=headers).status_code == 304
+        client.post("/api/social/rate", json={"meal_identifier": "Meal 9", "stars": 5}, headers={"user-id": "1"})
+        assert client.get("/api/lunches/week?day=2026-01-07", headers=headers).status_code == 200
+
+
+def test_cached_identity_makes_no_user_queries_on_lunch_cache_hits(sqlite_db):
+    from identity import get_current_user, identity_cache
+    from session_manager import clear_session
+    TestingSession, statements = sqlite_db
+    del app.dependency_overrides[get_current_user]
+    identity_cache.clear()
+
+    db = TestingSession()
+    db.add(User(id=1, edupage_username="testuser", edupage_session_data="state"))
+    db.commit()
+    db.close()
+
+    cache = LunchCache()
+    cache.set(1, "myschool", "2026-01-01", Meal.from_dict({
+        "date": "2026-01-01", "menus": [{"name": "Tasty Lunch", "number": "1"}], "ordered_meal": "A"
+    }))
+
+    def user_queries():
+        statements.clear()
+        response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
+        assert response.status_code == 200
+        assert response.json()[0]["is_ordered"] is True
+        return [s for s in statements if "FROM users" in s]
+
+    with patch("routers.lunches.lunch_cache", cache):
+        assert len(user_queries()) == 1
+        assert user_queries() == []
+        assert user_queries() == []
+
+        # Clearing the session (logout/expiry) drops the cached identity
+        clear_session(1)
+        assert len(user_queries()) == 1
+
+    identity_cache.clear()
+
+
+def test_stale_cached_identity_is_reread_after_a_login_on_another_worker(sqlite_db, monkeypatch):
+    import session_manager
+    from edupage_internal import AsyncEdupageClient, EdupageClient, NotLoggedInException
+    from identity import get_current_user, identity_cache
+    TestingSession, statements = sqlite_db
+    del app.dependency_overrides[get_current_user]
+    identity_cache.clear()
+    monkeypatch.setattr(session_manager, "_sessions", session_manager.OrderedDict())
+    monkeypatch.setattr(session_manager, "_async_sessions", {})
+
+    # This worker cached the user while logged out; another worker has since stored a login
+    identity_cache.set(User(id=1, edupage_username="testuser", edupage_session_data=None))
+    edupage = EdupageClient()
+    edupage.subdomain, edupage.username, edupage.is_logged_in = "myschool", "testuser", True
+    db = TestingSession()
+    db.add(User(id=1, edupage_username="testuser", edupage_session_data=session_manager.serialize_session(edupage)))
+    db.commit()
+    db.close()
+
+    week = {"2026-01-01": Meal.from_dict({
+        "date": "2026-01-01", "menus": [{"name": "Tasty Lunch", "number": "1"}], "ordered_meal": None
+    })}
+
+    async def get_meals_for_date(self, target_date):
+        if not self.is_logged_in:
+            raise NotLoggedInException()
+        return week
+
+    with patch("routers.lunches.lunch_cache", LunchCache()), \
+            patch.object(AsyncEdupageClient, "get_meals_for_date", get_meals_for_date):
+        response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
+
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "Tasty Lunch"
+    assert identity_cache.get(1).edupage_session_data is not None
+    identity_cache.clear()
+
+
+@pytest.mark.parametrize("stored, cleared", [(b"mockdata", True), (b"fresh login", False)])
+@patch("routers.lunches.clear_session")
+@patch("routers.lunches.get_async_client")
+def test_expired_session_is_cleared_only_if_still_stored(mock_get_client, mock_clear_session, sqlite_db, stored, cleared):
+    from edupage_internal import SessionExpiredException
+    TestingSession, statements = sqlite_db
+    db = TestingSession()
+    db.add(User(id=1, edupage_username="testuser", edupage_session_data=stored))
+    db.commit()
+    mock_get_client.return_value.get_meals_for_date = AsyncMock(side_effect=SessionExpiredException())
+
+    with patch("routers.lunches.lunch_cache", LunchCache()):
+        response = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"})
+
+    assert response.status_code == 401
+    db.expire_all()
+    assert db.get(User, 1).edupage_session_data == (None if cleared else stored)
+    assert mock_clear_session.called == cleared
+    db.close()
+
+
+def test_rate_lunch_updates_existing_rating_and_totals(sqlite_db):
+    from models import Rating, MealRatingStats
+    from rating_stats import backfill_rating_stats
+    TestingSession, statements = sqlite_db
+    db = TestingSession()
+    db.add(Rating(user_id=2, meal_identifier="Soup", stars=2))
+    db.commit()
+    backfill_rating_stats(db.connection())
+    db.commit()
+
+    for stars in (3, 5):
+        response = client.post("/api/social/rate", json={"meal_identifier": "Soup", "stars": stars}, headers={"user-id": "1"})
+        assert response.status_code == 200
+    response = client.post("/api/social/rate", json={"meal_identifier": "Pasta", "stars": 4}, headers={"user-id": "1"})
+    assert response.status_code == 200
+
+    assert sorted((r.user_id, r.meal_identifier, r.stars) for r in db.query(Rating).all()) == [
+        (1, "Pasta", 4), (1, "Soup", 5), (2, "Soup", 2)
+    ]
+    totals = {s.meal_identifier: (s.rating_count, s.rating_sum) for s in db.query(MealRatingStats).all()}
+    assert totals == {"Soup": (2, 7), "Pasta": (1, 4)}
+
+    # The incrementally kept totals match a rebuild from the ratings
+    backfill_rating_stats(db.connection())
+    db.commit()
+    assert {s.meal_identifier: (s.rating_count, s.rating_sum) for s in db.query(MealRatingStats).all()} == totals
+    db.close()
+
+
+def test_rate_lunch_rejects_out_of_range_stars(sqlite_db):
+    from models import Rating
+    TestingSession, statements = sqlite_db
+
+    for stars in (0, -1, 5.5):
+        response = client.post("/api/social/rate", json={"meal_identifier": "Soup", "stars": stars}, headers={"user-id": "1"})
+        assert response.status_code == 422
+    assert client.post("/api/social/rate", json={"meal_identifier": "Soup", "stars": 5}, headers={"user-id": "1"}).status_code == 200
+
+    db = TestingSession()
+    assert [r.stars for r in db.query(Rating).all()] == [5]
+    db.close()
+
+
+def test_rate_batch_applies_valid_items_and_reports_invalid_ones(sqlite_db):
+    from models import Rating, MealRatingStats
+    from rating_stats import backfill_rating_stats
+    TestingSession, statements = sqlite_db
+    db = TestingSession()
+    db.add(Rating(user_id=2, meal_identifier="Soup", stars=2))
+    db.add(Rating(user_id=1, meal_identifier="Soup", stars=1))
+    db.commit()
+    backfill_rating_stats(db.connection())
+    db.commit()
+
+    statements.clear()
+    response = client.post("/api/social/rate/batch", json=[
+        {"meal_identifier": "Soup", "stars": 4},
+        {"meal_identifier": "Pasta", "stars": 9},
+        {"stars": 3},
+        {"meal_identifier": "Pasta", "stars": 3.5},
+        "Rice",
+        {"meal_identifier": "Rice", "stars": 5},
+    ], headers={"user-id": "1"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["rated"] == 3
+    assert [(r["index"], r["status"]) for r in body["results"]] == [
+        (0, "ok"), (1, "error"), (2, "error"), (3, "ok"), (4, "error"), (5, "ok")
+    ]
+    assert body["results"][1]["detail"].startswith("stars:")
+    assert body["results"][2]["detail"].startswith("meal_identifier:")
+    # For the whole batch: one insert of the new ratings, one read and one update of the
+    # changed one, one totals delta and one version bump
+    assert len([s for s in statements if s.startswith("INSERT")]) == 3
+    assert len([s for s in statements if s.startswith(("SELECT", "UPDATE"))]) == 2
+
+    assert sorted((r.user_id, r.meal_identifier, r.stars) for r in db.query(Rating).all()) == [
+        (1, "Pasta", 3.5), (1, "Rice", 5), (1, "Soup", 4), (2, "Soup", 2)
+    ]
+    totals = {s.meal_identifier: (s.rating_count, s.rating_sum) for s in db.query(MealRatingStats).all()}
+    assert totals == {"Soup": (2, 6), "Pasta": (1, 3.5), "Rice": (1, 5)}
+    db.close()
+
+
+def test_rate_batch_rejects_oversized_batches(override_auth_and_db):
+    from routers.social import RATE_BATCH_MAX
+    items = [{"meal_identifier": f"Meal {n}", "stars": 3} for n in range(RATE_BATCH_MAX + 1)]
+
+    response = client.post("/api/social/rate/batch", json=items, headers={"user-id": "1"})
+
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def local_uploads(sqlite_db, tmp_path, monkeypatch):
+    """LocalStorage in tmp_path for the photo routes, variant task and deletion drain."""
+    import database
+    import storage
+    local = storage.LocalStorage(upload_dir=str(tmp_path / "uploads"))
+    monkeypatch.setattr(storage, "get_storage_service", lambda: local)
+    monkeypatch.setattr("routers.social.get_storage_service", lambda: local)
+    monkeypatch.setattr("routers.lunches.get_storage_service", lambda: local)
+    # The background task and the drain write through the sync session factory
+    monkeypatch.setattr(database, "SessionLocal", sqlite_db[0])
+    return tmp_path / "uploads"
+
+
+@patch("routers.lunches.lunch_cache")
+def test_uploaded_photo_gets_variants_and_listing_serves_thumbnails(mock_cache, sqlite_db, local_uploads):
+    import hashlib
+    import io
+    from PIL import Image
+    from models import Photo
+    TestingSession, statements = sqlite_db
+    uploads = local_uploads
+
+    upload = io.BytesIO()
+    Image.new("RGB", (3000, 2000), (10, 120, 200)).save(upload, "JPEG")
+    response = client.post(
+        "/api/social/upload",
+        data={"meal_identifier": "Soup"},
+        files={"file": ("lunch.jpg", upload.getvalue(), "image/jpeg")},
+        headers={"user-id": "1"},
+    )
+    assert response.status_code == 200
+
+    db = TestingSession()
+    photo = db.query(Photo).one()
+    digest = hashlib.sha256(upload.getvalue()).hexdigest()
+    assert photo.photo_path == f"{digest}.jpg"
+    assert photo.thumbnail_path == f"{digest}.thumbnail.webp"
+    assert photo.large_path == f"{digest}.large.webp"
+    assert (uploads / photo.thumbnail_path).stat().st_size < (uploads / photo.photo_path).stat().st_size
+    db.close()
+
+    mock_cache.aget = AsyncMock(return_value=Meal.from_dict({
+        "date": "2026-01-01", "menus": [{"name": "Soup", "number": "1"}],
+        "ordered_meal": None, "can_be_changed_until": None
+    }))
+    item = client.get("/api/lunches/?day=2026-01-01", headers={"user-id": "1"}).json()[0]
+    assert item["photos"] == [f"/uploads/{photo.thumbnail_path}"]
+    assert item["photos_large"] == [f"/uploads/{photo.large_path}"]
+    item = client.get("/api/lunches/?day=2026-01-01&photo_size=original", headers={"user-id": "1"}).json()[0]
+    assert item["photos"] == [f"/uploads/{photo.photo_path}"]
+    assert client.get("/api/lunches/?day=2026-01-01&photo_size=huge", headers={"user-id": "1"}).status_code == 400
+
+    # Deleting the photo queues the original and its variants; the outbox drain removes them
+    from storage_outbox import drain_deletions
+    assert client.post("/api/social/delete_photo", json={"meal_identifier": "Soup"}, headers={"user-id": "1"}).status_code == 200
+    assert len(list(uploads.iterdir())) == 3
+    assert drain_deletions()["deleted"] == 3
+    assert list(uploads.iterdir()) == []
+
+
+def test_identical_uploads_share_one_object_until_the_last_reference_goes(sqlite_db, local_uploads):
+    import io
+    from PIL import Image
+    from models import Photo, StoredObject
+    from storage_outbox import drain_deletions
+    from routers.social import get_current_user
+    TestingSession, statements = sqlite_db
+    uploads = local_uploads
+
+    image = io.BytesIO()
+    Image.new("RGB", (800, 600), (90, 30, 60)).save(image, "JPEG")
+
+    def as_user(user_id, method, url, **kwargs):
+        app.dependency_overrides[get_current_user] = lambda: User(id=user_id)
+        response = getattr(client, method)(url, headers={"user-id": str(user_id)}, **kwargs)
+        assert response.status_code == 200
+        return response
+
+    for user_id in (1, 1, 2):  # a retried upload, then another user with the same picture
+        as_user(user_id, "post", "/api/social/upload", data={"meal_identifier": "Soup"},
+                files={"file": ("IMG_0001.JPG", image.getvalue(), "image/jpeg")})
+
+    db = TestingSession()
+    photos = db.query(Photo).order_by(Photo.user_id).all()
+    assert [p.user_id for p in photos] == [1, 2]
+    assert photos[0].photo_path == photos[1].photo_path
+    assert (photos[1].thumbnail_path, photos[1].large_path) == (photos[0].thumbnail_path, photos[0].large_path)
+    assert db.get(StoredObject, photos[0].photo_path).refcount == 2
+    assert len(list(uploads.iterdir())) == 3  # original + two variants
+    db.close()
+
+    as_user(1, "post", "/api/social/delete_photo", json={"meal_identifier": "Soup"})
+    drain_deletions()
+    assert len(list(uploads.iterdir())) == 3
+
+    as_user(2, "post", "/api/social/delete_photo", json={"meal_identifier": "Soup"})
+    assert drain_deletions()["deleted"] == 3
+    assert list(uploads.iterdir()) == []
+
+
+def test_failed_variant_build_leaves_partial_variants_to_the_object(sqlite_db, local_uploads, monkeypatch):
+    import io
+    from PIL import Image
+    from models import Photo, StorageDeletion
+    from storage_outbox import drain_deletions
+    import storage
+    TestingSession, statements = sqlite_db
+    uploads = local_uploads
+
+    local = storage.get_storage_service()
+    save = local.save
+
+    def failing_save(file_obj, filename):
+        if filename.endswith(".thumbnail.webp"):
+            raise OSError("disk full")
+        return save(file_obj, filename)
+
+    monkeypatch.setattr(local, "save", failing_save)
+    image = io.BytesIO()
+    Image.new("RGB", (800, 600), (90, 30, 60)).save(image, "JPEG")
+    response = client.post("/api/social/upload", data={"meal_identifier": "Soup"},
+                           files={"file": ("lunch.jpg", image.getvalue(), "image/jpeg")}, headers={"user-id": "1"})
+    assert response.status_code == 200
+
+    db = TestingSession()
+    photo = db.query(Photo).one()
+    assert photo.large_path is None
+    assert db.query(StorageDeletion).count() == 0
+    assert len(list(uploads.iterdir())) == 2  # original + the large variant saved before the failure
+    db.close()
+
+    # The partial variant goes with the object's last reference
+    assert client.post("/api/social/delete_photo", json={"meal_identifier": "Soup"}, headers={"user-id": "1"}).status_code == 200
+    drain_deletions()
+    assert list(uploads.iterdir()) == []
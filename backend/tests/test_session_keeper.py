@@ -0,0 +1,185 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import session_keeper
+from database import Base
+from edupage_internal import SessionExpiredException
+from models import User
+
+
+@pytest.fixture
+def keeper_db(monkeypatch, tmp_path):
+    # A file, so the ping threads clearing sessions each get their own connection
+    engine = create_engine(f"sqlite:///{tmp_path / 'keeper.db'}")
+    Base.metadata.create_all(bind=engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(session_keeper, "SessionLocal", TestingSession)
+    monkeypatch.setattr(session_keeper, "KEEP_ALIVE_SPREAD_FRACTION", 0)
+    monkeypatch.setattr(session_keeper, "idle_threshold_minutes", 20.0)
+    monkeypatch.setattr(session_keeper, "idle_ceiling_minutes", session_keeper.KEEP_ALIVE_MAX_IDLE_MINUTES)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    return TestingSession, statements
+
+
+def test_ping_cycle_is_concurrent_bounded_and_clears_expired_sessions(keeper_db, monkeypatch):
+    TestingSession, statements = keeper_db
+    db = TestingSession()
+    for n in range(12):
+        db.add(User(edupage_username=f"user{n}", edupage_session_data="state"))
+    db.commit()
+    db.close()
+
+    monkeypatch.setattr(session_keeper, "KEEP_ALIVE_CONCURRENCY", 3)
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, max
+
+    def make_client(user):
+        client = MagicMock()
+
+        def ping(_):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+            if user.id % 4 == 0:
+                raise SessionExpiredException()
+            if user.id == 5:
+                raise ConnectionError("timeout")
+
+        client.get_meals_for_date.side_effect = ping
+        return client
+
+    commits = []
+    event.listen(session_keeper.SessionLocal.kw["bind"], "commit", lambda conn: commits.append(1))
+    statements.clear()
+    with patch("session_keeper.get_client", side_effect=make_client), patch("session_keeper.clear_session") as clear:
+        session_keeper.ping_all_sessions()
+
+    assert in_flight[1] == 3
+    stats = session_keeper.last_cycle_stats
+    assert (stats["pinged"], stats["alive"], stats["expired"], stats["error"]) == (12, 8, 3, 1)
+    assert sorted(c.args[0] for c in clear.call_args_list) == [4, 8, 12]
+    # Expired sessions (one conditional UPDATE each) and refreshed activity timestamps
+    # are written in a single commit at the end of the cycle
+    assert len([s for s in statements if s.startswith("UPDATE")]) == 4
+    assert len(commits) == 1
+
+    db = TestingSession()
+    cleared = db.query(User.id).filter(User.edupage_session_data.is_(None)).all()
+    assert sorted(row[0] for row in cleared) == [4, 8, 12]
+    db.close()
+
+
+def test_expiry_does_not_wipe_a_session_renewed_during_the_cycle(keeper_db):
+    TestingSession, _ = keeper_db
+    db = TestingSession()
+    db.add(User(id=1, edupage_username="relogged", edupage_session_data="old"))
+    db.add(User(id=2, edupage_username="gone", edupage_session_data="old"))
+    db.commit()
+    db.close()
+
+    def make_client(user):
+        client = MagicMock()
+        client.check_session_alive.return_value = False
+        if user.id == 1:
+            # The user logs in again while the keeper pings the old session
+            db = TestingSession()
+            db.get(User, 1).edupage_session_data = "new"
+            db.commit()
+            db.close()
+        return client
+
+    with patch("session_keeper.get_client", side_effect=make_client), patch("session_keeper.clear_session") as clear:
+        session_keeper.ping_all_sessions()
+
+    assert [c.args[0] for c in clear.call_args_list] == [2]
+    db = TestingSession()
+    assert {u.id: u.edupage_session_data for u in db.query(User)} == {1: "new", 2: None}
+    db.close()
+
+
+def test_ping_schedule_spreads_pings_across_window():
+    offsets = session_keeper._ping_schedule(4, 100)
+
+    assert len(offsets) == 4
+    for i, offset in enumerate(offsets):
+        assert i * 25 <= offset <= (i + 1) * 25
+
+
+def test_recently_active_sessions_are_not_pinged(keeper_db):
+    TestingSession, _ = keeper_db
+    now = datetime.utcnow()
+    db = TestingSession()
+    db.add(User(edupage_username="active", edupage_session_data="state", last_upstream_success_at=now - timedelta(minutes=3)))
+    db.add(User(edupage_username="idle", edupage_session_data="state", last_upstream_success_at=now - timedelta(minutes=45)))
+    db.add(User(edupage_username="unknown", edupage_session_data="state"))
+    db.add(User(edupage_username="logged_out", edupage_session_data=None))
+    db.commit()
+    db.close()
+
+    pinged = []
+
+    def get_client(user):
+        pinged.append(user.edupage_username)
+        return MagicMock()
+
+    with patch("session_keeper.get_client", side_effect=get_client):
+        session_keeper.ping_all_sessions()
+
+    assert sorted(pinged) == ["idle", "unknown"]
+    assert session_keeper.last_cycle_stats["skipped"] == 1
+
+    db = TestingSession()
+    idle = db.query(User).filter(User.edupage_username == "idle").one()
+    assert now - idle.last_upstream_success_at < timedelta(minutes=1)
+    db.close()
+
+
+def test_idle_threshold_adapts_to_expiries(monkeypatch):
+    monkeypatch.setattr(session_keeper, "idle_threshold_minutes", 40.0)
+    monkeypatch.setattr(session_keeper, "idle_ceiling_minutes", session_keeper.KEEP_ALIVE_MAX_IDLE_MINUTES)
+    monkeypatch.setattr(session_keeper, "KEEP_ALIVE_IDLE_MARGIN_MINUTES", 5)
+
+    # Clean cycle: creep up
+    session_keeper._adapt_idle_threshold([], any_alive=True)
+    assert session_keeper.idle_threshold_minutes == 42.0
+
+    # A session died after 50 idle minutes: stay two cycles below that
+    session_keeper._adapt_idle_threshold([50.0], any_alive=True)
+    assert session_keeper.idle_threshold_minutes == 21.0
+
+    # Clean cycles creep back up, but stop at the learned ceiling (50 - 10 - 5)
+    for _ in range(50):
+        session_keeper._adapt_idle_threshold([], any_alive=True)
+    assert session_keeper.idle_threshold_minutes == 35.0
+    assert session_keeper.idle_ceiling_minutes == 35.0
+
+    session_keeper._adapt_idle_threshold([12.0], any_alive=False)
+    assert session_keeper.idle_threshold_minutes == session_keeper.KEEP_ALIVE_MIN_IDLE_MINUTES
+
+
+def test_ping_uses_liveness_probe_before_full_fetch():
+    user = User(id=7, edupage_username="u", edupage_session_data="state")
+    client = MagicMock()
+
+    with patch("session_keeper.get_client", return_value=client):
+        client.check_session_alive.return_value = True
+        assert session_keeper._ping_user(user) == "alive"
+        client.check_session_alive.return_value = False
+        assert session_keeper._ping_user(user) == "expired"
+        client.get_meals_for_date.assert_not_called()
+
+        # Inconclusive probe falls back to the full menu fetch
+        client.check_session_alive.return_value = None
+        assert session_keeper._ping_user(user) == "alive"
+        client.get_meals_for_date.assert_called_once()
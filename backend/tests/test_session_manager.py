@@ -0,0 +1,132 @@
+import base64
+import pickle
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+import session_manager
+from database import Base
+from edupage_internal import EdupageClient
+from migrations import run_migrations
+from models import User
+
+
+@pytest.fixture(autouse=True)
+def empty_registry(monkeypatch):
+    monkeypatch.setattr(session_manager, "_sessions", session_manager.OrderedDict())
+    monkeypatch.setattr(session_manager, "_async_sessions", {})
+    monkeypatch.setattr(session_manager, "_last_used", {})
+
+
+def logged_in_client(subdomain="myschool"):
+    client = EdupageClient()
+    client.session.cookies.set("PHPSESSID", "abc123", domain=f"{subdomain}.edupage.org", path="/")
+    client.session.cookies.set("edid", "xyz", domain=".edupage.org", path="/", secure=True)
+    client.subdomain = subdomain
+    client.username = "student"
+    client.gsec_hash = "hash"
+    client.is_logged_in = True
+    return client
+
+
+def legacy_session_data(client):
+    """users.edupage_session_data as written by older versions."""
+    state = {
+        'cookies': client.session.cookies,
+        'subdomain': client.subdomain,
+        'username': client.username,
+        'gsec_hash': client.gsec_hash
+    }
+    return base64.b64encode(pickle.dumps(state)).decode('utf-8')
+
+
+def cookie_tuples(client):
+    return sorted((c.name, c.value, c.domain, c.path, c.secure) for c in client.session.cookies)
+
+
+def test_session_round_trips_through_json():
+    original = logged_in_client()
+    user = User(id=1)
+
+    session_manager.update_session(user, original)
+    assert user.edupage_session_data.startswith('{"v":1,')
+
+    session_manager.clear_session(1)
+    restored = session_manager.get_client(user)
+
+    assert restored is not original
+    assert restored.is_logged_in
+    assert (restored.subdomain, restored.username, restored.gsec_hash) == ("myschool", "student", "hash")
+    assert cookie_tuples(restored) == cookie_tuples(original)
+
+
+def test_request_paths_never_unpickle_session_data(monkeypatch):
+    unpickled = []
+    monkeypatch.setattr(pickle, "loads", lambda *args, **kwargs: unpickled.append(args))
+    user = User(id=1, edupage_session_data=legacy_session_data(logged_in_client()))
+
+    restored = session_manager.get_client(user)
+
+    # Not yet migrated: treated as no session (log in again), never unpickled
+    assert not restored.is_logged_in
+    assert unpickled == []
+
+
+def test_registry_evicts_least_recently_used_and_closes_it(monkeypatch):
+    monkeypatch.setattr(session_manager, "SESSION_REGISTRY_MAX", 2)
+    users = [User(id=n) for n in (1, 2, 3)]
+    clients = [logged_in_client() for _ in users]
+
+    with patch.object(EdupageClient, "close", autospec=True) as close:
+        session_manager.update_session(users[0], clients[0])
+        session_manager.update_session(users[1], clients[1])
+        session_manager.get_client(users[0])  # user 1 is now the most recently used
+        session_manager.update_session(users[2], clients[2])
+
+    close.assert_called_once_with(clients[1])
+    assert list(session_manager._sessions) == [1, 3]
+
+
+def test_idle_sessions_are_closed(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_manager.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(session_manager, "_last_idle_sweep", now[0])
+    idle, active = User(id=1), User(id=2)
+
+    with patch.object(EdupageClient, "close", autospec=True) as close:
+        session_manager.update_session(idle, logged_in_client())
+        session_manager.update_session(active, logged_in_client())
+        session_manager.get_async_client(idle)
+
+        now[0] += session_manager.SESSION_IDLE_TIMEOUT_SECONDS - 30
+        session_manager.get_client(active)
+        now[0] += 60
+        session_manager.get_client(active)
+
+    assert close.call_count == 1
+    assert list(session_manager._sessions) == [2]
+    assert 1 not in session_manager._async_sessions
+
+
+def test_startup_migration_converts_pickled_rows():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    original = logged_in_client()
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, edupage_username, edupage_session_data) VALUES (1, 'a', :d)"),
+                     {"d": legacy_session_data(original)})
+        conn.execute(text("INSERT INTO users (id, edupage_username, edupage_session_data) VALUES (2, 'b', 'garbage')"))
+        conn.execute(text("INSERT INTO users (id, edupage_username, edupage_session_data) VALUES (3, 'c', NULL)"))
+
+    run_migrations(engine)
+    run_migrations(engine)  # idempotent
+
+    with engine.connect() as conn:
+        rows = dict(conn.execute(text("SELECT id, edupage_session_data FROM users")).fetchall())
+    assert rows[1].startswith('{"v":1,')
+    assert rows[2] is None
+    assert rows[3] is None
+    restored = session_manager.get_client(User(id=1, edupage_session_data=rows[1]))
+    assert cookie_tuples(restored) == cookie_tuples(original)
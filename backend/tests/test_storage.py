@@ -0,0 +1,86 @@
+import io
+import os
+
+import pytest
+
+import storage
+from fake_object_store import FakeObjectStorageClient, FakeServiceError
+from storage import OCIStorage
+
+PART = 1024
+
+
+@pytest.fixture
+def fake_client():
+    return FakeObjectStorageClient()
+
+
+@pytest.fixture
+def oci_storage(fake_client):
+    return OCIStorage(client=fake_client, bucket_name="photos", region="eu-frankfurt-1", part_size=PART)
+
+
+def test_namespace_is_looked_up_once(fake_client, monkeypatch):
+    monkeypatch.delenv("OCI_NAMESPACE", raising=False)
+    instance = OCIStorage(client=fake_client, bucket_name="photos", region="eu-frankfurt-1")
+    instance.save(io.BytesIO(b"a"), "a.jpg")
+    instance.save(io.BytesIO(b"b"), "b.jpg")
+
+    assert fake_client.calls.count("get_namespace") == 1
+    assert instance.get_url("a.jpg") == "https://objectstorage.eu-frankfurt-1.oraclecloud.com/n/testns/b/photos/o/a.jpg"
+
+
+def test_small_upload_is_a_single_put(fake_client, oci_storage):
+    upload = io.BytesIO(b"x" * PART)
+    upload.read(10)  # saved from the start even if the caller read from it
+
+    assert oci_storage.save(upload, "abc_lunch.jpg") == "abc_lunch.jpg"
+
+    assert [c for c in fake_client.calls if c != "get_namespace"] == ["put_object"]
+    assert fake_client.objects[("photos", "abc_lunch.jpg")] == b"x" * PART
+    assert fake_client.content_types[("photos", "abc_lunch.jpg")] == "image/jpeg"
+
+
+def test_large_upload_streams_in_parts(fake_client, oci_storage):
+    data = os.urandom(PART * 3 + 100)
+
+    oci_storage.save(io.BytesIO(data), "big.webp")
+
+    assert fake_client.calls.count("upload_part") == 4
+    assert fake_client.calls[-1] == "commit_multipart_upload"
+    assert fake_client.largest_body == PART
+    assert fake_client.objects[("photos", "big.webp")] == data
+    assert fake_client.content_types[("photos", "big.webp")] == "image/webp"
+
+
+def test_failed_multipart_upload_is_aborted(fake_client, oci_storage):
+    fake_client.fail_on_part = 2
+
+    with pytest.raises(FakeServiceError):
+        oci_storage.save(io.BytesIO(os.urandom(PART * 3)), "big.jpg")
+
+    assert fake_client.aborted == ["upload-1"]
+    assert fake_client.uploads == {}
+    assert ("photos", "big.jpg") not in fake_client.objects
+
+
+def test_storage_service_is_shared_per_process(monkeypatch):
+    monkeypatch.setattr(storage, "_storage_service", None)
+    monkeypatch.setenv("STORAGE_TYPE", "oci")
+    created = []
+    monkeypatch.setattr(storage, "OCIStorage", lambda: created.append(1) or object())
+
+    first = storage.get_storage_service()
+
+    assert storage.get_storage_service() is first
+    assert len(created) == 1
+
+
+def test_delete_raises_on_failure_but_ignores_missing_objects(fake_client, oci_storage):
+    oci_storage.save(io.BytesIO(b"x"), "a.jpg")
+    oci_storage.delete("a.jpg")
+    oci_storage.delete("a.jpg")  # already gone: 404 is not an error
+
+    fake_client.delete_object = lambda *args, **kwargs: (_ for _ in ()).throw(FakeServiceError(503, "ServiceUnavailable"))
+    with pytest.raises(FakeServiceError):
+        oci_storage.delete("b.jpg")
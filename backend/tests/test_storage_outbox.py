@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database
+import storage
+import storage_outbox
+from database import Base
+from models import StorageDeletion
+
+
+class FlakyStorage:
+    """Deletes succeed except for paths listed in failing."""
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.deleted = []
+
+    def delete(self, filename):
+        if filename in self.failing:
+            raise ConnectionError("object storage unavailable")
+        self.deleted.append(filename)
+
+
+@pytest.fixture
+def outbox_db(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", TestingSession)
+    return TestingSession
+
+
+def queue(TestingSession, paths):
+    db = TestingSession()
+    storage_outbox.enqueue_deletions(db, paths)
+    db.commit()
+    db.close()
+
+
+def remaining(TestingSession):
+    db = TestingSession()
+    rows = {row.path: row for row in db.query(StorageDeletion).all()}
+    db.close()
+    return rows
+
+
+def test_drain_deletes_in_batches(outbox_db, monkeypatch):
+    fake = FlakyStorage()
+    monkeypatch.setattr(storage, "get_storage_service", lambda: fake)
+    monkeypatch.setattr(storage_outbox, "STORAGE_DELETE_BATCH_SIZE", 4)
+    queue(outbox_db, [f"uploads/{n}.jpg" for n in range(10)] + [None])
+
+    assert storage_outbox.drain_deletions() == {"deleted": 10, "retrying": 0, "failed": 0, "referenced": 0}
+    assert sorted(fake.deleted) == sorted(f"uploads/{n}.jpg" for n in range(10))
+    assert remaining(outbox_db) == {}
+
+
+def test_failed_delete_is_retried_with_backoff_then_parked(outbox_db, monkeypatch):
+    fake = FlakyStorage(failing={"uploads/stuck.jpg"})
+    monkeypatch.setattr(storage, "get_storage_service", lambda: fake)
+    monkeypatch.setattr(storage_outbox, "STORAGE_DELETE_MAX_ATTEMPTS", 3)
+    queue(outbox_db, ["uploads/stuck.jpg", "uploads/fine.jpg"])
+
+    assert storage_outbox.drain_deletions() == {"deleted": 1, "retrying": 1, "failed": 0, "referenced": 0}
+    entry = remaining(outbox_db)["uploads/stuck.jpg"]
+    assert entry.attempts == 1
+    assert "unavailable" in entry.last_error
+    assert entry.next_attempt_at > datetime.utcnow() + timedelta(seconds=20)
+
+    # Not due yet: nothing happens
+    assert storage_outbox.drain_deletions() == {"deleted": 0, "retrying": 0, "failed": 0, "referenced": 0}
+
+    def make_due():
+        db = outbox_db()
+        db.query(StorageDeletion).update({StorageDeletion.next_attempt_at: datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+        db.close()
+
+    make_due()
+    assert storage_outbox.drain_deletions()["retrying"] == 1
+    assert remaining(outbox_db)["uploads/stuck.jpg"].next_attempt_at > datetime.utcnow() + timedelta(seconds=50)
+    make_due()
+    assert storage_outbox.drain_deletions()["failed"] == 1
+
+    # Kept for inspection, no longer picked up
+    entry = remaining(outbox_db)["uploads/stuck.jpg"]
+    assert (entry.attempts, entry.next_attempt_at) == (3, None)
+    assert storage_outbox.drain_deletions() == {"deleted": 0, "retrying": 0, "failed": 0, "referenced": 0}
+
+
+def test_enqueue_rolls_back_with_the_row_change(outbox_db):
+    db = outbox_db()
+    storage_outbox.enqueue_deletions(db, ["uploads/a.jpg"])
+    db.rollback()
+    db.close()
+
+    assert remaining(outbox_db) == {}
+
+
+def test_content_objects_referenced_again_are_kept(outbox_db, monkeypatch):
+    from models import StoredObject
+    fake = FlakyStorage()
+    monkeypatch.setattr(storage, "get_storage_service", lambda: fake)
+    db = outbox_db()
+    # abc.jpg was released and then uploaded again before the drain; def.jpg is unreferenced
+    db.add_all([StoredObject(key="abc.jpg", refcount=1), StoredObject(key="def.jpg", refcount=0)])
+    storage_outbox.enqueue_deletions(db, ["abc.jpg", "abc.thumbnail.webp"], object_key="abc.jpg")
+    storage_outbox.enqueue_deletions(db, ["def.jpg"], object_key="def.jpg")
+    db.commit()
+    db.close()
+
+    assert storage_outbox.drain_deletions() == {"deleted": 1, "retrying": 0, "failed": 0, "referenced": 2}
+    assert fake.deleted == ["def.jpg"]
+    assert remaining(outbox_db) == {}
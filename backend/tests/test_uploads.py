@@ -0,0 +1,78 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from routers import uploads
+
+client = TestClient(app)
+
+CONTENT = bytes(range(256)) * 40
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", str(tmp_path))
+    (tmp_path / f"{DIGEST}.jpg").write_bytes(CONTENT)
+    (tmp_path / "1f0c_old photo.jpg").write_bytes(CONTENT)
+    return tmp_path
+
+
+def test_content_addressed_upload_is_immutable_with_strong_etag(upload_dir):
+    response = client.get(f"/uploads/{DIGEST}.jpg")
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["etag"] == f'"{DIGEST}.jpg"'
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+    revalidated = client.get(f"/uploads/{DIGEST}.jpg", headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+
+def test_legacy_upload_gets_stat_etag_and_short_max_age(upload_dir):
+    response = client.get("/uploads/1f0c_old photo.jpg")
+
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == f"public, max-age={uploads.LEGACY_UPLOAD_MAX_AGE}"
+    assert client.get("/uploads/1f0c_old photo.jpg", headers={"If-None-Match": f'W/"x", {response.headers["etag"]}'}).status_code == 304
+    assert client.get("/uploads/1f0c_old photo.jpg", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_range_requests(upload_dir):
+    response = client.get(f"/uploads/{DIGEST}.jpg", headers={"Range": "bytes=100-199"})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+    # If-Range with a stale validator sends the whole file
+    stale = client.get(f"/uploads/{DIGEST}.jpg", headers={"Range": "bytes=100-199", "If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+
+def test_head_and_missing_or_unsafe_names(upload_dir):
+    head = client.head(f"/uploads/{DIGEST}.jpg")
+    assert head.status_code == 200
+    assert head.headers["content-length"] == str(len(CONTENT))
+
+    assert client.get("/uploads/missing.jpg").status_code == 404
+    assert client.get("/uploads/..%2Fsecret").status_code == 404
+    assert client.get("/uploads/.hidden").status_code == 404
+
+
+def test_x_accel_redirect_mode_leaves_the_bytes_to_nginx(upload_dir, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOADS_X_ACCEL_PREFIX", "/protected-uploads/")
+
+    response = client.get("/uploads/1f0c_old photo.jpg")
+
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == "/protected-uploads/1f0c_old%20photo.jpg"
+    assert client.get(f"/uploads/{DIGEST}.jpg").headers["cache-control"] == uploads.IMMUTABLE_CACHE_CONTROL
+    assert client.get("/uploads/missing.jpg").status_code == 404